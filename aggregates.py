@@ -0,0 +1,235 @@
+import os
+import numpy as np
+import pandas as pd
+import snapshot
+import timeseries
+import utils
+
+LEVELS = ['Region', 'District', 'Suburb']
+SOURCE_COLUMNS = ['ListingId', 'StartDate', 'EndDate', 'Region', 'District', 'Suburb', 'Price', 'Bedrooms',
+                  'Bathrooms', 'PropertyType', 'ListingStatus', 'LastUpdatedAt']
+# Groups for listings with no Region, District, Suburb or PropertyType.
+MISSING_NAME = ''
+
+
+def get_aggregate_days():
+    return int(os.getenv('AGGREGATE_DAYS', 30))
+
+
+def get_price_bin_width():
+    return float(os.getenv('AGGREGATE_PRICE_BIN', 100000))
+
+
+def has_room_details(data):
+    # The dashboard's price, bedroom and bathroom sliders drop listings missing any of them, even at full range.
+    return (data['Price'].notna() & data['Bedrooms'].notna() & data['Bathrooms'].notna()).to_numpy()
+
+
+def price_bins(prices, bin_width):
+    return np.floor(np.asarray(prices, dtype=float) / bin_width) * bin_width
+
+
+def iter_groups(data):
+    yield 'All', 'All', data
+    for level in LEVELS:
+        names = data[level].astype(object).where(data[level].notna(), MISSING_NAME)
+        for name, group in data.groupby(names, sort=True):
+            yield level, name, group
+
+
+def started_median_prices(data, dates):
+    # Median price of the listings that had started by each date, whether or not they were still running: the
+    # median price bars bound listings by StartDate alone.
+    started = pd.DataFrame({'StartDate': data['StartDate'], 'EndDate': pd.Timestamp.max, 'Price': data['Price']})
+    return timeseries.daily_median_prices(started, dates)
+
+
+def sort_median_prices(median_price, column):
+    # Highest median first. A median can land an ulp away depending on whether it was taken in dollars or
+    # millions, so prices are compared to the cent and ties go by name.
+    order = np.lexsort((median_price[column].astype(str).to_numpy(), -np.round(median_price['Price'].to_numpy(), 8)))
+    return median_price.iloc[order].reset_index(drop=True)
+
+
+def build_daily_aggregates(data, dates):
+    # For every date and every Region, District and Suburb (plus 'All'): the listing count the dashboard plots,
+    # and the median price of the listings with a price, bedrooms and bathrooms that had started by that date.
+    rows = []
+    priced = pd.Series(has_room_details(data), index=data.index)
+    for level, name, group in iter_groups(data):
+        rows.append(pd.DataFrame({
+            'Date': dates,
+            'Level': level,
+            'Name': name,
+            'ActiveCount': timeseries.daily_listing_counts(group, dates),
+            'MedianPrice': started_median_prices(group[priced[group.index]], dates),
+        }))
+    return pd.concat(rows, ignore_index=True)
+
+
+def build_price_histogram(data, bin_width=None):
+    # Listings with a price, bedrooms and bathrooms, counted per PropertyType and fixed-width price bin.
+    bin_width = bin_width or get_price_bin_width()
+    priced = data[has_room_details(data)]
+    property_types = priced['PropertyType'].astype(object).where(priced['PropertyType'].notna(), MISSING_NAME)
+    bins = pd.Series(price_bins(priced['Price'], bin_width), index=priced.index)
+    histogram = priced.groupby([property_types, bins]).size().reset_index()
+    histogram.columns = ['PropertyType', 'BinStart', 'Count']
+    histogram['BinEnd'] = histogram['BinStart'] + bin_width
+    return histogram
+
+
+def to_rows(aggregate, source_updated_at):
+    aggregate = aggregate.astype(object).where(aggregate.notna(), None)
+    if 'Date' in aggregate:
+        aggregate['Date'] = [date.isoformat() for date in aggregate['Date']]
+    aggregate['SourceUpdatedAt'] = source_updated_at.isoformat()
+    return aggregate.to_dict('records')
+
+
+def publish_aggregates(supabase, days=None, end=None):
+    # Rebuilds DailyAggregates for the `days` days up to `end` (today) and PriceHistogram from the stored listings,
+    # then drops rows the rebuild didn't write. Every row carries the newest LastUpdatedAt it was built from.
+    days = days or get_aggregate_days()
+    end = pd.Timestamp(end) if end is not None else pd.Timestamp.now()
+    data = pd.DataFrame(utils.fetch_table(supabase, 'dash_view', columns=','.join(SOURCE_COLUMNS)),
+                        columns=SOURCE_COLUMNS)
+    for column in snapshot.DATE_COLUMNS:
+        data[column] = pd.to_datetime(data[column])
+    source_updated_at = data['LastUpdatedAt'].max()
+    if pd.isna(source_updated_at):
+        print('No listings to aggregate.')
+        return []
+    dates = pd.date_range(end=end.normalize(), periods=days, freq='D')
+    reports = [
+        utils.upsert_in_batches(supabase, 'DailyAggregates', to_rows(build_daily_aggregates(data, dates),
+                                                                      source_updated_at),
+                                on_conflict='Date,Level,Name'),
+        utils.upsert_in_batches(supabase, 'PriceHistogram', to_rows(build_price_histogram(data), source_updated_at),
+                                on_conflict='PropertyType,BinStart'),
+    ]
+    if not any(report.failed_batch_ids for report in reports):
+        for table in ['DailyAggregates', 'PriceHistogram']:
+            supabase.table(table).delete().lt('SourceUpdatedAt', source_updated_at.isoformat()).execute()
+        # A run that leaves the newest LastUpdatedAt where it was rewrites every row with the same SourceUpdatedAt,
+        # so the dates that have left the window are dropped by date as well.
+        supabase.table('DailyAggregates').delete().lt('Date', dates[0].isoformat()).execute()
+    return reports
+
+
+def get_aggregate_paths(path=None):
+    directory = os.path.dirname(path or snapshot.get_snapshot_path())
+    return os.path.join(directory, 'daily_aggregates.arrow'), os.path.join(directory, 'price_histogram.arrow')
+
+
+def fetch_aggregates(supabase):
+    daily = pd.DataFrame(utils.fetch_table(supabase, 'DailyAggregates', order=('Date', 'Level', 'Name')))
+    histogram = pd.DataFrame(utils.fetch_table(supabase, 'PriceHistogram', order=('PropertyType', 'BinStart')))
+    for aggregate, columns in [(daily, ['Date', 'SourceUpdatedAt']), (histogram, ['SourceUpdatedAt'])]:
+        for column in columns:
+            if column in aggregate:
+                aggregate[column] = pd.to_datetime(aggregate[column])
+    # The dashboard works in millions.
+    if 'MedianPrice' in daily:
+        daily['MedianPrice'] = daily['MedianPrice'].astype(float) / 1000000
+    for column in ['BinStart', 'BinEnd']:
+        if column in histogram:
+            histogram[column] = histogram[column].astype(float) / 1000000
+    return daily, histogram
+
+
+def fetch_max_source_updated_at(supabase):
+    return snapshot.fetch_latest(supabase, 'DailyAggregates', 'SourceUpdatedAt')
+
+
+def read_source_updated_at(path=None):
+    # The newest SourceUpdatedAt in the local copy of DailyAggregates, or None when there is none.
+    daily_path, _ = get_aggregate_paths(path)
+    if not os.path.exists(daily_path):
+        return None
+    return snapshot.read_snapshot(daily_path)['SourceUpdatedAt'].max()
+
+
+def aggregates_changed(supabase, path=None):
+    latest = fetch_max_source_updated_at(supabase)
+    return latest is not None and latest != read_source_updated_at(path)
+
+
+def load_aggregate_store(connect, data, path=None, refresh=False):
+    # Aggregates are only used when they were built from the same listings as the dashboard data; otherwise every
+    # figure is computed from raw rows. Local copies built from other listings are fetched again once, since the
+    # listings may have been reloaded between the last upsert and the aggregates being published.
+    daily_path, histogram_path = get_aggregate_paths(path)
+    try:
+        store = None
+        if not refresh and os.path.exists(daily_path) and os.path.exists(histogram_path):
+            store = AggregateStore(snapshot.read_snapshot(daily_path), snapshot.read_snapshot(histogram_path))
+        if store is None or store.source_updated_at != data['LastUpdatedAt'].max():
+            daily, histogram = fetch_aggregates(connect())
+            if daily.empty or histogram.empty:
+                print('No aggregate tables to load.')
+                return None
+            # The daily table goes last: watchers of a shared version reload when it changes.
+            snapshot.write_snapshot(histogram, histogram_path)
+            snapshot.write_snapshot(daily, daily_path)
+            store = AggregateStore(daily, histogram)
+    except Exception as e:
+        print(f'Could not load aggregate tables: {e}')
+        return None
+    if store.source_updated_at != data['LastUpdatedAt'].max():
+        print(f'Aggregates were built from data as of {store.source_updated_at}, not '
+              f'{data["LastUpdatedAt"].max()}; ignoring them.')
+        return None
+    return store
+
+
+class AggregateStore:
+    def __init__(self, daily, histogram):
+        source_updated_at = pd.concat([daily['SourceUpdatedAt'], histogram['SourceUpdatedAt']])
+        # A half-published rebuild mixes two versions; treat it as out of date.
+        self.source_updated_at = (source_updated_at.iloc[0] if source_updated_at.nunique() == 1 else None)
+        self.daily = {key: group.set_index('Date').sort_index()
+                      for key, group in daily.groupby(['Level', 'Name'])}
+        self.dates = pd.DatetimeIndex(daily.loc[daily['Level'] == 'All', 'Date']).sort_values()
+        # Per level, a date by name table of median prices. Local copies from before the column have none.
+        self.median_price_tables = {
+            level: daily[daily['Level'] == level].pivot(index='Date', columns='Name', values='MedianPrice')
+            for level in LEVELS} if 'MedianPrice' in daily else None
+        self.histogram = histogram
+
+    def covers(self, dates):
+        return len(dates) > 0 and bool(pd.DatetimeIndex(dates).isin(self.dates).all())
+
+    def listing_counts(self, level, names, dates):
+        if not self.covers(dates):
+            return None
+        counts = np.zeros(len(dates), dtype=np.int64)
+        for name in names:
+            if (level, name) in self.daily:
+                counts += self.daily[(level, name)]['ActiveCount'].reindex(dates).to_numpy(dtype=np.int64)
+        return counts
+
+    def median_prices(self, level, end_date):
+        # Shaped like median_price_by on the raw rows, for the listings started by `end_date`, which must be one
+        # of the dates, at midnight.
+        if self.median_price_tables is None or end_date not in self.dates:
+            return None
+        medians = self.median_price_tables[level].loc[end_date].astype(float)
+        medians = medians[(medians.index != MISSING_NAME) & medians.notna()]
+        return sort_median_prices(pd.DataFrame({level: medians.index.to_numpy(dtype=object),
+                                                'Price': medians.to_numpy()}), level)
+
+    def selected_bins(self, property_types):
+        if property_types is None:
+            return self.histogram
+        return self.histogram[self.histogram['PropertyType'].isin(property_types)]
+
+    def price_histogram(self, property_types):
+        histogram = self.selected_bins(property_types).groupby('BinStart')['Count'].sum()
+        return histogram.index.to_numpy(), histogram.to_numpy()
+
+    def property_type_counts(self, property_types):
+        # Shaped like PropertyType.value_counts().reset_index() on the raw rows.
+        counts = self.selected_bins(property_types).groupby('PropertyType')['Count'].sum()
+        counts = counts[(counts.index != MISSING_NAME) & (counts > 0)].sort_values(ascending=False)
+        return counts.rename('PropertyType').rename_axis(None).reset_index()
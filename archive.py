@@ -0,0 +1,176 @@
+import os
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import utils
+
+LISTING_COLUMNS = ['ListingId', 'Price', 'Region', 'District', 'Suburb', 'PropertyType', 'Bedrooms', 'Bathrooms']
+SCHEMA = pa.schema([
+    ('ListingId', pa.int64()),
+    ('Price', pa.float64()),
+    ('Region', pa.string()),
+    ('District', pa.string()),
+    ('Suburb', pa.string()),
+    ('PropertyType', pa.string()),
+    ('Bedrooms', pa.float32()),
+    ('Bathrooms', pa.float32()),
+    ('ListingStatus', pa.string()),
+    ('FirstSeen', pa.date32()),
+    ('LastSeen', pa.date32()),
+    ('PriceChanged', pa.bool_()),
+    ('PreviousPrice', pa.float64()),
+    ('StatusChanged', pa.bool_()),
+    ('PreviousStatus', pa.string()),
+])
+DICTIONARY_COLUMNS = ['Region', 'District', 'Suburb', 'PropertyType', 'ListingStatus', 'PreviousStatus']
+PARTITIONING = ds.partitioning(pa.schema([('run_date', pa.date32())]), flavor='hive')
+PARTITION_PREFIX = 'run_date='
+# Rows are sorted by ListingId, so row group statistics let a single-listing lookup skip most of each file.
+ROW_GROUP_SIZE = 32768
+
+
+def get_archive_path():
+    return os.getenv('LISTING_ARCHIVE_PATH', 'listing_archive')
+
+
+def to_date(value):
+    return pd.Timestamp(value).date()
+
+
+def get_partition_path(root, run_date):
+    return os.path.join(root, f'{PARTITION_PREFIX}{run_date.isoformat()}', 'part-0.parquet')
+
+
+def list_run_dates(root):
+    if not os.path.isdir(root):
+        return []
+    return sorted(to_date(name[len(PARTITION_PREFIX):]) for name in os.listdir(root)
+                  if name.startswith(PARTITION_PREFIX) and os.path.exists(os.path.join(root, name, 'part-0.parquet')))
+
+
+def read_partition(root, run_date, columns=None):
+    return pq.read_table(get_partition_path(root, run_date), columns=columns, schema=SCHEMA).to_pandas()
+
+
+def prepare_listings(data):
+    # Normalised batches hold None rather than NaN and may have object columns.
+    listings = data[LISTING_COLUMNS].drop_duplicates(subset=['ListingId'])
+    listings = pd.DataFrame({
+        'ListingId': listings['ListingId'].astype('int64').to_numpy(),
+        'Price': pd.to_numeric(listings['Price']).astype(float).to_numpy(),
+        'Region': listings['Region'].to_numpy(dtype=object),
+        'District': listings['District'].to_numpy(dtype=object),
+        'Suburb': listings['Suburb'].to_numpy(dtype=object),
+        'PropertyType': listings['PropertyType'].to_numpy(dtype=object),
+        'Bedrooms': pd.to_numeric(listings['Bedrooms']).astype('float32').to_numpy(),
+        'Bathrooms': pd.to_numeric(listings['Bathrooms']).astype('float32').to_numpy(),
+    })
+    listings['ListingStatus'] = 'Listed'
+    return listings
+
+
+def build_daily_state(listings, previous, run_date, delisted_listings=(), reconciled=True):
+    # One row per listing fetched on run_date, plus a 'Delisted' row for every listing that dropped off that day,
+    # carried over from the previous run. Price and status transitions are flagged against the previous run.
+    # Without a real reconcile nobody knows whether the listings missing from the fetch were delisted, so they are
+    # carried over as 'Missing' until a run that reconciles delists them or fetches them again.
+    state = prepare_listings(listings)
+    if previous is None:
+        previous = pd.DataFrame(columns=SCHEMA.names)
+    previous = previous.set_index('ListingId')
+    unresolved = previous.index[previous['ListingStatus'] == 'Missing'].to_numpy(dtype='int64')
+    if reconciled:
+        # The reconcile only reports listings still listed in the database, so missing listings it doesn't
+        # report had already been delisted there.
+        dropped = np.union1d(np.asarray(list(delisted_listings), dtype='int64'), unresolved)
+        status = 'Delisted'
+    else:
+        dropped = previous.index[previous['ListingStatus'].isin(['Listed', 'Missing'])].to_numpy(dtype='int64')
+        status = 'Missing'
+    delisted = previous.reindex(np.intersect1d(dropped, previous.index.to_numpy(dtype='int64')))
+    delisted = delisted[delisted['ListingStatus'] != 'Delisted'][LISTING_COLUMNS[1:]].reset_index()
+    delisted['ListingStatus'] = status
+    # Listings picked up again today are listed, whatever the reconcile step thought.
+    delisted = delisted[~delisted['ListingId'].isin(state['ListingId'])]
+    state = pd.concat([state, delisted], ignore_index=True)
+
+    before = previous.reindex(state['ListingId'])
+    is_new = before['ListingStatus'].isna().to_numpy()
+    state['FirstSeen'] = before['FirstSeen'].where(~is_new, run_date).to_numpy()
+    state['LastSeen'] = np.where(state['ListingStatus'] == 'Listed', run_date, before['LastSeen'].to_numpy())
+    previous_price = before['Price'].to_numpy(dtype=float)
+    price = state['Price'].to_numpy(dtype=float)
+    state['PriceChanged'] = ~is_new & ~((previous_price == price) | (np.isnan(previous_price) & np.isnan(price)))
+    state['PreviousPrice'] = np.where(state['PriceChanged'], previous_price, np.nan)
+    state['StatusChanged'] = ~is_new & (before['ListingStatus'].to_numpy() != state['ListingStatus'].to_numpy())
+    state['PreviousStatus'] = np.where(state['StatusChanged'], before['ListingStatus'].to_numpy(), None)
+    return state.sort_values('ListingId', ignore_index=True)
+
+
+def write_partition(state, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    table = pa.Table.from_pandas(state[SCHEMA.names], schema=SCHEMA, preserve_index=False)
+    utils.replace_atomically(path, lambda temporary_path: pq.write_table(
+        table, temporary_path, compression='zstd', use_dictionary=DICTIONARY_COLUMNS, row_group_size=ROW_GROUP_SIZE))
+
+
+class ListingArchive:
+    # Append-only Parquet archive of the daily state of every listing, partitioned by run date.
+    def __init__(self, root=None):
+        self.root = root or get_archive_path()
+        self.batches = []
+
+    def collect(self, batches):
+        # Passes the ingest batches through, keeping the archived columns of each one.
+        for batch in batches:
+            self.batches.append(batch[LISTING_COLUMNS])
+            yield batch
+
+    def run_dates(self):
+        return list_run_dates(self.root)
+
+    def append(self, run_date, delisted_listings=(), reconciled=True):
+        run_date = to_date(run_date)
+        earlier = [date for date in self.run_dates() if date < run_date]
+        previous = read_partition(self.root, earlier[-1]) if earlier else None
+        listings = (pd.concat(self.batches, ignore_index=True) if self.batches
+                    else pd.DataFrame(columns=LISTING_COLUMNS))
+        state = build_daily_state(listings, previous, run_date, delisted_listings, reconciled)
+        path = get_partition_path(self.root, run_date)
+        write_partition(state, path)
+        self.batches = []
+        print(f'Archived {len(state)} listings for {run_date} ({os.path.getsize(path) / 1024:.0f} KiB)')
+        return state
+
+    def state_as_of(self, date):
+        # The latest run on or before `date`; only that partition is read.
+        date = to_date(date)
+        earlier = [run_date for run_date in self.run_dates() if run_date <= date]
+        if not earlier:
+            return pd.DataFrame(columns=['run_date'] + SCHEMA.names)
+        state = read_partition(self.root, earlier[-1])
+        state.insert(0, 'run_date', pd.Timestamp(earlier[-1]))
+        return state
+
+    def price_history(self, listing_id, start=None, end=None, columns=None):
+        # Runs where listing_id first appeared, changed price or changed status. Partitions outside
+        # [start, end] are never opened.
+        columns = columns or ['run_date', 'Price', 'ListingStatus', 'PreviousPrice', 'PreviousStatus']
+        if not self.run_dates():
+            return pd.DataFrame(columns=columns)
+        condition = ds.field('ListingId') == int(listing_id)
+        if start is not None:
+            condition &= ds.field('run_date') >= pa.scalar(to_date(start), pa.date32())
+        if end is not None:
+            condition &= ds.field('run_date') <= pa.scalar(to_date(end), pa.date32())
+        condition &= ((ds.field('FirstSeen') == ds.field('run_date')) | ds.field('PriceChanged')
+                      | ds.field('StatusChanged'))
+        dataset = ds.dataset(self.root, format='parquet', partitioning=PARTITIONING, schema=self.dataset_schema())
+        history = dataset.to_table(columns=columns, filter=condition).to_pandas()
+        history['run_date'] = pd.to_datetime(history['run_date'])
+        return history.sort_values('run_date', ignore_index=True)
+
+    def dataset_schema(self):
+        return SCHEMA.append(pa.field('run_date', pa.date32()))
@@ -0,0 +1,132 @@
+"""Consistency of the published aggregate tables with the raw rows they summarise.
+
+Publishes DailyAggregates and PriceHistogram to a fake PostgREST endpoint from synthetic listings, loads them the
+way the dashboard does, and answers coarse filter states both ways. Exits non-zero if any answer differs.
+
+    python -m benchmarks.aggregates --listings 50000 --days 30
+"""
+import argparse
+import itertools
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import aggregates
+import figures
+import query_engine
+import snapshot
+import utils
+from benchmarks import synthetic
+from benchmarks.stub_servers import PostgRESTStubServer
+
+
+def filter_states(data, dates):
+    price_range = [float(data['Price'].min()), float(data['Price'].max())]
+    bedroom_range = [0, float(data['Bedrooms'].max())]
+    bathroom_range = [0, float(data['Bathrooms'].max())]
+    regions = data['Region'].dropna().unique().tolist()
+    districts = data['District'].dropna().unique().tolist()
+    property_types = data['PropertyType'].dropna().unique().tolist()
+    windows = [(str(dates[0].date()), str(dates[-1].date())),
+               (str(data['LastUpdatedAt'].min().date()), str(dates[-1].date())),
+               (str(dates[len(dates) // 2].date()), str(dates[-1].date())),
+               (str(data['LastUpdatedAt'].min().date()), str(dates[len(dates) // 2].date()))]
+    locations = [('All Regions', 'All Districts', None), (regions[:1], 'All Districts', None),
+                 (regions[:2], 'All Districts', None), ('All Regions', districts[:1], None),
+                 ('All Regions', 'All Districts', ['Region', regions[0]]),
+                 ('All Regions', 'All Districts', ['District', districts[1]])]
+    for (start_date, end_date), (region, district, drill_down), property_type in itertools.product(
+            windows, locations, ['All Property Types', property_types[:2]]):
+        yield query_engine.normalise_filters(tuple(drill_down) if drill_down else None, start_date, end_date, region,
+                                             district, 'All Suburbs', price_range, bedroom_range, bathroom_range,
+                                             property_type)
+
+
+def answers(charts, filters):
+    bin_starts, counts = charts._price_histogram(filters)
+    results = {
+        'listing counts': np.asarray(charts._listing_counts(filters)[1], dtype=float),
+        'histogram': np.concatenate([bin_starts, counts]),
+        'property type counts': np.sort(charts._property_type_counts(filters)['PropertyType'].to_numpy()),
+    }
+    for level in aggregates.LEVELS:
+        median_price = charts._median_prices(filters, level)
+        results[f'{level} median names'] = median_price[level].to_numpy(dtype=object)
+        results[f'{level} median prices'] = median_price['Price'].to_numpy(dtype=float)
+    return results
+
+
+def same_answer(expected, actual):
+    if expected.shape != actual.shape:
+        return False
+    if expected.dtype == object:
+        return np.array_equal(expected, actual)
+    return np.allclose(expected, actual, rtol=1e-12, atol=0, equal_nan=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    listings = synthetic.make_dash_view(args.listings)
+    # Some listings with no location, which the dashboard's null-tolerant listing count keeps.
+    rng = np.random.default_rng(1)
+    for column in ['Region', 'District', 'Suburb', 'PropertyType']:
+        listings.loc[rng.random(len(listings)) < 0.01, column] = None
+    end = listings['LastUpdatedAt'].max()
+
+    with PostgRESTStubServer(latency=0) as server, tempfile.TemporaryDirectory() as directory:
+        server.tables['dash_view'] = {row['ListingId']: row for row in synthetic.dash_view_rows(listings)}
+        start = time.perf_counter()
+        aggregates.publish_aggregates(server.connect(), days=args.days, end=end)
+        print(f'published aggregates in {time.perf_counter() - start:.1f}s: '
+              f'{len(server.tables["DailyAggregates"])} daily rows, {len(server.tables["PriceHistogram"])} bins')
+        data = snapshot.prepare_dash_view(pd.DataFrame(utils.fetch_table(server.connect(), 'dash_view')))
+        store = aggregates.load_aggregate_store(server.connect, data, path=os.path.join(directory, 'dash_view.arrow'))
+    if store is None:
+        sys.exit('aggregates were not loaded')
+
+    served = {}
+
+    def counting(name, method):
+        def answer(*args):
+            result = method(*args)
+            served[name] = served.get(name, 0) + (result is not None)
+            return result
+        return answer
+
+    for name in ['listing_counts', 'median_prices', 'price_histogram', 'property_type_counts']:
+        setattr(store, name, counting(name, getattr(store, name)))
+
+    engine = query_engine.QueryEngine(data)
+    from_aggregates = figures.DashboardFigures(engine, store)
+    from_rows = figures.DashboardFigures(engine)
+    dates = pd.date_range(end=end.normalize(), periods=args.days, freq='D')
+    mismatches = checked = 0
+    aggregate_time = raw_time = 0
+    for filters in filter_states(data, dates):
+        start = time.perf_counter()
+        expected = answers(from_rows, filters)
+        raw_time += time.perf_counter() - start
+        start = time.perf_counter()
+        actual = answers(from_aggregates, filters)
+        aggregate_time += time.perf_counter() - start
+        for name in expected:
+            checked += 1
+            if not same_answer(expected[name], actual[name]):
+                mismatches += 1
+                print(f'mismatch in {name} for {filters}')
+    print(f'{checked} answers checked, {mismatches} mismatches; answered from aggregates: '
+          + ', '.join(f'{name} {count}' for name, count in served.items()))
+    print(f'raw rows {raw_time:.2f}s, with aggregates {aggregate_time:.2f}s')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,141 @@
+"""On-disk size and query speed of the listing archive over simulated nightly runs.
+
+Each simulated day delists --churn of the listings, lists as many new ones and reprices --repriced of them. On
+--unreconciled of the days the reconcile is a dry run, so the listings that dropped off stay 'Missing' until the
+next day that reconciles. The archive is then checked against the simulation: the state as of every run date and
+the price history of a sample of listings. Exits non-zero on any mismatch.
+
+    python -m benchmarks.archive --listings 50000 --days 60
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+import archive
+from benchmarks import synthetic
+
+
+def make_listings(first_id, n, rng):
+    # Columns as normalise_listings leaves them: objects with None for missing values.
+    data = synthetic.make_dash_view(n, seed=int(rng.integers(1 << 31)))
+    data['ListingId'] = np.arange(first_id, first_id + n)
+    data = data[archive.LISTING_COLUMNS].astype(object)
+    return data.where(data.notna(), None)
+
+
+def simulate(n, days, churn, repriced, rng):
+    listings = make_listings(4000000000, n, rng)
+    next_id = 4000000000 + n
+    for day in range(days):
+        delisted = np.array([], dtype='int64')
+        if day:
+            dropped = rng.random(len(listings)) < churn
+            delisted = listings.loc[dropped, 'ListingId'].to_numpy(dtype='int64')
+            listings = listings[~dropped]
+            changed = rng.random(len(listings)) < repriced
+            prices = listings.loc[changed, 'Price'].map(lambda price: 500000.0 if price is None else price)
+            listings.loc[changed, 'Price'] = (prices * rng.uniform(0.9, 1.0, len(prices))).round(-3).to_numpy()
+            listings = pd.concat([listings, make_listings(next_id, int(dropped.sum()), rng)], ignore_index=True)
+            next_id += int(dropped.sum())
+        yield day, listings.copy(), delisted
+
+
+def expected_history(prices, listing_id):
+    # (run date, price, status) whenever the listing appeared, changed price or changed status.
+    rows, last = [], None
+    for run_date, day_prices in prices:
+        if listing_id not in day_prices:
+            continue
+        current = day_prices[listing_id]
+        if last is None or current != last:
+            rows.append((run_date, *current))
+        last = current
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=50000)
+    parser.add_argument('--days', type=int, default=60)
+    parser.add_argument('--churn', type=float, default=0.025)
+    parser.add_argument('--repriced', type=float, default=0.01)
+    parser.add_argument('--sample', type=int, default=50)
+    parser.add_argument('--unreconciled', type=float, default=0.1,
+                        help='Share of days whose reconcile is a dry run, as after a resume from stale pages.')
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    run_dates = pd.date_range('2024-06-01', periods=args.days, freq='D')
+    with tempfile.TemporaryDirectory() as directory:
+        listing_archive = archive.ListingArchive(os.path.join(directory, 'listing_archive'))
+        prices, append_seconds, rows = [], 0.0, 0
+        # Listings that dropped off on days without a real reconcile, still listed in the database.
+        unresolved = np.array([], dtype='int64')
+        for day, listings, delisted in simulate(args.listings, args.days, args.churn, args.repriced, rng):
+            reconciled = rng.random() >= args.unreconciled
+            unresolved = np.union1d(unresolved, delisted)
+            for _ in listing_archive.collect([listings]):
+                pass
+            start = time.perf_counter()
+            state = listing_archive.append(run_dates[day], unresolved, reconciled=reconciled)
+            append_seconds += time.perf_counter() - start
+            rows += len(state)
+            day_prices = {listing_id: (price if price is not None else np.nan, 'Listed')
+                          for listing_id, price in zip(listings['ListingId'], listings['Price'])}
+            if prices:
+                for listing_id in unresolved:
+                    day_prices[listing_id] = (prices[-1][1][listing_id][0], 'Delisted' if reconciled else 'Missing')
+            if reconciled:
+                unresolved = np.array([], dtype='int64')
+            prices.append((run_dates[day], day_prices))
+
+        size = sum(os.path.getsize(os.path.join(root, name))
+                   for root, _, names in os.walk(listing_archive.root) for name in names)
+        print(f'{rows} listing-days in {args.days} partitions: {size / 2 ** 20:.1f} MiB, '
+              f'{size / rows * 1e6 / 2 ** 20:.1f} MiB per million listing-days; '
+              f'{append_seconds / args.days * 1000:.0f} ms per nightly append')
+
+        mismatches = 0
+        start = time.perf_counter()
+        for run_date, day_prices in prices:
+            state = listing_archive.state_as_of(run_date + pd.Timedelta(hours=12))
+            actual = {listing_id: (price, status) for listing_id, price, status
+                      in zip(state['ListingId'], state['Price'], state['ListingStatus'])}
+            if actual.keys() != day_prices.keys() or any(
+                    not (np.isnan(price) and np.isnan(day_prices[listing_id][0]) or price == day_prices[listing_id][0])
+                    or status != day_prices[listing_id][1] for listing_id, (price, status) in actual.items()):
+                mismatches += 1
+                print(f'mismatch in state as of {run_date.date()}')
+        state_seconds = (time.perf_counter() - start) / len(prices)
+
+        ever_listed = np.array(sorted(set().union(*(day_prices.keys() for _, day_prices in prices))))
+        sample = rng.choice(ever_listed, size=min(args.sample, len(ever_listed)), replace=False)
+        start = time.perf_counter()
+        for listing_id in sample:
+            history = listing_archive.price_history(listing_id)
+            actual = list(zip(history['run_date'], history['Price'].fillna(np.nan), history['ListingStatus']))
+            expected = expected_history(prices, listing_id)
+            if len(actual) != len(expected) or any(
+                    a[0] != e[0] or a[2] != e[2] or not (a[1] == e[1] or np.isnan(a[1]) and np.isnan(e[1]))
+                    for a, e in zip(actual, expected)):
+                mismatches += 1
+                print(f'mismatch in price history of {listing_id}')
+        history_seconds = (time.perf_counter() - start) / len(sample)
+        start = time.perf_counter()
+        for listing_id in sample:
+            listing_archive.price_history(listing_id, start=run_dates[-7], end=run_dates[-1])
+        window_seconds = (time.perf_counter() - start) / len(sample)
+
+    print(f'state as of a date: {state_seconds * 1000:.0f} ms; price history of a listing: '
+          f'{history_seconds * 1000:.0f} ms over every run, {window_seconds * 1000:.0f} ms over the last week')
+    print(f'{len(prices)} states and {len(sample)} histories checked, {mismatches} mismatches')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
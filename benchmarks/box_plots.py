@@ -0,0 +1,41 @@
+"""Price vs. bedrooms box plot payload: px.box with every point vs. the precomputed statistics in figures.py.
+
+    python -m benchmarks.box_plots --listings 10000 50000 200000
+"""
+import argparse
+import time
+
+import plotly.express as px
+
+import figures
+import snapshot
+from benchmarks import synthetic
+
+
+def px_boxplot(filtered_data):
+    # The figure create_price_bedrooms_boxplot built before figures.box_statistics.
+    return px.box(filtered_data, x='Bedrooms', y='Price', notched=True, points='all', height=800)
+
+
+def timed_payload(build, filtered_data):
+    start = time.perf_counter()
+    payload = build(filtered_data).to_json()
+    return len(payload), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, nargs='+', default=[10000, 50000, 200000])
+    args = parser.parse_args()
+
+    for n in args.listings:
+        data = snapshot.prepare_dash_view(synthetic.make_dash_view(n))
+        data = data[data['Price'].notna()]
+        old_size, old_time = timed_payload(px_boxplot, data)
+        new_size, new_time = timed_payload(figures.create_price_bedrooms_boxplot, data)
+        print(f'{len(data):>8} listings: px.box {old_size / 1024:8.0f} KiB in {old_time:.2f}s, '
+              f'precomputed {new_size / 1024:4.0f} KiB in {new_time:.3f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""Upsert synthetic listings into a local fake PostgREST endpoint, single request vs. batched writer.
+
+The stub can reject large bodies (--max-payload-kb) and fail every nth request (--fail-every) to
+exercise the batch retries. Exits non-zero if the stored rows don't match what was sent.
+
+    python -m benchmarks.bulk_upsert --listings 50000 --batch-size 1000 --workers 4 --fail-every 7
+"""
+import argparse
+import sys
+import time
+
+import pandas as pd
+from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+
+import fetch_and_store
+import utils
+from benchmarks import synthetic
+from benchmarks.stub_servers import PostgRESTStubServer
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=50000)
+    parser.add_argument('--batch-size', type=int, default=1000)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--fail-every', type=int, default=0)
+    parser.add_argument('--max-payload-kb', type=int, default=0)
+    args = parser.parse_args()
+    load_dotenv('config.env')
+
+    data = pd.DataFrame.from_dict(synthetic.make_listings(args.listings))
+    rows = fetch_and_store.listings_to_records(fetch_and_store.normalise_listings(data))
+    max_payload_bytes = args.max_payload_kb * 1024 or None
+
+    with PostgRESTStubServer(args.latency, max_payload_bytes=max_payload_bytes) as server:
+        supabase = server.connect()
+        start = time.perf_counter()
+        try:
+            supabase.table('Listings').upsert(rows, on_conflict='ListingId').execute()
+            outcome = 'ok'
+        except APIError as e:
+            outcome = f'failed: {e.message}'
+        print(f'single request: {time.perf_counter() - start:.2f}s, {outcome}')
+
+        server.tables.clear()
+        server.requests = 0
+        server.fail_every = args.fail_every
+        report = utils.upsert_in_batches(supabase, 'Listings', rows, on_conflict='ListingId',
+                                         batch_size=args.batch_size, max_workers=args.workers, backoff=0.1)
+        stored = server.tables.get('Listings', {})
+        print(f'batched: {report.rows_per_second:.0f} rows/s over {server.requests} requests, '
+              f'{len(stored)} rows stored, failed batches {report.failed_batch_ids}')
+    sys.exit(0 if len(stored) + report.rows_failed == len(rows) else 1)
+
+
+if __name__ == '__main__':
+    main()
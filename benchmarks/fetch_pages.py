@@ -0,0 +1,56 @@
+"""Compare the concurrent TradeMe fetcher with the old one-page-at-a-time loop.
+
+Run from the repository root:
+
+    python -m benchmarks.fetch_pages --listings 20000 --latency 0.2 --workers 8 --rate 20
+"""
+import argparse
+import json
+import time
+
+import pandas as pd
+import requests
+
+import fetch_and_store
+from benchmarks.stub_servers import TradeMeStubServer
+
+
+def fetch_sequential(session, url):
+    # The pre-concurrency loop, kept here as the baseline.
+    parsed_data = json.loads(session.get(url).content)
+    data_df = pd.DataFrame.from_dict(parsed_data['List'])
+    for i in range(2, int(parsed_data['TotalCount']/500) + 2):
+        response = session.get(f'{url}&page={i}&sort_order=Default HTTP/1.1')
+        if response.status_code != 200:
+            break
+        data_df = pd.concat([data_df, pd.DataFrame.from_dict(json.loads(response.content)['List'])],
+                            ignore_index=True)
+        time.sleep(0.5)
+    return data_df
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=20000)
+    parser.add_argument('--latency', type=float, default=0.2, help='Seconds the stub waits before each response.')
+    parser.add_argument('--workers', type=int, default=8)
+    parser.add_argument('--rate', type=float, default=20, help='Requests per second allowed by the token bucket.')
+    parser.add_argument('--throttle-every', type=int, default=0, help='Answer every nth request with a 429.')
+    parser.add_argument('--skip-baseline', action='store_true')
+    args = parser.parse_args()
+
+    with TradeMeStubServer(args.listings, latency=args.latency, throttle_every=args.throttle_every) as server:
+        if not args.skip_baseline:
+            start = time.perf_counter()
+            baseline = fetch_sequential(requests.Session(), server.url)
+            print(f'sequential: {len(baseline)} listings in {time.perf_counter() - start:.2f}s')
+        server.requests = 0
+        start = time.perf_counter()
+        data = fetch_and_store.fetch_trademe_data(requests.Session(), server.url, max_workers=args.workers,
+                                                  requests_per_second=args.rate, session_factory=requests.Session)
+        print(f'concurrent: {len(data)} listings in {time.perf_counter() - start:.2f}s '
+              f'({server.requests} requests, {args.workers} workers, {args.rate:g} req/s)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+"""Overhead of the metrics module, switched off and on.
+
+Times a tight loop of metrics.increment / metrics.timer / a metrics.timed function, then fetches and normalises
+synthetic listings from the TradeMe stub with metrics off, on, and on with a JSON-lines sink.
+
+    python -m benchmarks.instrumentation --listings 50000
+"""
+import argparse
+import os
+import statistics
+import tempfile
+import time
+
+import requests
+from dotenv import load_dotenv
+
+import fetch_and_store
+import metrics
+from benchmarks.stub_servers import TradeMeStubServer
+
+
+@metrics.timed('benchmark_seconds')
+def noop():
+    pass
+
+
+def per_call_ns(function, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        function()
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def timer_once():
+    with metrics.timer('benchmark_seconds'):
+        pass
+
+
+def increment_once():
+    metrics.increment('benchmark_total')
+
+
+def ingest(url, workers):
+    rows = 0
+    pages = fetch_and_store.iter_trademe_pages(requests.Session(), url, max_workers=workers,
+                                               requests_per_second=1000, session_factory=requests.Session)
+    for batch in fetch_and_store.iter_listing_batches(pages):
+        rows += len(batch)
+    return rows
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=int, default=50000)
+    parser.add_argument('--calls', type=int, default=1000000)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--workers', type=int, default=4)
+    args = parser.parse_args()
+    load_dotenv('config.env')
+
+    with tempfile.TemporaryDirectory() as directory:
+        modes = {'off': lambda: metrics.configure(enabled=False),
+                 'on': lambda: metrics.configure(),
+                 'on + JSON lines': lambda: metrics.configure(os.path.join(directory, 'metrics.jsonl'))}
+        for mode, configure in modes.items():
+            configure()
+            print(f'{mode:>16}: increment {per_call_ns(increment_once, args.calls):6.0f} ns, '
+                  f'timer {per_call_ns(timer_once, args.calls):6.0f} ns, '
+                  f'timed function {per_call_ns(noop, args.calls):6.0f} ns per call')
+
+        with TradeMeStubServer(total_count=args.listings, latency=0) as server:
+            seconds = {mode: [] for mode in modes}
+            # Alternate the modes so drift in the machine's speed hits them all alike.
+            for _ in range(args.repeats):
+                for mode, configure in modes.items():
+                    configure()
+                    start = time.perf_counter()
+                    ingest(server.url, args.workers)
+                    seconds[mode].append(time.perf_counter() - start)
+            metrics.configure(enabled=False)
+        baseline = statistics.median(seconds['off'])
+        for mode, samples in seconds.items():
+            median = statistics.median(samples)
+            print(f'{mode:>16}: {args.listings} listings fetched and normalised in {median:.2f}s '
+                  f'({(median / baseline - 1) * 100:+.1f}%)')
+
+
+if __name__ == '__main__':
+    main()
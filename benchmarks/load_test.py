@@ -0,0 +1,433 @@
+"""Concurrent users against the dashboard's Dash callbacks, fully offline.
+
+Starts dashboard.py's `server` in a child process on a fixed synthetic dataset, written as the local snapshot (and,
+unless --no-aggregates, the aggregate tables) so nothing is fetched from Supabase. Each simulated client loads the
+page and then replays a browsing session against /_dash-update-component the way dash-renderer would: it keeps
+every component's props, fires the callbacks whose inputs changed and follows the chain through filter-state to
+every figure. Sessions pick regions, districts and property types, change the date range, apply filters, drill
+down by clicking the median price bars, and pan and zoom the map.
+
+Reports latency percentiles and response sizes per callback output. --profile-dir also dumps one cProfile per
+callback output (open with snakeviz or pstats), or pyinstrument HTML when --profiler pyinstrument is installed.
+
+    python -m benchmarks.load_test --listings 100000 --clients 1 8 32 --sessions 5
+"""
+import argparse
+import cProfile
+import io
+import json
+import os
+import pstats
+import random
+import re
+import signal
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+import requests
+
+UPDATE_PATH = '/_dash-update-component'
+REGION_CLICKS = {'Region': 'median-price-by-region', 'District': 'median-price-by-district',
+                 'Suburb': 'median-price-by-suburb'}
+CENTRES = [(174.76, -36.85), (174.78, -41.29), (172.63, -43.53), (175.28, -37.79), (170.50, -45.87)]
+
+
+def write_dataset(listings, directory, with_aggregates):
+    # Imported here so the load-generating process doesn't pay for them.
+    import snapshot
+    from benchmarks import synthetic
+
+    raw = synthetic.make_dash_view(listings)
+    path = os.path.join(directory, 'dash_view.arrow')
+    snapshot.write_snapshot(snapshot.prepare_dash_view(raw.copy()), path)
+    if with_aggregates:
+        write_aggregates(raw, path)
+    return path
+
+
+def write_aggregates(raw, path):
+    # The aggregate tables for the raw (unprepared) dash_view rows, next to the snapshot at `path`.
+    import aggregates
+    import snapshot
+
+    source_updated_at = raw['LastUpdatedAt'].max()
+    dates = pd.date_range(end=source_updated_at.normalize(), periods=aggregates.get_aggregate_days(), freq='D')
+    daily = aggregates.build_daily_aggregates(raw, dates)
+    histogram = aggregates.build_price_histogram(raw)
+    daily['MedianPrice'] = daily['MedianPrice'] / 1000000
+    histogram[['BinStart', 'BinEnd']] = histogram[['BinStart', 'BinEnd']] / 1000000
+    for aggregate, aggregate_path in zip([daily, histogram], aggregates.get_aggregate_paths(path)):
+        aggregate['SourceUpdatedAt'] = source_updated_at
+        snapshot.write_snapshot(aggregate, aggregate_path)
+
+
+class CallbackProfiler:
+    # WSGI middleware that profiles every callback request and merges the profiles per callback output.
+    def __init__(self, app, directory, profiler):
+        self.app = app
+        self.directory = directory
+        self.profiler = profiler
+        self.profiles = {}
+        self.lock = threading.Lock()
+
+    def __call__(self, environ, start_response):
+        if environ.get('PATH_INFO') != UPDATE_PATH:
+            return self.app(environ, start_response)
+        body = environ['wsgi.input'].read(int(environ.get('CONTENT_LENGTH') or 0))
+        environ['wsgi.input'] = io.BytesIO(body)
+        output = json.loads(body)['output']
+        if self.profiler == 'pyinstrument':
+            from pyinstrument import Profiler
+            profiler = Profiler()
+            profiler.start()
+            response = list(self.app(environ, start_response))
+            profiler.stop()
+            profile = profiler.last_session
+        else:
+            profiler = cProfile.Profile()
+            response = profiler.runcall(lambda: list(self.app(environ, start_response)))
+            profile = pstats.Stats(profiler)
+        with self.lock:
+            self.profiles.setdefault(output, []).append(profile)
+        return response
+
+    def dump(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for output, profiles in self.profiles.items():
+            name = re.sub(r'[^A-Za-z0-9-]+', '_', output).strip('_')
+            if self.profiler == 'pyinstrument':
+                from pyinstrument.renderers import HTMLRenderer
+                from pyinstrument.session import Session
+                session = profiles[0]
+                for other in profiles[1:]:
+                    session = Session.combine(session, other)
+                with open(os.path.join(self.directory, f'{name}.html'), 'w') as f:
+                    f.write(HTMLRenderer().render(session))
+            else:
+                stats = profiles[0]
+                for other in profiles[1:]:
+                    stats.add(other)
+                stats.dump_stats(os.path.join(self.directory, f'{name}.prof'))
+
+
+def serve(profile_dir, profiler):
+    # Runs in the child process, with the environment pointing dashboard.py at the synthetic snapshot.
+    from werkzeug.serving import make_server
+    # stdout only carries the port; the dashboard's own prints go to the log with everything else.
+    port_output, sys.stdout = sys.stdout, sys.stderr
+    import dashboard
+
+    app = dashboard.server
+    if profile_dir:
+        app.wsgi_app = CallbackProfiler(app.wsgi_app, profile_dir, profiler)
+
+    def stop(*_):
+        if profile_dir:
+            app.wsgi_app.dump()
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    print(server.server_port, file=port_output, flush=True)
+    server.serve_forever()
+
+
+class DashboardProcess:
+    def __init__(self, snapshot_path, profile_dir=None, profiler='cprofile', log_path=os.devnull):
+        self.command = [sys.executable, '-m', 'benchmarks.load_test', '--serve', '--profiler', profiler]
+        if profile_dir:
+            self.command += ['--profile-dir', profile_dir]
+        # Dead Supabase address: the snapshot and aggregates are read from disk, and nothing polls for updates.
+        self.env = dict(os.environ, DASHBOARD_SNAPSHOT_PATH=snapshot_path, DASHBOARD_REFRESH_SECONDS='0',
+                        SUPABASE_URL='http://127.0.0.1:9', SUPABASE_API_KEY='stub.stub.stub')
+        self.log_path = log_path
+        self.process = None
+        self.base_url = None
+
+    def __enter__(self):
+        self.log = open(self.log_path, 'w')
+        self.process = subprocess.Popen(self.command, env=self.env, stdout=subprocess.PIPE, stderr=self.log,
+                                        text=True)
+        self.base_url = f'http://127.0.0.1:{int(self.process.stdout.readline())}'
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait()
+        self.log.close()
+
+
+def walk_layout(component, values):
+    if isinstance(component, list):
+        for child in component:
+            walk_layout(child, values)
+    elif isinstance(component, dict) and 'props' in component:
+        props = component['props']
+        if 'id' in props:
+            for prop, value in props.items():
+                values[(props['id'], prop)] = value
+        walk_layout(props.get('children'), values)
+
+
+def parse_dependency(dependency):
+    # '..a.b...c.d..' for multi-output callbacks, 'a.b' otherwise.
+    multi = dependency['output'].startswith('..')
+    outputs = [tuple(output.rsplit('.', 1)) for output in dependency['output'].strip('.').split('...')]
+    return {
+        'output': dependency['output'],
+        'multi': multi,
+        'outputs': outputs,
+        'inputs': [(item['id'], item['property']) for item in dependency['inputs']],
+        'state': [(item['id'], item['property']) for item in dependency['state']],
+    }
+
+
+def fetch_callbacks(base_url, layout):
+    # The server-side callbacks dash-renderer could call on this layout: clientside ones never reach the server, and
+    # ones reading components the layout doesn't have (the loading page's, once the data is in) never fire.
+    values = {}
+    walk_layout(layout, values)
+    component_ids = {component_id for component_id, _ in values}
+    callbacks = [parse_dependency(dependency) for dependency in requests.get(f'{base_url}/_dash-dependencies').json()
+                 if not dependency.get('clientside_function')]
+    return [callback for callback in callbacks
+            if all(component_id in component_ids for component_id, _ in callback['inputs'])]
+
+
+def apply_patch(current, value):
+    # Applies a Patch response to the stored prop as dash-renderer does. The figure callbacks only assign.
+    if not isinstance(value, dict) or '__dash_patch_update' not in value:
+        return value
+    for operation in value['operations']:
+        *path, key = operation['location']
+        target = current
+        for step in path:
+            target = target[step]
+        target[key] = operation['params']['value']
+    return current
+
+
+class Recorder:
+    def __init__(self):
+        self.samples = {}
+        self.lock = threading.Lock()
+
+    def add(self, output, seconds, size, status):
+        with self.lock:
+            self.samples.setdefault(output, []).append((seconds, size, status))
+
+
+class DashClient:
+    # Plays the part of dash-renderer for one browser tab.
+    def __init__(self, base_url, layout, callbacks, recorder, rng):
+        self.base_url = base_url
+        self.session = requests.Session()
+        self.values = {}
+        walk_layout(layout, self.values)
+        self.callbacks = callbacks
+        self.recorder = recorder
+        self.rng = rng
+        self.produced = {output for callback in callbacks for output in callback['outputs']}
+        self.date_range = (pd.Timestamp(self.values[('date-picker-range', 'start_date')]),
+                           pd.Timestamp(self.values[('date-picker-range', 'end_date')]))
+
+    def call(self, callback, changed):
+        payload = {
+            'output': callback['output'],
+            'outputs': [{'id': i, 'property': p} for i, p in callback['outputs']] if callback['multi']
+            else {'id': callback['outputs'][0][0], 'property': callback['outputs'][0][1]},
+            'inputs': [{'id': i, 'property': p, 'value': self.values.get((i, p))} for i, p in callback['inputs']],
+            'state': [{'id': i, 'property': p, 'value': self.values.get((i, p))} for i, p in callback['state']],
+            'changedPropIds': [f'{i}.{p}' for i, p in callback['inputs'] if (i, p) in changed],
+        }
+        start = time.perf_counter()
+        response = self.session.post(f'{self.base_url}{UPDATE_PATH}', json=payload)
+        self.recorder.add(callback['output'], time.perf_counter() - start, len(response.content),
+                          response.status_code)
+        if response.status_code != 200:
+            return set()
+        updated = set()
+        for component_id, props in response.json()['response'].items():
+            for prop, value in props.items():
+                self.values[(component_id, prop)] = apply_patch(self.values.get((component_id, prop)), value)
+                updated.add((component_id, prop))
+        return updated
+
+    def fire(self, changed):
+        # Call every callback with a changed input, then the ones whose inputs those callbacks updated.
+        while changed:
+            updated = set()
+            for callback in self.callbacks:
+                if changed.intersection(callback['inputs']):
+                    updated |= self.call(callback, changed)
+            changed = updated
+
+    def load(self):
+        # On page load dash-renderer calls every callback whose inputs no other callback produces.
+        updated = set()
+        for callback in self.callbacks:
+            if not self.produced.intersection(callback['inputs']):
+                updated |= self.call(callback, set())
+        self.fire(updated)
+
+    def set(self, **props):
+        changed = set()
+        for key, value in props.items():
+            component_id, prop = key.rsplit('__', 1)
+            self.values[(component_id.replace('_', '-'), prop)] = value
+            changed.add((component_id.replace('_', '-'), prop))
+        self.fire(changed)
+
+    def options(self, component_id):
+        return [option['value'] for option in self.values.get((component_id, 'options')) or []
+                if not option['value'].startswith('All ')]
+
+    def apply(self):
+        self.set(filter_button__n_clicks=(self.values.get(('filter-button', 'n_clicks')) or 0) + 1)
+
+    def pick(self, component_id, count=1):
+        options = self.options(component_id)
+        return self.rng.sample(options, min(count, len(options))) if options else None
+
+    def browse(self, steps):
+        actions = [self.choose_location, self.change_dates, self.drill_down, self.move_map, self.choose_property_type,
+                   self.reset]
+        for _ in range(steps):
+            self.rng.choice(actions)()
+
+    def choose_location(self):
+        regions = self.pick('region-dropdown')
+        if regions:
+            self.set(region_dropdown__value=regions)
+            if self.rng.random() < 0.5:
+                districts = self.pick('district-dropdown')
+                if districts:
+                    self.set(district_dropdown__value=districts)
+        self.apply()
+
+    def change_dates(self):
+        start_date, end_date = self.date_range
+        days = max(1, (end_date - start_date).days)
+        new_start = start_date + pd.Timedelta(days=self.rng.randrange(days))
+        self.values[('date-picker-range', 'start_date')] = new_start.date().isoformat()
+        self.values[('date-picker-range', 'end_date')] = end_date.date().isoformat()
+        self.apply()
+
+    def drill_down(self):
+        # Clicking a bar sends its category as clickData.
+        level = self.rng.choice(list(REGION_CLICKS))
+        figure = self.values.get((REGION_CLICKS[level], 'figure')) or {}
+        categories = [x for trace in figure.get('data', []) for x in trace.get('x', [])]
+        if not categories:
+            categories = self.options({'Region': 'region-dropdown', 'District': 'district-dropdown',
+                                       'Suburb': 'suburb-dropdown'}[level])
+        if categories:
+            self.set(**{f'{REGION_CLICKS[level].replace("-", "_")}__clickData':
+                        {'points': [{'x': self.rng.choice(categories)}]}})
+
+    def move_map(self):
+        lon, lat = self.rng.choice(CENTRES)
+        self.set(listings_on_map__relayoutData={'mapbox.center': {'lon': lon, 'lat': lat},
+                                                'mapbox.zoom': self.rng.choice([5, 8, 11, 14])})
+
+    def choose_property_type(self):
+        property_types = self.pick('property-type-dropdown', self.rng.randint(1, 2))
+        if property_types:
+            self.set(property_type_dropdown__value=property_types)
+        self.apply()
+
+    def reset(self):
+        self.set(region_dropdown__value='All Regions', district_dropdown__value='All Districts',
+                 suburb_dropdown__value='All Suburbs', property_type_dropdown__value='All Property Types')
+        self.apply()
+
+
+def run_client(base_url, layout, callbacks, recorder, seed, sessions, steps):
+    rng = random.Random(seed)
+    for _ in range(sessions):
+        client = DashClient(base_url, layout, callbacks, recorder, rng)
+        client.load()
+        client.browse(steps)
+
+
+def summarise(recorder, elapsed):
+    rows = []
+    for output, samples in sorted(recorder.samples.items()):
+        seconds = np.array([sample[0] for sample in samples]) * 1000
+        sizes = np.array([sample[1] for sample in samples])
+        errors = sum(sample[2] >= 500 for sample in samples)
+        rows.append({'callback': output, 'requests': len(samples), 'errors': int(errors),
+                     'p50_ms': round(float(np.percentile(seconds, 50)), 1),
+                     'p90_ms': round(float(np.percentile(seconds, 90)), 1),
+                     'p99_ms': round(float(np.percentile(seconds, 99)), 1),
+                     'max_ms': round(float(seconds.max()), 1),
+                     'mean_kib': round(float(sizes.mean()) / 1024, 1), 'max_kib': round(float(sizes.max()) / 1024, 1)})
+    requests_made = sum(row['requests'] for row in rows)
+    return {'requests': requests_made, 'seconds': round(elapsed, 2), 'requests_per_second': round(requests_made /
+                                                                                                  elapsed, 1),
+            'callbacks': rows}
+
+
+def print_summary(clients, summary):
+    print(f'{clients} clients: {summary["requests"]} requests in {summary["seconds"]:.1f}s '
+          f'({summary["requests_per_second"]:.0f}/s)')
+    print(f'  {"callback":<58} {"n":>5} {"p50":>7} {"p90":>7} {"p99":>7} {"max":>7} {"KiB":>7} {"max KiB":>8}')
+    for row in summary['callbacks']:
+        print(f'  {row["callback"][:58]:<58} {row["requests"]:>5} {row["p50_ms"]:>7.1f} {row["p90_ms"]:>7.1f} '
+              f'{row["p99_ms"]:>7.1f} {row["max_ms"]:>7.1f} {row["mean_kib"]:>7.1f} {row["max_kib"]:>8.1f}'
+              + (f'  {row["errors"]} errors' if row['errors'] else ''))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=int, default=100000)
+    parser.add_argument('--clients', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--sessions', type=int, default=3, help='Page loads per client.')
+    parser.add_argument('--steps', type=int, default=10, help='User actions per page load.')
+    parser.add_argument('--no-aggregates', action='store_true', help="Don't write the aggregate tables.")
+    parser.add_argument('--profile-dir', help='Write a profile per callback output here.')
+    parser.add_argument('--profiler', choices=['cprofile', 'pyinstrument'], default='cprofile')
+    parser.add_argument('--server-log', default=os.devnull, help="File for the dashboard's own log.")
+    parser.add_argument('--report', help='Write the summary as JSON.')
+    parser.add_argument('--serve', action='store_true', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.serve:
+        serve(args.profile_dir, args.profiler)
+        return
+
+    reports = []
+    failed = False
+    with tempfile.TemporaryDirectory() as directory:
+        snapshot_path = write_dataset(args.listings, directory, not args.no_aggregates)
+        with DashboardProcess(snapshot_path, args.profile_dir, args.profiler, args.server_log) as dashboard:
+            layout = requests.get(f'{dashboard.base_url}/_dash-layout').json()
+            callbacks = fetch_callbacks(dashboard.base_url, layout)
+            for clients in args.clients:
+                recorder = Recorder()
+                start = time.perf_counter()
+                with ThreadPoolExecutor(max_workers=clients) as executor:
+                    futures = [executor.submit(run_client, dashboard.base_url, layout, callbacks, recorder, seed,
+                                               args.sessions, args.steps) for seed in range(clients)]
+                    for future in futures:
+                        future.result()
+                summary = summarise(recorder, time.perf_counter() - start)
+                print_summary(clients, summary)
+                failed |= any(row['errors'] for row in summary['callbacks'])
+                reports.append({'clients': clients, **summary})
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'listings': args.listings, 'aggregates': not args.no_aggregates, 'sessions': args.sessions,
+                       'steps': args.steps, 'runs': reports}, f, indent=2)
+    if args.profile_dir:
+        print(f'Profiles written to {args.profile_dir}')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
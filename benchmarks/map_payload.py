@@ -0,0 +1,54 @@
+"""Listings-on-map payload: every listing with its hover fields vs. the zoom-aware bins/points in map_pipeline.py.
+
+    python -m benchmarks.map_payload --listings 200000
+"""
+import argparse
+import time
+
+import plotly.express as px
+
+import map_pipeline
+import snapshot
+from benchmarks import synthetic
+
+VIEWS = [('national', None), ('Auckland, zoom 9', (174.76, -36.85, 9)), ('Auckland, zoom 12', (174.76, -36.85, 12)),
+         ('Ponsonby, zoom 15', (174.745, -36.85, 15))]
+
+
+def scatter_mapbox(filtered_data):
+    # The figure update_graphs built before map_pipeline.py.
+    fig_map = px.scatter_mapbox(filtered_data, lat='Latitude', lon='Longitude', size='Price', zoom=4, height=300,
+                                title='Listings on Map',
+                                hover_data={'Title': True, 'Price': ':.2f', 'Region': True, 'District': True,
+                                            'Suburb': True, 'Area': True, 'LandArea': True, 'Bedrooms': True,
+                                            'Bathrooms': True, 'PropertyType': True, 'StartDate': True})
+    fig_map.update_layout(mapbox_style='open-street-map', title='Listings on Map', height=800)
+    return fig_map
+
+
+def timed_payload(build):
+    start = time.perf_counter()
+    payload = build().to_json()
+    return len(payload), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=200000)
+    args = parser.parse_args()
+
+    data = snapshot.prepare_dash_view(synthetic.make_dash_view(args.listings))
+    # Warm plotly's lazy imports so they don't count against the first case.
+    map_pipeline.create_map_figure(data.head(10), None)
+    # px.scatter_mapbox rejects NaN sizes, so the old figure only ever got priced listings. The pipeline gets them all.
+    size, seconds = timed_payload(lambda: scatter_mapbox(data[data['Price'].notna()]))
+    print(f'{"scatter_mapbox, priced listings":>30}: {size / 2 ** 20:7.2f} MiB in {seconds:.2f}s')
+    for name, view in VIEWS:
+        viewport = map_pipeline.viewport_around(*view) if view else None
+        mode = map_pipeline.create_map_figure(data, viewport)[1]
+        size, seconds = timed_payload(lambda: map_pipeline.create_map_figure(data, viewport)[0])
+        print(f'{name:>30}: {size / 2 ** 20:7.2f} MiB in {seconds:.2f}s ({mode})')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+"""Check the vectorised listing normalisation against the original row-by-row version and time both.
+
+Exits non-zero if the two disagree on any row. Run under a DST zone as well as UTC, e.g.
+
+    TZ=Pacific/Auckland python -m benchmarks.normalise --listings 100000
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from dotenv import load_dotenv
+
+import fetch_and_store
+from benchmarks import synthetic
+
+EDGE_CASE_PRICES = [
+    'Asking price $1,250,000.50', 'Enquiries over $999', '$500,000 - $600,000', 'By negotiation', 'Offers over $85',
+    'Asking price $1,000,000,000', 'Price $12,34', 'Auction $', '$1,234.5', '',
+]
+
+
+def normalise_listings_rowwise(data):
+    # normalise_listings as it was before vectorisation.
+    columns = fetch_and_store.os.getenv('LISTING_COLUMNS').split(',')
+    data = data.copy()
+    data['ListingStatus'] = 'Listed'
+    data['StartDate'] = data['StartDate'].apply(fetch_and_store.convert_date_string)
+    data['EndDate'] = data['EndDate'].apply(fetch_and_store.convert_date_string)
+    data['Price'] = data['PriceDisplay'].apply(fetch_and_store.extract_price)
+    data['Price'] = data['Price'].replace('', None).astype(float, errors='ignore').replace({np.nan: None})
+    data['Parking'] = data['Parking'].replace('', None)
+    data['Amenities'] = data['Amenities'].fillna('').replace('', None)
+    data = data.replace({np.nan: None})
+    data['Latitude'] = data['GeographicLocation'].apply(lambda x: float(x['Latitude']))
+    data['Longitude'] = data['GeographicLocation'].apply(lambda x: float(x['Longitude']))
+    data = data[columns]
+    return [data.iloc[i].to_dict() for i in range(len(data))]
+
+
+def normalise_listings_vectorised(data):
+    return fetch_and_store.listings_to_records(fetch_and_store.normalise_listings(data))
+
+
+def make_frame(n_listings):
+    listings = synthetic.make_listings(n_listings)
+    for listing, price_display in zip(listings, EDGE_CASE_PRICES):
+        listing['PriceDisplay'] = price_display
+    # Straddle the NZ daylight saving changeovers.
+    listings[-1]['StartDate'] = '/Date(1712412000000)/'
+    listings[-2]['StartDate'] = '/Date(1727531999999)/'
+    listings[-3]['StartDate'] = '/Date(1727532000000)/'
+    return pd.DataFrame.from_dict(listings)
+
+
+def same_value(a, b):
+    if isinstance(a, float) and isinstance(b, float):
+        return a == b or (np.isnan(a) and np.isnan(b))
+    return a == b and (a is None) == (b is None)
+
+
+def find_mismatches(expected, actual):
+    mismatches = []
+    for i, (expected_row, actual_row) in enumerate(zip(expected, actual)):
+        for column, value in expected_row.items():
+            if not same_value(value, actual_row[column]):
+                mismatches.append((i, column, value, actual_row[column]))
+    return mismatches
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=100000)
+    args = parser.parse_args()
+    load_dotenv('config.env')
+
+    data = make_frame(args.listings)
+    results = {}
+    for normalise in (normalise_listings_rowwise, normalise_listings_vectorised):
+        start = time.perf_counter()
+        results[normalise] = normalise(data)
+        print(f'{normalise.__name__:>30}: {time.perf_counter() - start:6.2f}s for {len(data)} listings')
+
+    mismatches = find_mismatches(results[normalise_listings_rowwise], results[normalise_listings_vectorised])
+    for row, column, expected, actual in mismatches[:20]:
+        print(f'row {row} {column}: expected {expected!r}, got {actual!r}')
+    print(f'{len(mismatches)} mismatched values')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,135 @@
+"""Dashboard filtering: the mask chains update_graphs used vs. the indexed, cached query in query_engine.py.
+
+Replays random filter states, half of them repeated, and exits non-zero if any filtered frame or dropdown cascade
+differs.
+
+    python -m benchmarks.query_engine --listings 200000 --queries 200
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+
+import query_engine
+import snapshot
+from benchmarks import synthetic
+
+
+def filter_with_masks(data, drill_down, start_date, end_date, region, district, suburb, price_range, bedroom_range,
+                      bathroom_range, property_type):
+    # The filtering update_graphs did before query_engine.py.
+    if drill_down is None:
+        filtered_data = data[data['StartDate'] <= end_date]
+    else:
+        filtered_data = data[data[drill_down[0]] == drill_down[1]]
+        filtered_data = filtered_data[(filtered_data['EndDate'] >= start_date)]
+        filtered_data = filtered_data[(filtered_data['StartDate'] <= end_date)]
+    filtered_data = filtered_data[~((filtered_data['LastUpdatedAt'] < start_date)
+                                  & (filtered_data['ListingStatus'] == 'Delisted'))]
+    filtered_data_with_nulls = filtered_data
+    for column, value, all_label in [('Region', region, 'All Regions'), ('District', district, 'All Districts'),
+                                     ('Suburb', suburb, 'All Suburbs')]:
+        if value != all_label and value and all_label not in value:
+            filtered_data = filtered_data[filtered_data[column].isin(value)]
+            filtered_data_with_nulls = filtered_data_with_nulls[filtered_data_with_nulls[column].isin(value)
+                                                                | filtered_data_with_nulls[column].isnull()]
+    for column, (low, high) in [('Price', price_range), ('Bedrooms', bedroom_range), ('Bathrooms', bathroom_range)]:
+        filtered_data = filtered_data[(filtered_data[column] >= low) & (filtered_data[column] <= high)]
+        filtered_data_with_nulls = filtered_data_with_nulls[((filtered_data_with_nulls[column] >= low)
+                                                             & (filtered_data_with_nulls[column] <= high))
+                                                            | filtered_data_with_nulls[column].isnull()]
+    if property_type != 'All Property Types' and property_type:
+        filtered_data = filtered_data[filtered_data['PropertyType'].isin(property_type)]
+        filtered_data_with_nulls = filtered_data_with_nulls[filtered_data_with_nulls['PropertyType']
+                                                            .isin(property_type)
+                                                            | filtered_data_with_nulls['PropertyType'].isnull()]
+    return filtered_data, filtered_data_with_nulls
+
+
+def dropdowns_with_masks(data, region, district, suburb):
+    filtered_data = data
+    if not (region == 'All Regions' or not region or 'All Regions' in region):
+        filtered_data = filtered_data[filtered_data['Region'].isin(region)]
+    districts = list(filtered_data['District'].unique())
+    if not (district == 'All Districts' or not district or 'All Districts' in district):
+        filtered_data = filtered_data[filtered_data['District'].isin(district)]
+    suburbs = list(filtered_data['Suburb'].unique())
+    if not (suburb == 'All Suburbs' or not suburb or 'All Suburbs' in suburb):
+        filtered_data = filtered_data[filtered_data['Suburb'].isin(suburb)]
+    return districts, suburbs, list(filtered_data['PropertyType'].unique())
+
+
+def pick(rng, values, all_label):
+    choice = rng.integers(4)
+    if choice == 0:
+        return all_label
+    if choice == 1:
+        return []
+    return sorted(rng.choice(values, size=min(len(values), choice - 1), replace=False).tolist())
+
+
+def random_filter_state(rng, data):
+    regions = data['Region'].dropna().unique().tolist()
+    region = pick(rng, regions, 'All Regions')
+    districts = []
+    if isinstance(region, list) and region:
+        districts = data.loc[data['Region'].isin(region), 'District'].dropna().unique().tolist()
+    district = pick(rng, districts, 'All Districts') if districts else 'All Districts'
+    dates = data['LastUpdatedAt'].dropna()
+    start_date, end_date = sorted(rng.choice(dates.dt.strftime('%Y-%m-%d').unique(), size=2))
+    drill_down = None
+    if rng.random() < 0.3:
+        column = ['Region', 'District', 'Suburb'][rng.integers(3)]
+        drill_down = (column, rng.choice(data[column].dropna().unique().tolist()))
+    price_max = float(data['Price'].max())
+    low = round(float(rng.uniform(0, price_max / 2)), 1)
+    property_types = data['PropertyType'].dropna().unique().tolist()
+    property_type = pick(rng, property_types, 'All Property Types')
+    return (drill_down, start_date, end_date, region, district, 'All Suburbs', [low, price_max],
+            [int(rng.integers(0, 3)), 6], [0, int(rng.integers(1, 4))], property_type)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=200000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    data = synthetic.make_dash_view(args.listings)
+    # Some rows with no location, to cover the null-tolerant filters.
+    rng = np.random.default_rng(1)
+    for column in ['Region', 'District', 'Suburb', 'PropertyType']:
+        data.loc[rng.random(len(data)) < 0.01, column] = None
+    data = snapshot.prepare_dash_view(data)
+
+    start = time.perf_counter()
+    engine = query_engine.QueryEngine(data, cache_size=args.queries)
+    build_time = time.perf_counter() - start
+    states = [random_filter_state(rng, data) for _ in range(args.queries // 2)]
+    states = states + [states[i] for i in rng.permutation(len(states))]
+
+    old_time = new_time = 0
+    mismatches = 0
+    for state in states:
+        start = time.perf_counter()
+        expected = filter_with_masks(data, *state)
+        old_time += time.perf_counter() - start
+        start = time.perf_counter()
+        actual = engine.filter(query_engine.normalise_filters(*state))
+        new_time += time.perf_counter() - start
+        if any(not expected_frame.index.equals(actual_frame.index)
+               for expected_frame, actual_frame in zip(expected, actual)):
+            mismatches += 1
+        if engine.dropdown_options(*state[3:5], state[5]) != dropdowns_with_masks(data, *state[3:5], state[5]):
+            mismatches += 1
+
+    print(f'index build: {build_time:.3f}s for {len(data)} rows')
+    print(f'{len(states)} queries: mask chains {old_time:.2f}s, query engine {new_time:.2f}s '
+          f'({engine.positions.cache_info().hits} cache hits)')
+    print(f'mismatches: {mismatches}')
+    sys.exit(1 if mismatches else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,72 @@
+"""Reconcile delistings against a fake PostgREST endpoint, old single-request version vs. the chunked stage.
+
+The stub caps URLs at --max-url-kb like a real proxy would, and serves at most 1000 rows per select.
+
+    python -m benchmarks.reconcile --listed 200000 --delisted 20000
+"""
+import argparse
+import time
+
+import numpy as np
+from postgrest.exceptions import APIError
+
+import fetch_and_store
+from benchmarks.stub_servers import PostgRESTStubServer
+
+
+def reconcile_single_request(listing_ids, supabase):
+    # reconcile_delisted_listings before pagination and chunking.
+    db_listings = supabase.table('Listings').select('ListingId').eq('ListingStatus', 'Listed').execute()
+    delisted_listings = set(x['ListingId'] for x in db_listings.data) - set(listing_ids)
+    supabase.table('Listings').update({'ListingStatus': 'Delisted'}).in_('ListingId', delisted_listings).execute()
+    return delisted_listings
+
+
+def seed_listings(server, n_listed):
+    server.tables['Listings'] = {listing_id: {'ListingId': listing_id, 'ListingStatus': 'Listed'}
+                                 for listing_id in range(4000000000, 4000000000 + n_listed)}
+
+
+def count_delisted(server):
+    return sum(row['ListingStatus'] == 'Delisted' for row in server.tables['Listings'].values())
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listed', type=int, default=200000)
+    parser.add_argument('--delisted', type=int, default=20000)
+    parser.add_argument('--max-url-kb', type=int, default=8)
+    parser.add_argument('--latency', type=float, default=0.005)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    all_ids = np.arange(4000000000, 4000000000 + args.listed)
+    fetched_ids = rng.permutation(np.setdiff1d(all_ids, rng.choice(all_ids, args.delisted, replace=False)))
+
+    with PostgRESTStubServer(args.latency, max_url_bytes=args.max_url_kb * 1024) as server:
+        supabase = server.connect()
+        seed_listings(server, args.listed)
+        start = time.perf_counter()
+        try:
+            reconcile_single_request(fetched_ids, supabase)
+            outcome = f'{count_delisted(server)} delisted'
+        except APIError as e:
+            outcome = f'failed: {e.message}'
+        print(f'single request: {time.perf_counter() - start:.2f}s, {outcome}')
+
+        seed_listings(server, args.listed)
+        dry_run = fetch_and_store.reconcile_delisted_listings(fetched_ids, supabase, dry_run=True)
+        server.requests = 0
+        start = time.perf_counter()
+        fetch_and_store.reconcile_delisted_listings(fetched_ids, supabase)
+        print(f'chunked: {time.perf_counter() - start:.2f}s over {server.requests} requests, '
+              f'{count_delisted(server)} delisted (dry run said {len(dry_run.delisted_listings)})')
+
+        try:
+            fetch_and_store.reconcile_delisted_listings(fetched_ids[:len(fetched_ids) // 2], supabase, dry_run=True)
+        except fetch_and_store.ReconcileGuardError as e:
+            print(f'guard on a half-sized fetch: {e}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,241 @@
+"""Replay the nightly ingest, fetch_and_store.run() as the GitHub Actions job runs it, offline and write a JSON report.
+
+TradeMe is replaced by an OAuth1-checking stub serving synthetic pages (or pages recorded from the live API), and
+Supabase by the PostgREST stub, whose dash_view is the Listings table itself. Both run in child processes so only
+the pipeline's own memory is measured. Every size gets a fresh database seeded with a --delisted share of extra
+listings that the fetch won't return, so reconcile has work to do, and a fresh manifest, checkpoint and archive.
+Stage times come from the pipeline's own metrics: `fetch` is the time spent waiting on TradeMe pages, and
+`store_batches` includes it.
+
+    python -m benchmarks.replay record --out recordings/today
+    python -m benchmarks.replay run --listings 10000 100000 1000000 --report replay.json
+    python -m benchmarks.replay run --recording recordings/today --compare replay.json
+
+With --compare, the run exits non-zero if any stage got more than --tolerance slower than in the earlier report.
+"""
+import argparse
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from functools import partial
+from urllib.parse import parse_qs, urlsplit
+
+from requests_oauthlib import OAuth1Session
+
+import fetch_and_store
+import metrics
+from benchmarks.stub_servers import (SEARCH_PATH, PostgRESTStubServer, StubProcess, TradeMeStubServer,
+                                     connect_to_stub, get_recorded_page_path)
+
+
+class RecordingSession:
+    # Wraps a TradeMe session and writes the raw body of every page it fetches to `directory`.
+    def __init__(self, session, directory):
+        self.session = session
+        self.directory = directory
+
+    def get(self, url, **kwargs):
+        response = self.session.get(url, **kwargs)
+        if response.status_code == 200:
+            page = int(parse_qs(urlsplit(url).query).get('page', ['1'])[0])
+            with open(get_recorded_page_path(self.directory, page), 'wb') as f:
+                f.write(response.content)
+        return response
+
+
+def record(directory):
+    os.makedirs(directory, exist_ok=True)
+    url = os.getenv('TRADEME_HOUSES_URL')
+    trademe = RecordingSession(fetch_and_store.connect_to_trademe(), directory)
+    pages = fetch_and_store.iter_trademe_pages(
+        trademe, url, session_factory=lambda: RecordingSession(fetch_and_store.connect_to_trademe(), directory))
+    listings = sum(len(page) for _, page in pages)
+    print(f'Recorded {listings} listings to {directory}')
+
+
+class PeakMemory(threading.Thread):
+    # Samples this process's resident set size until stopped.
+    def __init__(self, interval=0.01):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+        self.start_rss = self.peak_rss = get_rss()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak_rss = max(self.peak_rss, get_rss())
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+        self.peak_rss = max(self.peak_rss, get_rss())
+
+
+def get_rss():
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except OSError:
+        # No /proc: fall back to the high-water mark, which is in KiB on Linux and bytes on macOS.
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak if sys.platform == 'darwin' else peak * 1024
+
+
+def stage_seconds(before, after):
+    # The stage_seconds totals recorded between two metrics snapshots.
+    seconds = {}
+    for key, (_, total, _) in after[1].items():
+        name, labels = key
+        if name == 'stage_seconds':
+            seconds[dict(labels)['stage']] = total - before[1].get(key, [0, 0.0, 0.0])[1]
+    return seconds
+
+
+def seed_listed(first_id, count, updated_at, server):
+    # Listings the database thinks are listed but the fetch won't return. The aggregate tables are built from
+    # dash_view, which here is the Listings table itself.
+    server.tables['Listings'] = {listing_id: {'ListingId': listing_id, 'ListingStatus': 'Listed',
+                                              'LastUpdatedAt': updated_at}
+                                 for listing_id in range(first_id, first_id + count)}
+    server.tables['dash_view'] = server.tables['Listings']
+
+
+def connect_to_trademe_stub():
+    # The stub checks that requests are signed, so signing costs the same as against the real API.
+    return OAuth1Session('stub-key', 'stub-secret')
+
+
+def replay(args, listings):
+    trademe_kwargs = {'latency': args.trademe_latency, 'require_oauth': True}
+    if args.recording:
+        trademe_kwargs['recording'] = args.recording
+        with open(get_recorded_page_path(args.recording, 1)) as f:
+            listings = json.load(f)['TotalCount']
+    else:
+        trademe_kwargs['total_count'] = listings
+    # Synthetic and real ListingIds are both far above 1000000000, so the seeded ones never collide.
+    updated_at = datetime.now().isoformat(timespec='seconds')
+    setup = partial(seed_listed, 1000000000, int(listings * args.delisted), updated_at)
+    metrics.configure()
+    with StubProcess(TradeMeStubServer, **trademe_kwargs) as trademe_stub, \
+            StubProcess(PostgRESTStubServer, setup=setup, latency=args.supabase_latency,
+                        defaults={'Listings': {'ListingStatus': 'Listed', 'LastUpdatedAt': updated_at}}
+                        ) as supabase_stub, tempfile.TemporaryDirectory() as directory:
+        supabase = connect_to_stub(supabase_stub.base_url)
+        url = f'{trademe_stub.base_url}{SEARCH_PATH}'
+        before = metrics.registry.snapshot()
+        memory = PeakMemory()
+        memory.start()
+        start = time.perf_counter()
+        try:
+            report = fetch_and_store.run(
+                connect_to_trademe_stub(), url, supabase, incremental=True, archive=True,
+                manifest_path=os.path.join(directory, 'listing_manifest.sqlite'),
+                archive_path=os.path.join(directory, 'listing_archive'),
+                work_dir=os.path.join(directory, 'ingest_work'), max_workers=args.workers,
+                requests_per_second=args.rate, session_factory=connect_to_trademe_stub)
+        finally:
+            seconds = time.perf_counter() - start
+            memory.stop()
+    stages = {name: {'seconds': round(total, 3)}
+              for name, total in stage_seconds(before, metrics.registry.snapshot()).items()}
+    for name, stage in stages.items():
+        print(f'  {name:>27}: {stage["seconds"]:8.2f}s')
+    print(f'  {"run":>27}: {seconds:8.2f}s, peak RSS {memory.peak_rss / 2 ** 20:8.1f} MiB')
+    return {
+        'listings': report.listing_count,
+        'stages': stages,
+        'total_seconds': round(seconds, 3),
+        'peak_rss_mib': round(memory.peak_rss / 2 ** 20, 1),
+        'rss_growth_mib': round((memory.peak_rss - memory.start_rss) / 2 ** 20, 1),
+        'rows_stored': report.upsert_report.rows_written,
+        'failed_batches': report.failed_batches,
+        'delisted': len(report.reconcile_report.delisted_listings),
+    }
+
+
+def get_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def find_regressions(runs, previous, tolerance):
+    regressions = []
+    previous_runs = {run['listings']: run for run in previous['runs']}
+    for run in runs:
+        earlier = previous_runs.get(run['listings'])
+        if earlier is None:
+            continue
+        for name, stage in run['stages'].items():
+            before = earlier['stages'].get(name, {}).get('seconds')
+            if before and stage['seconds'] > before * (1 + tolerance):
+                regressions.append(f'{name} at {run["listings"]} listings: {before:.2f}s -> {stage["seconds"]:.2f}s')
+    return regressions
+
+
+def run(args):
+    sizes = [None] if args.recording else args.listings
+    runs = []
+    for listings in sizes:
+        print(f'Replaying {args.recording or f"{listings} synthetic listings"}')
+        runs.append(replay(args, listings))
+    report = {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'commit': get_commit(),
+        'python': platform.python_version(),
+        'platform': platform.platform(),
+        'source': args.recording or 'synthetic',
+        'settings': {'workers': args.workers, 'rate': args.rate, 'trademe_latency': args.trademe_latency,
+                     'supabase_latency': args.supabase_latency, 'delisted': args.delisted},
+        'runs': runs,
+    }
+    failed = [f'{run["failed_batches"]} failed batches at {run["listings"]} listings'
+              for run in runs if run['failed_batches']]
+    if args.compare:
+        # Read before writing, in case the report overwrites the file being compared against.
+        with open(args.compare) as f:
+            failed += find_regressions(runs, json.load(f), args.tolerance)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f'Wrote {args.report}')
+    for failure in failed:
+        print(failure)
+    sys.exit(1 if failed else 0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest='command', required=True)
+    recorder = commands.add_parser('record', help='Fetch every page from the live TradeMe API and save it.')
+    recorder.add_argument('--out', required=True, help='Directory to write page-00001.json, ... to.')
+    runner = commands.add_parser('run', help='Replay the pipeline against the stubs.')
+    runner.add_argument('--listings', type=int, nargs='+', default=[10000, 100000, 1000000])
+    runner.add_argument('--recording', help='Serve the pages saved by `record` instead of synthetic ones.')
+    runner.add_argument('--delisted', type=float, default=0.02,
+                        help='Extra listings seeded as listed in the database, as a share of those fetched.')
+    runner.add_argument('--workers', type=int, default=8)
+    runner.add_argument('--rate', type=float, default=100, help='Requests per second allowed by the token bucket.')
+    runner.add_argument('--trademe-latency', type=float, default=0.02)
+    runner.add_argument('--supabase-latency', type=float, default=0.005)
+    runner.add_argument('--report', default='replay_report.json')
+    runner.add_argument('--compare', help='Earlier report to check each stage against.')
+    runner.add_argument('--tolerance', type=float, default=0.2)
+    args = parser.parse_args()
+    if args.command == 'record':
+        record(args.out)
+    else:
+        run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Memory per gunicorn worker, with every worker loading its own snapshot vs. mapping the shared store.
+
+Runs `gunicorn -c gunicorn.conf.py dashboard:server` on a synthetic dataset for each worker count, warms every
+worker up with a few load_test browsing sessions and then reads each worker's /proc/<pid>/smaps_rollup. RSS counts
+shared pages in full for every process; PSS splits them between the processes mapping them, so the PSS total is
+what the workers cost together; USS is the memory only that worker holds. In shared mode the script then
+publishes a new version and times how long it takes every worker to report it on /healthz.
+
+    python -m benchmarks.serving --listings 200000 --workers 4 8
+"""
+import argparse
+import json
+import os
+import signal
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import requests
+
+from benchmarks import load_test
+from benchmarks import synthetic
+
+# The synthetic dataset's newest LastUpdatedAt; the swap publishes a day later.
+END = datetime(2024, 6, 1)
+GUNICORN_CONF = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'gunicorn.conf.py')
+
+
+def publish_dataset(listings, directory, end):
+    import shared_store
+    import snapshot
+
+    raw = synthetic.make_dash_view(listings, end=end)
+    data = snapshot.prepare_dash_view(raw.copy())
+    # The aggregate tables go in first, so a worker swapping to the version finds them.
+    path = os.path.join(directory, shared_store.get_version_name(data))
+    os.makedirs(path, exist_ok=True)
+    load_test.write_aggregates(raw, os.path.join(path, shared_store.SNAPSHOT_FILE))
+    return shared_store.publish(data, directory)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def child_pids(pid):
+    children = []
+    for entry in os.listdir('/proc'):
+        if entry.isdigit():
+            try:
+                with open(f'/proc/{entry}/stat') as f:
+                    # The command name is in parentheses and may hold spaces; the parent pid is two fields after it.
+                    if int(f.read().rsplit(')', 1)[1].split()[1]) == pid:
+                        children.append(int(entry))
+            except (FileNotFoundError, ProcessLookupError):
+                continue
+    return sorted(children)
+
+
+def memory(pid):
+    fields = {}
+    with open(f'/proc/{pid}/smaps_rollup') as f:
+        for line in f:
+            parts = line.split()
+            if len(parts) == 3 and parts[2] == 'kB':
+                fields[parts[0].rstrip(':')] = int(parts[1]) / 1024
+    return {'rss_mb': fields['Rss'], 'pss_mb': fields['Pss'],
+            'uss_mb': fields['Private_Clean'] + fields['Private_Dirty']}
+
+
+class GunicornProcess:
+    def __init__(self, workers, env, log_path=os.devnull):
+        self.port = free_port()
+        self.base_url = f'http://127.0.0.1:{self.port}'
+        self.command = [sys.executable, '-m', 'gunicorn', '-c', GUNICORN_CONF, '-w', str(workers),
+                        '-b', f'127.0.0.1:{self.port}', 'dashboard:server']
+        self.workers = workers
+        self.env = env
+        self.log_path = log_path
+        self.process = None
+
+    def __enter__(self):
+        self.log = open(self.log_path, 'w')
+        self.process = subprocess.Popen(self.command, env=self.env, stdout=self.log, stderr=subprocess.STDOUT,
+                                        cwd=os.path.dirname(GUNICORN_CONF))
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.send_signal(signal.SIGTERM)
+        self.process.wait()
+        self.log.close()
+
+    def health(self, timeout, until=None):
+        # Polls /healthz from many connections at once until every worker has answered (with `until` version).
+        seen = {}
+        deadline = time.monotonic() + timeout
+        with ThreadPoolExecutor(max_workers=self.workers * 4) as executor:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f'gunicorn exited with {self.process.returncode}')
+                for response in executor.map(self.get_health, range(self.workers * 4)):
+                    if response and (until is None or response['version'] == until):
+                        seen[response['pid']] = response
+                if len(seen) == self.workers:
+                    return seen
+                time.sleep(0.1)
+        raise TimeoutError(f'{len(seen)} of {self.workers} workers answered within {timeout}s')
+
+    def get_health(self, _):
+        try:
+            return requests.get(f'{self.base_url}/healthz', timeout=5).json()
+        except requests.RequestException:
+            return None
+
+
+def warm_up(base_url, clients, sessions, steps):
+    layout = requests.get(f'{base_url}/_dash-layout').json()
+    callbacks = load_test.fetch_callbacks(base_url, layout)
+    recorder = load_test.Recorder()
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        futures = [executor.submit(load_test.run_client, base_url, layout, callbacks, recorder, seed, sessions, steps)
+                   for seed in range(clients)]
+        for future in futures:
+            future.result()
+    return sum(sample[2] >= 500 for samples in recorder.samples.values() for sample in samples)
+
+
+def run(mode, workers, args, directory):
+    shared_dir = os.path.join(directory, 'shared')
+    if mode == 'shared':
+        publish_dataset(args.listings, shared_dir, END)
+    else:
+        load_test.write_dataset(args.listings, directory, True)
+    env = dict(os.environ, DASHBOARD_REFRESH_SECONDS='0', DASHBOARD_SWAP_CHECK_SECONDS='1',
+               SUPABASE_URL='http://127.0.0.1:9', SUPABASE_API_KEY='stub.stub.stub',
+               DASHBOARD_SHARED_DIR=shared_dir if mode == 'shared' else '',
+               DASHBOARD_SNAPSHOT_PATH=os.path.join(directory, 'dash_view.arrow'))
+    result = {'mode': mode, 'workers': workers}
+    with GunicornProcess(workers, env, args.server_log) as server:
+        start = time.perf_counter()
+        server.health(args.timeout)
+        result['startup_seconds'] = round(time.perf_counter() - start, 2)
+        result['errors'] = int(warm_up(server.base_url, workers * 2, args.sessions, args.steps))
+        pids = child_pids(server.process.pid)
+        result['per_worker'] = [memory(pid) for pid in pids]
+        result['master'] = memory(server.process.pid)
+        if mode == 'shared':
+            start = time.perf_counter()
+            name = publish_dataset(args.listings, shared_dir, END + timedelta(days=1))
+            server.health(args.timeout, until=name)
+            result['swap_seconds'] = round(time.perf_counter() - start, 2)
+    for key in ('rss_mb', 'pss_mb', 'uss_mb'):
+        values = [worker[key] for worker in result['per_worker']]
+        result[f'mean_{key}'] = round(sum(values) / len(values), 1)
+    result['total_pss_mb'] = round(sum(worker['pss_mb'] for worker in result['per_worker']) +
+                                   result['master']['pss_mb'], 1)
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=int, default=200000)
+    parser.add_argument('--workers', type=int, nargs='+', default=[4, 8])
+    parser.add_argument('--modes', nargs='+', choices=['per-worker', 'shared'], default=['per-worker', 'shared'])
+    parser.add_argument('--sessions', type=int, default=1, help='Warm-up page loads per client.')
+    parser.add_argument('--steps', type=int, default=5, help='User actions per warm-up page load.')
+    parser.add_argument('--timeout', type=float, default=120, help='Seconds to wait for every worker.')
+    parser.add_argument('--server-log', default=os.devnull, help="File for gunicorn's own log.")
+    parser.add_argument('--report', help='Write the results as JSON.')
+    args = parser.parse_args()
+
+    results = []
+    for workers in args.workers:
+        for mode in args.modes:
+            with tempfile.TemporaryDirectory() as directory:
+                result = run(mode, workers, args, directory)
+            results.append(result)
+            print(f'{mode:>10}, {workers} workers: RSS {result["mean_rss_mb"]:.0f} MiB, '
+                  f'PSS {result["mean_pss_mb"]:.0f} MiB, USS {result["mean_uss_mb"]:.0f} MiB per worker; '
+                  f'{result["total_pss_mb"]:.0f} MiB PSS in all; up in {result["startup_seconds"]:.1f}s'
+                  + (f'; new version on every worker in {result["swap_seconds"]:.1f}s' if 'swap_seconds' in result
+                     else '') + (f'; {result["errors"]} errors' if result['errors'] else ''))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'listings': args.listings, 'runs': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Dashboard start-up time and resident memory, pulling dash_view over the network vs. loading the local snapshot,
+with the data loaded while dashboard.py is imported vs. in the background (DASHBOARD_DEFERRED_LOAD=1).
+
+Each case imports dashboard.py in a fresh interpreter against a fake PostgREST endpoint serving synthetic rows and
+splits the start-up into:
+
+    import      importing dashboard.py, after which the server can bind
+    data ready  from the start of the import until the dataset and the full layout are in
+    render      the first full page load once the data is ready: the layout, the dependencies and every callback
+                dash-renderer calls on load
+
+    python -m benchmarks.startup --listings 50000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+from benchmarks import synthetic
+from benchmarks.stub_servers import PostgRESTStubServer
+
+CHILD = '''
+import json, random, threading, time
+start = time.perf_counter()
+import dashboard
+imported = time.perf_counter() - start
+while not dashboard.data_ready.wait(0.01):
+    if dashboard.load_error is not None:
+        raise dashboard.load_error
+ready = time.perf_counter() - start
+
+import requests
+from werkzeug.serving import make_server
+from benchmarks import load_test
+server = make_server('127.0.0.1', 0, dashboard.server, threaded=True)
+threading.Thread(target=server.serve_forever, daemon=True).start()
+base_url = f'http://127.0.0.1:{server.server_port}'
+render_start = time.perf_counter()
+layout = requests.get(f'{base_url}/_dash-layout').json()
+recorder = load_test.Recorder()
+client = load_test.DashClient(base_url, layout, load_test.fetch_callbacks(base_url, layout), recorder,
+                              random.Random(0))
+client.load()
+render = time.perf_counter() - render_start
+server.shutdown()
+errors = sum(sample[2] >= 500 for samples in recorder.samples.values() for sample in samples)
+rss_kb = next(int(line.split()[1]) for line in open('/proc/self/status') if line.startswith('VmRSS'))
+print(json.dumps({'import_seconds': imported, 'ready_seconds': ready, 'render_seconds': render,
+                  'data_load_seconds': dashboard.startup_timings['data_load'], 'rss_mb': rss_kb / 1024,
+                  'rows': len(dashboard.data), 'errors': int(errors)}))
+'''
+
+
+def measure_startup(env):
+    output = subprocess.run([sys.executable, '-c', CHILD], env=env, capture_output=True, text=True, check=True)
+    return json.loads(output.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--listings', type=int, default=50000)
+    parser.add_argument('--latency', type=float, default=0.05, help='Seconds per PostgREST request.')
+    parser.add_argument('--report', help='Write the results as JSON.')
+    args = parser.parse_args()
+
+    results = []
+    for deferred in (False, True):
+        # A fresh snapshot path per mode, so each starts with a network pull that writes the snapshot.
+        with PostgRESTStubServer(args.latency) as server, tempfile.TemporaryDirectory() as directory:
+            rows = synthetic.dash_view_rows(synthetic.make_dash_view(args.listings))
+            server.tables['dash_view'] = {row['ListingId']: row for row in rows}
+            env = dict(os.environ, SUPABASE_URL=server.base_url, SUPABASE_API_KEY='stub.stub.stub',
+                       DASHBOARD_SNAPSHOT_PATH=os.path.join(directory, 'dash_view.arrow'),
+                       DASHBOARD_REFRESH_SECONDS='0', DASHBOARD_SHARED_DIR='',
+                       DASHBOARD_DEFERRED_LOAD='1' if deferred else '0')
+            for source in ('network pull', 'snapshot'):
+                result = {'source': source, 'deferred': deferred, **measure_startup(env)}
+                results.append(result)
+                print(f'{source:>12}, {"deferred" if deferred else "eager":>8}: {result["rows"]} rows, '
+                      f'import {result["import_seconds"]:.2f}s, data ready {result["ready_seconds"]:.2f}s '
+                      f'(load {result["data_load_seconds"]:.2f}s), render {result["render_seconds"]:.2f}s, '
+                      f'RSS {result["rss_mb"]:.0f} MiB' + (f', {result["errors"]} errors' if result['errors'] else ''))
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'listings': args.listings, 'latency': args.latency, 'runs': results}, f, indent=2)
+
+
+if __name__ == '__main__':
+    main()
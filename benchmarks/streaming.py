@@ -0,0 +1,81 @@
+"""Time and peak memory of assembling synthetic TradeMe pages into normalised listings.
+
+Compares the old page-by-page pd.concat followed by one big normalisation pass with the streaming
+batch pipeline, either consumed batch by batch (as the nightly job does) or concatenated once.
+
+    python -m benchmarks.streaming --listings 50000 500000
+"""
+import argparse
+import time
+import tracemalloc
+
+import pandas as pd
+from dotenv import load_dotenv
+
+import fetch_and_store
+from benchmarks import synthetic
+
+
+TEMPLATE_PAGES = [synthetic.make_page(page, 500, 10 * 500)['List'] for page in range(1, 11)]
+
+
+def iter_synthetic_pages(n_listings, page_size=500):
+    # Recycle a few generated pages with fresh ListingIds so page generation doesn't dominate the timings.
+    n_pages = int(n_listings/page_size) + 1
+    for page in range(1, n_pages + 1):
+        first = (page - 1) * page_size
+        template = TEMPLATE_PAGES[page % len(TEMPLATE_PAGES)][:min(page_size, n_listings - first)]
+        yield page, [dict(listing, ListingId=first + i) for i, listing in enumerate(template)]
+
+
+def concat_then_normalise(n_listings):
+    data_df = None
+    for _, listings in iter_synthetic_pages(n_listings):
+        page_df = pd.DataFrame.from_dict(listings)
+        data_df = page_df if data_df is None else pd.concat([data_df, page_df], ignore_index=True)
+    return len(fetch_and_store.normalise_listings(data_df.drop_duplicates(subset=['ListingId'])))
+
+
+def stream_to_sink(n_listings):
+    rows = 0
+    for batch in fetch_and_store.iter_listing_batches(iter_synthetic_pages(n_listings)):
+        rows += len(batch)
+    return rows
+
+
+def stream_then_concat(n_listings):
+    batches = fetch_and_store.iter_listing_batches(iter_synthetic_pages(n_listings))
+    return len(pd.concat(batches, ignore_index=True))
+
+
+def measure(function, n_listings):
+    # Timed without tracemalloc, which slows allocation-heavy code down several times over.
+    start = time.perf_counter()
+    rows = function(n_listings)
+    elapsed = time.perf_counter() - start
+    tracemalloc.start()
+    function(n_listings)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return rows, elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, nargs='+', default=[50000, 500000])
+    parser.add_argument('--skip-baseline', action='store_true')
+    args = parser.parse_args()
+    load_dotenv('config.env')
+
+    strategies = [stream_to_sink, stream_then_concat]
+    if not args.skip_baseline:
+        strategies.insert(0, concat_then_normalise)
+    for n_listings in args.listings:
+        for strategy in strategies:
+            rows, elapsed, peak = measure(strategy, n_listings)
+            print(f'{strategy.__name__:>22} {n_listings:>8} listings: {rows:>8} rows '
+                  f'{elapsed:7.2f}s  peak {peak / 2**20:8.1f} MiB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,335 @@
+import json
+import multiprocessing
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from supabase import create_client
+
+from benchmarks import synthetic
+
+
+SEARCH_PATH = '/v1/Search/Property/Residential.json?rows=500&return_metadata=false'
+
+
+def get_recorded_page_path(directory, page):
+    return os.path.join(directory, f'page-{page:05d}.json')
+
+
+def connect_to_stub(base_url):
+    # supabase-py only checks that the key looks like a JWT.
+    return create_client(base_url, 'stub.stub.stub')
+
+
+class TradeMeStubHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; without TCP_NODELAY, delayed ACKs add ~40ms to each response.
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def send_json(self, status, payload, headers=None):
+        self.send_body(status, json.dumps(payload).encode(), headers)
+
+    def send_body(self, status, body, headers=None):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        server = self.server
+        query = parse_qs(urlsplit(self.path).query)
+        page = int(query.get('page', ['1'])[0])
+        page_size = int(query.get('rows', ['500'])[0])
+        with server.lock:
+            server.requests += 1
+            request_number = server.requests
+        time.sleep(server.latency)
+        if server.require_oauth and 'oauth_signature=' not in self.headers.get('Authorization', ''):
+            self.send_json(401, {'ErrorDescription': 'Missing or invalid OAuth signature'})
+            return
+        if server.throttle_every and request_number % server.throttle_every == 0:
+            self.send_json(429, {'ErrorDescription': 'Too many requests'}, {'Retry-After': str(server.retry_after)})
+            return
+        if server.recording:
+            path = get_recorded_page_path(server.recording, page)
+            if not os.path.exists(path):
+                self.send_json(404, {'ErrorDescription': f'Page {page} was not recorded'})
+                return
+            with open(path, 'rb') as f:
+                self.send_body(200, f.read())
+            return
+        self.send_json(200, synthetic.make_page(page, page_size, server.total_count, server.seed))
+
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, handler, latency, port=0):
+        super().__init__(('127.0.0.1', port), handler)
+        self.latency = latency
+        self.requests = 0
+        self.lock = threading.Lock()
+
+    @property
+    def base_url(self):
+        host, port = self.server_address
+        return f'http://{host}:{port}'
+
+    def __enter__(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+        self.server_close()
+
+
+class TradeMeStubServer(StubServer):
+    # Serves synthetic pages, or the raw pages in a `recording` directory. With require_oauth it rejects requests
+    # that aren't OAuth1-signed, like the real API.
+    def __init__(self, total_count=None, latency=0.05, throttle_every=0, retry_after=1, seed=0, port=0,
+                 recording=None, require_oauth=False):
+        super().__init__(TradeMeStubHandler, latency, port)
+        if recording:
+            with open(get_recorded_page_path(recording, 1)) as f:
+                total_count = json.load(f)['TotalCount']
+        self.total_count = total_count
+        self.throttle_every = throttle_every
+        self.retry_after = retry_after
+        self.seed = seed
+        self.recording = recording
+        self.require_oauth = require_oauth
+
+    @property
+    def url(self):
+        return f'{self.base_url}{SEARCH_PATH}'
+
+
+def parse_filter_value(value):
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def parse_filter(expression):
+    operator, _, value = expression.partition('.')
+    if operator == 'in':
+        values = {parse_filter_value(v.strip('"')) for v in value.strip('()').split(',') if v}
+        return lambda cell: cell in values
+    value = parse_filter_value(value)
+    if operator == 'eq':
+        return lambda cell: cell == value
+    if operator == 'neq':
+        return lambda cell: cell != value
+    compare = {'gt': lambda cell: cell > value, 'gte': lambda cell: cell >= value,
+               'lt': lambda cell: cell < value, 'lte': lambda cell: cell <= value}[operator]
+    return lambda cell: cell is not None and compare(cell)
+
+
+class PostgRESTStubHandler(TradeMeStubHandler):
+    # Enough of PostgREST for supabase-py's select/upsert/update/delete against in-memory tables.
+    RESERVED_PARAMS = {'select', 'order', 'limit', 'offset', 'on_conflict', 'columns'}
+
+    def parse_request(self):
+        if not super().parse_request():
+            return False
+        # supabase-py sends a JSON body with every request, GETs included, so always drain it.
+        self.body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if self.server.max_url_bytes and len(self.path) > self.server.max_url_bytes:
+            self.send_json(414, {'message': 'URI too long', 'code': 'PGRST414'})
+            return False
+        url = urlsplit(self.path)
+        self.table = url.path.rsplit('/', 1)[-1]
+        self.params = parse_qs(url.query)
+        return True
+
+    def read_json(self):
+        return json.loads(self.body) if self.body else None
+
+    def row_filter(self):
+        filters = [(column, parse_filter(value)) for column, values in self.params.items()
+                   if column not in self.RESERVED_PARAMS for value in values]
+        return lambda row: all(matches(row.get(column)) for column, matches in filters)
+
+    def filtered_rows(self, rows):
+        matches = self.row_filter()
+        return [row for row in rows if matches(row)]
+
+    def candidate_rows(self, table):
+        # Look rows up by primary key when the request filters on it, the way PostgREST would use the index.
+        for value in self.params.get(self.server.primary_key, []):
+            operator, _, operand = value.partition('.')
+            if operator == 'eq':
+                keys = [parse_filter_value(operand)]
+            elif operator == 'in':
+                keys = {parse_filter_value(v.strip('"')) for v in operand.strip('()').split(',') if v}
+            else:
+                continue
+            return [table[key] for key in keys if key in table]
+        return table.values()
+
+    def sorted_keys(self, table):
+        cached = self.server.sorted_keys.get(self.table)
+        if cached is None or cached[0] is not table or len(cached[1]) != len(table):
+            cached = (table, sorted(table))
+            self.server.sorted_keys[self.table] = cached
+        return cached[1]
+
+    def keyset_rows(self, table, count):
+        # Walk the primary key in order from any gt/gte bound on it and stop after `count` matches, rather than
+        # filtering and sorting the whole table for every page.
+        keys = self.sorted_keys(table)
+        start = 0
+        for value in self.params.get(self.server.primary_key, []):
+            operator, _, operand = value.partition('.')
+            if operator in ('gt', 'gte'):
+                search = bisect_right if operator == 'gt' else bisect_left
+                start = max(start, search(keys, parse_filter_value(operand)))
+        matches = self.row_filter()
+        rows = []
+        for i in range(start, len(keys)):
+            row = table[keys[i]]
+            if matches(row):
+                rows.append(row)
+                if len(rows) == count:
+                    break
+        return rows
+
+    def fail_if_scheduled(self):
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            request_number = server.requests
+        time.sleep(server.latency)
+        if server.fail_every and request_number % server.fail_every == 0:
+            self.send_json(503, {'message': 'Service unavailable', 'code': 'PGRST000'})
+            return True
+        return False
+
+    def do_GET(self):
+        if self.fail_if_scheduled():
+            return
+        offset = int(self.params.get('offset', ['0'])[0])
+        limit = min(int(self.params.get('limit', [self.server.max_rows])[0]), self.server.max_rows)
+        with self.server.lock:
+            table = self.server.tables.get(self.table, {})
+            if self.params.get('order') in ([self.server.primary_key], [f'{self.server.primary_key}.asc']):
+                rows = self.keyset_rows(table, offset + limit)
+            else:
+                rows = self.filtered_rows(self.candidate_rows(table))
+        if 'order' in self.params:
+            # Sort by the last column first, so the stable sorts leave the first column taking precedence.
+            for order in reversed(self.params['order'][0].split(',')):
+                column, _, direction = order.partition('.')
+                rows.sort(key=lambda row: row.get(column), reverse=direction.startswith('desc'))
+        rows = rows[offset:offset + limit]
+        select = self.params.get('select', ['*'])[0]
+        if select != '*':
+            columns = select.split(',')
+            rows = [{column: row.get(column) for column in columns} for row in rows]
+        self.send_json(200, rows)
+
+    def do_POST(self):
+        if self.server.max_payload_bytes and len(self.body) > self.server.max_payload_bytes:
+            self.send_json(413, {'message': 'Payload too large', 'code': 'PGRST413'})
+            return
+        payload = self.read_json()
+        if self.fail_if_scheduled():
+            return
+        rows = payload if isinstance(payload, list) else [payload]
+        columns = self.params.get('on_conflict', [self.server.primary_key])[0].split(',')
+        with self.server.lock:
+            self.server.payload_bytes += len(self.body)
+            table = self.server.tables.setdefault(self.table, {})
+            self.server.sorted_keys.pop(self.table, None)
+            for row in rows:
+                key = row[columns[0]] if len(columns) == 1 else tuple(row[column] for column in columns)
+                table[key] = {**table.get(key, self.server.defaults.get(self.table, {})), **row}
+        self.send_json(201, [])
+
+    def do_DELETE(self):
+        if self.fail_if_scheduled():
+            return
+        with self.server.lock:
+            table = self.server.tables.get(self.table, {})
+            self.server.sorted_keys.pop(self.table, None)
+            matches = self.row_filter()
+            for key, row in list(table.items()):
+                if matches(row):
+                    del table[key]
+        self.send_json(200, [])
+
+    def do_PATCH(self):
+        payload = self.read_json()
+        if self.fail_if_scheduled():
+            return
+        with self.server.lock:
+            self.server.url_bytes += len(self.path)
+            for row in self.filtered_rows(self.candidate_rows(self.server.tables.get(self.table, {}))):
+                row.update(payload)
+        self.send_json(200, [])
+
+
+class PostgRESTStubServer(StubServer):
+    def __init__(self, latency=0.02, fail_every=0, max_payload_bytes=None, max_url_bytes=None, primary_key='ListingId',
+                 max_rows=1000, port=0, defaults=None):
+        super().__init__(PostgRESTStubHandler, latency, port)
+        # Supabase caps every select at 1000 rows by default.
+        self.max_rows = max_rows
+        self.fail_every = fail_every
+        self.max_payload_bytes = max_payload_bytes
+        self.max_url_bytes = max_url_bytes
+        self.primary_key = primary_key
+        # Column defaults per table, filled in when an upsert inserts a new row.
+        self.defaults = defaults or {}
+        self.tables = {}
+        self.sorted_keys = {}
+        self.payload_bytes = 0
+        self.url_bytes = 0
+
+    def connect(self):
+        return connect_to_stub(self.base_url)
+
+
+def serve_stub(server_class, kwargs, setup, connection):
+    server = server_class(**kwargs)
+    if setup is not None:
+        setup(server)
+    connection.send(server.base_url)
+    server.serve_forever()
+
+
+class StubProcess:
+    # Runs a stub server in a child process, so its threads and in-memory tables don't count against the
+    # memory and CPU of the process being benchmarked. `setup(server)` runs in the child before it serves.
+    def __init__(self, server_class, setup=None, **kwargs):
+        self.server_class = server_class
+        self.setup = setup
+        self.kwargs = kwargs
+        self.base_url = None
+        self.process = None
+
+    def __enter__(self):
+        parent, child = multiprocessing.Pipe()
+        self.process = multiprocessing.Process(target=serve_stub, args=(self.server_class, self.kwargs, self.setup,
+                                                                         child), daemon=True)
+        self.process.start()
+        self.base_url = parent.recv()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.process.terminate()
+        self.process.join()
@@ -0,0 +1,179 @@
+import random
+import zlib
+from datetime import datetime, timedelta
+
+import numpy as np
+import pandas as pd
+
+# A small slice of the real TradeMe locality tree, enough for realistic cardinalities in the dashboard.
+LOCALITIES = {
+    'Auckland': {
+        'Auckland City': ['Ponsonby', 'Grey Lynn', 'Mt Eden', 'Remuera', 'Epsom', 'Parnell', 'Onehunga'],
+        'North Shore City': ['Takapuna', 'Devonport', 'Albany', 'Glenfield', 'Milford'],
+        'Manukau City': ['Papatoetoe', 'Howick', 'Manurewa', 'Botany Downs'],
+        'Waitakere City': ['Henderson', 'Titirangi', 'New Lynn', 'Massey'],
+    },
+    'Wellington': {
+        'Wellington City': ['Kelburn', 'Karori', 'Newtown', 'Island Bay', 'Johnsonville', 'Thorndon'],
+        'Lower Hutt City': ['Petone', 'Eastbourne', 'Naenae', 'Wainuiomata'],
+        'Porirua City': ['Whitby', 'Titahi Bay', 'Paremata'],
+    },
+    'Canterbury': {
+        'Christchurch City': ['Riccarton', 'Fendalton', 'Sumner', 'Addington', 'Papanui', 'Halswell'],
+        'Selwyn': ['Rolleston', 'Lincoln', 'Prebbleton'],
+        'Waimakariri': ['Rangiora', 'Kaiapoi'],
+    },
+    'Waikato': {
+        'Hamilton City': ['Hamilton East', 'Chartwell', 'Rototuna', 'Hillcrest'],
+        'Thames-Coromandel': ['Whitianga', 'Thames', 'Pauanui'],
+    },
+    'Otago': {
+        'Dunedin City': ['Roslyn', 'St Clair', 'Mosgiel', 'North East Valley'],
+        'Queenstown-Lakes': ['Queenstown', 'Arrowtown', 'Wanaka'],
+    },
+    'Bay Of Plenty': {
+        'Tauranga City': ['Mount Maunganui', 'Papamoa', 'Bethlehem', 'Otumoetai'],
+        'Rotorua': ['Lynmore', 'Glenholme', 'Ngongotaha'],
+    },
+}
+
+CENTROIDS = {
+    'Auckland': (-36.85, 174.76), 'Wellington': (-41.29, 174.78), 'Canterbury': (-43.53, 172.63),
+    'Waikato': (-37.79, 175.28), 'Otago': (-45.87, 170.50), 'Bay Of Plenty': (-37.69, 176.17),
+}
+
+PROPERTY_TYPES = ['House', 'Apartment', 'Townhouse', 'Unit', 'Section', 'Lifestyle property']
+PARKING = ['Single garage', 'Double garage', 'Off street', 'Carport', '', None]
+AMENITIES = ['Close to schools', 'Close to shops', 'Sea views', 'Heat pump', '', None]
+STREETS = ['Queen Street', 'Main Road', 'Beach Road', 'Hill Street', 'Park Avenue', 'Church Street']
+
+
+def format_price_display(price, rng):
+    amount = f'${price:,.0f}'
+    variant = rng.random()
+    if variant < 0.35:
+        return f'Asking price {amount}'
+    if variant < 0.5:
+        return f'Enquiries over {amount}'
+    if variant < 0.6:
+        return amount
+    return rng.choice(['Price by negotiation', 'Auction', 'Tender', 'Deadline sale', 'To be auctioned'])
+
+
+def format_trademe_date(timestamp):
+    return f'/Date({int(timestamp.timestamp() * 1000)})/'
+
+
+def make_listing(listing_id, rng, now=None):
+    now = now or datetime(2024, 6, 1)
+    region = rng.choice(list(LOCALITIES))
+    district = rng.choice(list(LOCALITIES[region]))
+    suburb = rng.choice(LOCALITIES[region][district])
+    lat, lon = CENTROIDS[region]
+    property_type = rng.choice(PROPERTY_TYPES)
+    bedrooms = rng.choice([1, 2, 3, 3, 3, 4, 4, 5, 6]) if property_type != 'Section' else None
+    price = round(rng.lognormvariate(13.6, 0.45), -3)
+    start = now - timedelta(days=rng.randint(0, 120), minutes=rng.randint(0, 1440))
+    listing = {
+        'ListingId': listing_id,
+        'Title': f'{bedrooms or "Bare"} bedroom {property_type.lower()} in {suburb}',
+        'Category': '0350-5748-3399-',
+        'StartDate': format_trademe_date(start),
+        'EndDate': format_trademe_date(start + timedelta(days=rng.choice([28, 42, 56, 84]))),
+        'IsFeatured': rng.random() < 0.1,
+        'HasGallery': rng.random() < 0.5,
+        'PictureHref': f'https://trademe.tmcdn.co.nz/photoserver/thumb/{listing_id}.jpg',
+        'RegionId': list(LOCALITIES).index(region) + 1,
+        'Region': region,
+        'SuburbId': zlib.crc32(f'{region}/{district}/{suburb}'.encode()) % 10000,
+        'Suburb': suburb,
+        'PriceDisplay': format_price_display(price, rng),
+        'Address': f'{rng.randint(1, 300)} {rng.choice(STREETS)}',
+        'DistrictId': zlib.crc32(f'{region}/{district}'.encode()) % 100,
+        'District': district,
+        'LandArea': rng.choice([None, rng.randint(150, 2000)]),
+        'Area': rng.choice([None, rng.randint(40, 400)]),
+        'Bathrooms': rng.choice([1, 1, 2, 2, 3]) if bedrooms else None,
+        'Bedrooms': bedrooms,
+        'Parking': rng.choice(PARKING),
+        'PropertyType': property_type,
+        'TotalParking': rng.choice([None, 0, 1, 2, 3]),
+        'Amenities': rng.choice(AMENITIES),
+        'GeographicLocation': {
+            'Latitude': round(lat + rng.uniform(-0.25, 0.25), 6),
+            'Longitude': round(lon + rng.uniform(-0.25, 0.25), 6),
+            'Northing': rng.randint(4700000, 6000000),
+            'Easting': rng.randint(1100000, 2100000),
+            'Accuracy': rng.choice([1, 2, 3]),
+        },
+    }
+    # TradeMe omits empty fields rather than sending nulls.
+    return {key: value for key, value in listing.items() if value is not None}
+
+
+def make_listings(n, seed=0, start_id=4000000000):
+    rng = random.Random(seed)
+    return [make_listing(start_id + i, rng) for i in range(n)]
+
+
+def make_page(page, page_size, total_count, seed=0):
+    # Pages are generated independently so a stub server can serve any page without holding the whole set.
+    rng = random.Random(seed * 1000003 + page)
+    first = (page - 1) * page_size
+    listings = [make_listing(4000000000 + i, rng) for i in range(first, min(first + page_size, total_count))]
+    return {'TotalCount': total_count, 'Page': page, 'PageSize': page_size, 'List': listings}
+
+
+def make_dash_view(n, days=365, end=datetime(2024, 6, 1), seed=0):
+    # Rows shaped like the Supabase dash_view, generated column-wise so a few hundred thousand are cheap.
+    rng = np.random.default_rng(seed)
+    localities = [(region, district, suburb) for region, districts in LOCALITIES.items()
+                  for district, suburbs in districts.items() for suburb in suburbs]
+    region, district, suburb = (np.array(column, dtype=object)
+                                for column in zip(*[localities[i] for i in rng.integers(len(localities), size=n)]))
+    centroids = np.array([CENTROIDS[r] for r in region])
+    property_type = np.array(PROPERTY_TYPES, dtype=object)[rng.integers(len(PROPERTY_TYPES), size=n)]
+    bedrooms = rng.choice([1, 2, 3, 3, 3, 4, 4, 5, 6], size=n).astype(float)
+    bedrooms[property_type == 'Section'] = np.nan
+    bathrooms = np.where(np.isnan(bedrooms), np.nan, rng.choice([1, 1, 2, 2, 3], size=n))
+    price = np.round(rng.lognormal(13.6, 0.45, size=n), -3)
+    price[rng.random(n) < 0.4] = np.nan
+
+    end = pd.Timestamp(end)
+    start_date = end - pd.to_timedelta(rng.integers(0, days * 24 * 60, size=n), unit='min')
+    end_date = start_date + pd.to_timedelta(rng.choice([28, 42, 56, 84], size=n), unit='D')
+    delisted = (end_date < end) | (rng.random(n) < 0.05)
+    # Delisted listings were last touched on the night they dropped off TradeMe.
+    last_seen = start_date + (end_date.where(end_date < end, end) - start_date) * rng.random(n)
+    last_updated_at = last_seen.floor('D').where(delisted, end) + pd.Timedelta(hours=15)
+
+    return pd.DataFrame({
+        'ListingId': np.arange(4000000000, 4000000000 + n),
+        'Title': [f'{t} in {s}' for t, s in zip(property_type, suburb)],
+        'StartDate': start_date,
+        'EndDate': end_date,
+        'Region': region,
+        'District': district,
+        'Suburb': suburb,
+        'Price': price,
+        'Address': [f'{number} {street}' for number, street in
+                    zip(rng.integers(1, 300, size=n), np.array(STREETS)[rng.integers(len(STREETS), size=n)])],
+        'Area': np.where(rng.random(n) < 0.3, np.nan, rng.integers(40, 400, size=n)),
+        'LandArea': np.where(rng.random(n) < 0.3, np.nan, rng.integers(150, 2000, size=n)),
+        'Bedrooms': bedrooms,
+        'Bathrooms': bathrooms,
+        'PropertyType': property_type,
+        'Latitude': centroids[:, 0] + rng.uniform(-0.25, 0.25, size=n),
+        'Longitude': centroids[:, 1] + rng.uniform(-0.25, 0.25, size=n),
+        'ListingStatus': np.where(delisted, 'Delisted', 'Listed'),
+        'LastUpdatedAt': last_updated_at,
+    })
+
+
+def dash_view_rows(data):
+    # The JSON rows PostgREST would return for make_dash_view(...).
+    rows = data.copy()
+    for column in ['StartDate', 'EndDate', 'LastUpdatedAt']:
+        rows[column] = rows[column].dt.strftime('%Y-%m-%dT%H:%M:%S')
+    rows = rows.astype(object).where(rows.notna(), None)
+    return rows.to_dict('records')
@@ -0,0 +1,63 @@
+"""Daily active-listing counts and median prices: per-day scans vs. the sweep in timeseries.py.
+
+Exits non-zero if the two disagree.
+
+    python -m benchmarks.timeseries --listings 200000 --days 365
+"""
+import argparse
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+import snapshot
+import timeseries
+from benchmarks import synthetic
+
+
+def calculate_median_price(filtered_data, date):
+    # The per-day scans update_graphs used before timeseries.py.
+    active_listings = filtered_data[(filtered_data['StartDate'] <= date) & (filtered_data['EndDate'] >= date)]
+    return active_listings['Price'].median()
+
+
+def get_listing_count(filtered_data, date):
+    active_listings = filtered_data[(filtered_data['StartDate'] <= date) & (filtered_data['EndDate'] >= date)
+                                    & (filtered_data['ListingStatus'] == 'Listed')]
+    inactive_listings = filtered_data[(filtered_data['StartDate'] <= date) & (filtered_data['EndDate'] >= date)
+                                      & (filtered_data['ListingStatus'] == 'Delisted')]
+    inactive_listings = inactive_listings[inactive_listings['LastUpdatedAt'] >= date]
+    return len(active_listings) + len(inactive_listings)
+
+
+def timed(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return np.asarray(result, dtype=float), time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--listings', type=int, default=200000)
+    parser.add_argument('--days', type=int, default=365)
+    args = parser.parse_args()
+
+    data = snapshot.prepare_dash_view(synthetic.make_dash_view(args.listings, days=args.days))
+    dates = pd.date_range(end=data['LastUpdatedAt'].max().normalize(), periods=args.days, freq='D')
+
+    old_counts, old_count_time = timed(lambda: [get_listing_count(data, date) for date in dates])
+    new_counts, new_count_time = timed(timeseries.daily_listing_counts, data, dates)
+    old_medians, old_median_time = timed(lambda: [calculate_median_price(data, date) for date in dates])
+    new_medians, new_median_time = timed(timeseries.daily_median_prices, data, dates)
+
+    print(f'counts:  per-day scans {old_count_time:.2f}s, sweep {new_count_time:.3f}s')
+    print(f'medians: per-day scans {old_median_time:.2f}s, sweep {new_median_time:.3f}s')
+    counts_match = np.array_equal(old_counts, new_counts)
+    medians_match = np.allclose(old_medians, new_medians, rtol=0, atol=1e-12, equal_nan=True)
+    print(f'counts match: {counts_match}, medians match: {medians_match}')
+    sys.exit(0 if counts_match and medians_match else 1)
+
+
+if __name__ == '__main__':
+    main()
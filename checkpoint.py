@@ -0,0 +1,129 @@
+import json
+import os
+import shutil
+import sqlite3
+import time
+import pandas as pd
+import utils
+
+MANIFEST_FILE = 'run.sqlite'
+PAGES_DIRECTORY = 'pages'
+
+
+def get_work_dir():
+    return os.getenv('INGEST_WORK_DIR', 'ingest_work')
+
+
+def get_resume_hours():
+    # Long enough to rerun a failed job, short enough that the next nightly run never picks up yesterday's pages.
+    return float(os.getenv('INGEST_RESUME_HOURS', 2))
+
+
+def get_reconcile_resume_minutes():
+    return float(os.getenv('INGEST_RECONCILE_RESUME_MINUTES', 15))
+
+
+class IngestCheckpoint:
+    # Raw TradeMe pages and the progress of one ingest run, kept in a local work directory so a failed run can be
+    # resumed. Every fetched page is saved as JSON and recorded in a SQLite manifest, along with whether its
+    # listings have been upserted. Pages are only read and written from the thread driving the ingest.
+    def __init__(self, root=None, url=None, max_age_hours=None, fresh=False):
+        self.root = root or get_work_dir()
+        self.url = url
+        self.max_age_hours = max_age_hours if max_age_hours is not None else get_resume_hours()
+        os.makedirs(os.path.join(self.root, PAGES_DIRECTORY), exist_ok=True)
+        self.connection = sqlite3.connect(os.path.join(self.root, MANIFEST_FILE))
+        self.connection.execute('CREATE TABLE IF NOT EXISTS Run (Key TEXT PRIMARY KEY, Value TEXT)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS Pages '
+                                '(Page INTEGER PRIMARY KEY, Listings INTEGER NOT NULL, Upserted INTEGER NOT NULL)')
+        self.connection.execute('CREATE TABLE IF NOT EXISTS Stages (Stage TEXT PRIMARY KEY, FinishedAt TEXT)')
+        self.connection.commit()
+        if fresh:
+            self.reset()
+        self.resumed = self._check_run()
+        # Pages an earlier attempt saved, which this run reads back instead of fetching.
+        self.resumed_pages = len(self.fetched_pages())
+        self.upserted_pages = {page for page, in self.connection.execute('SELECT Page FROM Pages WHERE Upserted')}
+
+    def _check_run(self):
+        run = dict(self.connection.execute('SELECT Key, Value FROM Run'))
+        if run:
+            self.started_at = float(run['StartedAt'])
+            age_hours = self.age_minutes() / 60
+            # Yesterday's pages, or another search, would hand a stale listing set to reconciliation.
+            if run.get('Url') == (self.url or '') and age_hours <= self.max_age_hours:
+                return True
+            print(f'Discarding the ingest checkpoint in {self.root}, started {age_hours:.1f} hours ago.')
+            self.reset()
+        self.started_at = time.time()
+        self.connection.executemany('INSERT INTO Run (Key, Value) VALUES (?, ?)',
+                                    [('StartedAt', str(self.started_at)), ('Url', self.url or '')])
+        self.connection.commit()
+        return False
+
+    def age_minutes(self):
+        # Page 1 is saved as the run starts, so this is the age of the oldest saved page.
+        return (time.time() - self.started_at) / 60
+
+    def reconcile_is_safe(self):
+        # While a run paginates, listings that expire shift the ones behind them onto earlier pages. Pages saved
+        # long before the rest of a resumed run miss the listings that moved onto them in between, and
+        # reconciliation would delist those. Saved pages only a few minutes older than the rest miss very few.
+        return not self.resumed_pages or self.age_minutes() <= get_reconcile_resume_minutes()
+
+    def reset(self):
+        for table in ('Run', 'Pages', 'Stages'):
+            self.connection.execute(f'DELETE FROM {table}')
+        self.connection.commit()
+        shutil.rmtree(os.path.join(self.root, PAGES_DIRECTORY), ignore_errors=True)
+        os.makedirs(os.path.join(self.root, PAGES_DIRECTORY))
+
+    def get_page_path(self, page):
+        return os.path.join(self.root, PAGES_DIRECTORY, f'page-{page:05d}.json')
+
+    def fetched_pages(self):
+        return [page for page, in self.connection.execute('SELECT Page FROM Pages ORDER BY Page')]
+
+    def save_page(self, page, parsed_data):
+        def write(temporary_path):
+            with open(temporary_path, 'w') as f:
+                json.dump(parsed_data, f)
+
+        utils.replace_atomically(self.get_page_path(page), write)
+        self.connection.execute('INSERT OR REPLACE INTO Pages (Page, Listings, Upserted) VALUES (?, ?, 0)',
+                                (page, len(parsed_data['List'])))
+        self.connection.commit()
+
+    def load_page(self, page):
+        with open(self.get_page_path(page)) as f:
+            return json.load(f)
+
+    def is_upserted(self, page):
+        return page in self.upserted_pages
+
+    def mark_upserted(self, pages):
+        pages = [page for page in pages if page not in self.upserted_pages]
+        if not pages:
+            return
+        self.connection.executemany('UPDATE Pages SET Upserted = 1 WHERE Page = ?', [(page,) for page in pages])
+        self.connection.commit()
+        self.upserted_pages.update(pages)
+
+    def finish_stage(self, stage):
+        self.connection.execute('INSERT OR REPLACE INTO Stages (Stage, FinishedAt) VALUES (?, ?)',
+                                (stage, pd.Timestamp.now().isoformat()))
+        self.connection.commit()
+
+    def finished_stages(self):
+        return [stage for stage, in self.connection.execute('SELECT Stage FROM Stages ORDER BY FinishedAt')]
+
+    def summary(self):
+        pages = self.fetched_pages()
+        stages = ', '.join(self.finished_stages()) or 'none'
+        return f'{len(pages)} pages fetched, {len(self.upserted_pages)} upserted; stages finished: {stages}'
+
+    def close(self, completed=False):
+        # A completed run has nothing left to resume, so its work directory goes.
+        self.connection.close()
+        if completed:
+            shutil.rmtree(self.root, ignore_errors=True)
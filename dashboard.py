@@ -1,12 +1,16 @@
 import dash
 from dash import dcc
 from dash import html
-import pandas as pd
-import plotly.express as px
 from dash.dependencies import Input, Output, State
+from dash.exceptions import PreventUpdate
 from dotenv import load_dotenv
-import utils
+import metrics
+import flask
+import functools
+import logging
 import os
+import threading
+import time
 
 
 try:
@@ -16,93 +20,277 @@ except FileNotFoundError:
     print('No config file found.')
 
 
-def fetch_data(supabase):
-    data = supabase.table("dash_view").select("*").execute()
-    data_df = pd.DataFrame(data.data)
+def import_data_modules():
+    # pandas, pyarrow, supabase and plotly take seconds to import between them, so they wait until the data loads.
+    global pd, utils, snapshot, query_engine, aggregates, figures, map_pipeline, shared_store
+    import pandas as pd
+    import utils
+    import snapshot
+    import query_engine
+    import aggregates
+    import figures
+    import map_pipeline
+    import shared_store
+
+
+@metrics.timed('stage_seconds', stage='fetch_data')
+def fetch_data(supabase, page_size=None):
+    data_df = pd.DataFrame(utils.fetch_table(supabase, 'dash_view', page_size=page_size))
     return data_df
 
 
-app = dash.Dash(__name__)
+def swap_data(new_data):
+    global data, engine, charts
+    engine = query_engine.QueryEngine(new_data)
+    aggregate_store = aggregates.load_aggregate_store(utils.connect_to_supabase, new_data, refresh=True)
+    charts = figures.DashboardFigures(engine, aggregate_store)
+    data = new_data
+
+
+def refresh_aggregates(supabase):
+    # Aggregates are published after the last upsert to Listings, so the refresher may already have reloaded the
+    # final listings without them.
+    global charts
+    if aggregates.aggregates_changed(supabase):
+        charts = figures.DashboardFigures(engine, aggregates.load_aggregate_store(utils.connect_to_supabase, data,
+                                                                                  refresh=True))
+
+
+def swap_version(version):
+    # A version published to the shared store: the data and the range column order are mapped from its files, and
+    # its aggregate tables were written next to them by the publisher.
+    global data, engine, charts, data_version
+    engine = query_engine.QueryEngine(version.data, range_orders=version.range_orders)
+    aggregate_store = aggregates.load_aggregate_store(utils.connect_to_supabase, version.data,
+                                                      path=version.snapshot_path)
+    charts = figures.DashboardFigures(engine, aggregate_store)
+    data = version.data
+    data_version = version.name
+
+
+logging.basicConfig(level=logging.INFO, format='%(asctime)s %(name)s %(message)s')
+logger = logging.getLogger('dashboard')
+# With DASHBOARD_DEFERRED_LOAD=1 the server can bind as soon as this module is imported: the data loads in a
+# background thread, and pages opened before it is in get a placeholder that reloads itself once it is.
+deferred_load = os.getenv('DASHBOARD_DEFERRED_LOAD') == '1'
+app = dash.Dash(__name__, suppress_callback_exceptions=deferred_load)
 server = app.server
-data = fetch_data(utils.connect_to_supabase())
-data['Price'] = data['Price'] / 1000000
-data['StartDate'] = pd.to_datetime(data['StartDate'])
-data['EndDate'] = pd.to_datetime(data['EndDate'])
-data['LastUpdatedAt'] = pd.to_datetime(data['LastUpdatedAt'])
-
-# Generate options for dropdowns
-regions = [{'label': region, 'value': region} for region in data['Region'].unique()]
-regions.insert(0, {'label': 'All Regions', 'value': 'All Regions'})
-districts = [{'label': district, 'value': district} for district in data['District'].unique()]
-districts.insert(0, {'label': 'All Districts', 'value': 'All Districts'})
-suburbs = [{'label': suburb, 'value': suburb} for suburb in data['Suburb'].unique()]
-suburbs.insert(0, {'label': 'All Suburbs', 'value': 'All Suburbs'})
-property_types = [{'label': ptype, 'value': ptype} for ptype in data['PropertyType'].unique()]
-property_types.insert(0, {'label': 'All Property Types', 'value': 'All Property Types'})
-
-# Define the layout of the app
-app.layout = html.Div([
-    html.Div([
-        html.H2('Filters', style={'color': 'white'}),
-        html.Label('Start Date Range:', style={'color': 'white'}),
-        dcc.DatePickerRange(
-            id='date-picker-range',
-            start_date=data['LastUpdatedAt'].min(),
-            end_date=data['LastUpdatedAt'].max(),
-            display_format='MMM D, YYYY',
-            style={'marginBottom': '20px', 'fontSize': '12px'}
-        ),
-        html.Br(),
-        html.Label('Region', style={'color': 'white'}),
-        dcc.Dropdown(id='region-dropdown', options=regions, value='All Regions', style={'marginBottom': '20px'},
-                     multi=True, clearable=True, searchable=True, placeholder='Select Region'),
-        html.Label('District', style={'color': 'white'}),
-        dcc.Dropdown(id='district-dropdown', options=districts, value='All Districts', style={'marginBottom': '20px'},
-                     multi=True, clearable=True, searchable=True, placeholder='Select District'),
-        html.Label('Suburb', style={'color': 'white'}),
-        dcc.Dropdown(id='suburb-dropdown', options=suburbs, value='All Suburbs', style={'marginBottom': '20px'},
-                     multi=True, clearable=True, searchable=True, placeholder='Select Suburb'),
-        html.Label('Price Range', style={'color': 'white'}),
-        dcc.RangeSlider(id='price-slider', min=data['Price'].min(), max=data['Price'].max(),
-                        step=0.1,
-                        marks={price: f"${price:.0f}m" for price in range(int(data['Price'].min()),
-                                                                          int(data['Price'].max()) + 1,
-                                                                          1 if data['Price'].max() < 5
-                                                                          else 2)},
-                        value=[data['Price'].min(), data['Price'].max()]),
-        html.Label('Bedrooms:', style={'color': 'white'}),
-        dcc.RangeSlider(id='bedrooms-slider', min=0, max=data['Bedrooms'].max(),
-                        step=1, marks={i: str(i) for i in range(int(data['Bedrooms'].max()) + 1)},
-                        value=[0, data['Bedrooms'].max()]),
-        html.Br(),
-        html.Label('Bathrooms:', style={'color': 'white'}),
-        dcc.RangeSlider(id='bathrooms-slider', min=0, max=data['Bathrooms'].max(),
-                        step=1, marks={i: str(i) for i in range(int(data['Bathrooms'].max()) + 1)},
-                        value=[0, data['Bathrooms'].max()]),
-        html.Br(),
-        html.Label('Property Type', style={'color': 'white'}),
-        dcc.Dropdown(id='property-type-dropdown', options=property_types, value='All Property Types',
-                     style={'marginBottom': '20px'}, multi=True),
-        html.Button(id='filter-button', n_clicks=0, children='Apply Filters', style={'marginTop': '20px',
-                                                                                     'margin': '5px'}),
-        html.Div(id='stats-div', style={'color': 'white', 'marginTop': '20px'})
-    ],  style={'width': '16%', 'float': 'left', 'backgroundColor': '#00355f', 'padding': '20px',
-               'position': 'fixed', 'height': '100vh', 'overflow': 'auto'}),
-
-    html.Div([
-        dcc.Graph(id='price-distribution', style={'height': '800px'}),
-        dcc.Graph(id='listings-on-map', style={'height': '800px'}),
-        dcc.Graph(id='median-price-by-region', style={'height': '800px'}),
-        dcc.Graph(id='median-price-by-district', style={'height': '800px'}),
-        dcc.Graph(id='median-price-by-suburb', style={'height': '800px'}),
-        dcc.Graph(id='median-price-over-time', style={'height': '800px'}),
-        dcc.Graph(id='listing-count-over-time', style={'height': '800px'}),
-        dcc.Graph(id='listings-by-property-type', style={'height': '800px'}),
-        dcc.Graph(id='price-vs-land-area', style={'height': '800px'}),
-        dcc.Graph(id='price-vs-bedrooms', style={'height': '800'}),
-        dcc.Graph(id='price-vs-bathrooms', style={'height': '800px'}),
-    ], style={'display': 'inline-block', 'width': '75%', 'padding': '20px', 'float': 'right'})
-])
+# Callback timings and data loads are only recorded with a JSON-lines METRICS_PATH or the /metrics route turned on.
+serve_metrics = os.getenv('DASHBOARD_METRICS') == '1'
+metrics.configure(metrics.get_metrics_path(), enabled=serve_metrics)
+if serve_metrics:
+    # Prometheus text format. Under gunicorn each worker answers with its own counts.
+    @server.route('/metrics')
+    def metrics_route():
+        return flask.Response(metrics.prometheus_text(), mimetype='text/plain; version=0.0.4')
+
+data = None
+data_version = None
+engine = None
+charts = None
+dashboard_layout = None
+data_ready = threading.Event()
+load_error = None
+startup_timings = {}
+# A deferred load that fails is retried this many times, waiting twice as long before each attempt.
+load_attempts = int(os.getenv('DASHBOARD_LOAD_ATTEMPTS', 5))
+load_retry_seconds = float(os.getenv('DASHBOARD_LOAD_RETRY_SECONDS', 5))
+# Under gunicorn a browser that reloaded once one worker was ready can still reach a worker that is loading, so
+# callbacks wait this long for the data before giving up on the update.
+callback_wait_seconds = float(os.getenv('DASHBOARD_CALLBACK_WAIT_SECONDS', 10))
+
+
+def load_data():
+    global data, data_version, engine, charts, dashboard_layout
+    start = time.perf_counter()
+    import_data_modules()
+    startup_timings['imports'] = time.perf_counter() - start
+    shared_dir = shared_store.get_shared_dir()
+    if shared_dir:
+        # Serving from several processes (see gunicorn.conf.py): every worker maps the same published version.
+        shared_version = shared_store.attach(shared_dir, utils.connect_to_supabase, fetch_data)
+        swap_version(shared_version)
+        refresh_interval = 0 if os.getenv('DASHBOARD_REFRESH_SECONDS') == '0' else None
+        refresher = shared_store.SharedStoreWatcher(shared_dir, utils.connect_to_supabase, swap_version,
+                                                    shared_version, fetch_data, refresh_interval=refresh_interval)
+    else:
+        # Price in millions, parsed dates and categorical locations all come ready-made from the local snapshot.
+        data = snapshot.load_dash_view(utils.connect_to_supabase, fetch_data)
+        data_version = str(data['LastUpdatedAt'].max())
+        engine = query_engine.QueryEngine(data)
+        charts = figures.DashboardFigures(engine, aggregates.load_aggregate_store(utils.connect_to_supabase, data))
+        refresher = None
+        if os.getenv('DASHBOARD_REFRESH_SECONDS') != '0':
+            refresher = snapshot.SnapshotRefresher(utils.connect_to_supabase, fetch_data, swap_data,
+                                                   data['LastUpdatedAt'].max(),
+                                                   refresh_aggregates=refresh_aggregates)
+    dashboard_layout = build_layout(data)
+    # Started last, so a load that fails part way and is retried never leaves a second refresher running.
+    if refresher is not None:
+        refresher.start()
+    startup_timings['data_load'] = time.perf_counter() - start
+    data_ready.set()
+    logger.info('Dashboard data loaded in %.2fs', startup_timings['data_load'])
+
+
+def load_data_in_background():
+    global load_error
+    for attempt in range(1, load_attempts + 1):
+        try:
+            load_data()
+            load_error = None
+            return
+        except Exception as e:
+            load_error = e
+            logger.exception('Loading dashboard data failed (attempt %d of %d)', attempt, load_attempts)
+        if attempt < load_attempts:
+            time.sleep(load_retry_seconds * 2 ** (attempt - 1))
+
+
+def wait_for_data():
+    if not data_ready.wait(callback_wait_seconds):
+        raise PreventUpdate
+
+
+@server.route('/healthz')
+def healthz():
+    # Answers 200 while the data is still loading, so health checks pass as soon as the server is up, but 503 once
+    # a load has failed, so a worker that can't load is replaced.
+    status = 503 if load_error is not None and not data_ready.is_set() else 200
+    return flask.jsonify({'pid': os.getpid(), 'ready': data_ready.is_set(), 'version': data_version,
+                          'rows': len(data) if data is not None else 0,
+                          'error': str(load_error) if status != 200 else None}), status
+
+
+def build_layout(data):
+    # Generate options for dropdowns
+    regions = [{'label': region, 'value': region} for region in data['Region'].unique()]
+    regions.insert(0, {'label': 'All Regions', 'value': 'All Regions'})
+    districts = [{'label': district, 'value': district} for district in data['District'].unique()]
+    districts.insert(0, {'label': 'All Districts', 'value': 'All Districts'})
+    suburbs = [{'label': suburb, 'value': suburb} for suburb in data['Suburb'].unique()]
+    suburbs.insert(0, {'label': 'All Suburbs', 'value': 'All Suburbs'})
+    property_types = [{'label': ptype, 'value': ptype} for ptype in data['PropertyType'].unique()]
+    property_types.insert(0, {'label': 'All Property Types', 'value': 'All Property Types'})
+
+    # Define the layout of the app
+    return html.Div([
+        html.Div([
+            html.H2('Filters', style={'color': 'white'}),
+            html.Label('Start Date Range:', style={'color': 'white'}),
+            dcc.DatePickerRange(
+                id='date-picker-range',
+                start_date=data['LastUpdatedAt'].min(),
+                end_date=data['LastUpdatedAt'].max(),
+                display_format='MMM D, YYYY',
+                style={'marginBottom': '20px', 'fontSize': '12px'}
+            ),
+            html.Br(),
+            html.Label('Region', style={'color': 'white'}),
+            dcc.Dropdown(id='region-dropdown', options=regions, value='All Regions', style={'marginBottom': '20px'},
+                         multi=True, clearable=True, searchable=True, placeholder='Select Region'),
+            html.Label('District', style={'color': 'white'}),
+            dcc.Dropdown(id='district-dropdown', options=districts, value='All Districts',
+                         style={'marginBottom': '20px'}, multi=True, clearable=True, searchable=True,
+                         placeholder='Select District'),
+            html.Label('Suburb', style={'color': 'white'}),
+            dcc.Dropdown(id='suburb-dropdown', options=suburbs, value='All Suburbs', style={'marginBottom': '20px'},
+                         multi=True, clearable=True, searchable=True, placeholder='Select Suburb'),
+            html.Label('Price Range', style={'color': 'white'}),
+            dcc.RangeSlider(id='price-slider', min=data['Price'].min(), max=data['Price'].max(),
+                            step=0.1,
+                            marks={price: f"${price:.0f}m" for price in range(int(data['Price'].min()),
+                                                                              int(data['Price'].max()) + 1,
+                                                                              1 if data['Price'].max() < 5
+                                                                              else 2)},
+                            value=[data['Price'].min(), data['Price'].max()]),
+            html.Label('Bedrooms:', style={'color': 'white'}),
+            dcc.RangeSlider(id='bedrooms-slider', min=0, max=data['Bedrooms'].max(),
+                            step=1, marks={i: str(i) for i in range(int(data['Bedrooms'].max()) + 1)},
+                            value=[0, data['Bedrooms'].max()]),
+            html.Br(),
+            html.Label('Bathrooms:', style={'color': 'white'}),
+            dcc.RangeSlider(id='bathrooms-slider', min=0, max=data['Bathrooms'].max(),
+                            step=1, marks={i: str(i) for i in range(int(data['Bathrooms'].max()) + 1)},
+                            value=[0, data['Bathrooms'].max()]),
+            html.Br(),
+            html.Label('Property Type', style={'color': 'white'}),
+            dcc.Dropdown(id='property-type-dropdown', options=property_types, value='All Property Types',
+                         style={'marginBottom': '20px'}, multi=True),
+            html.Button(id='filter-button', n_clicks=0, children='Apply Filters', style={'marginTop': '20px',
+                                                                                         'margin': '5px'}),
+            html.Div(id='stats-div', style={'color': 'white', 'marginTop': '20px'}),
+            dcc.Store(id='filter-state')
+        ],  style={'width': '16%', 'float': 'left', 'backgroundColor': '#00355f', 'padding': '20px',
+                   'position': 'fixed', 'height': '100vh', 'overflow': 'auto'}),
+
+        html.Div([
+            dcc.Graph(id='price-distribution', style={'height': '800px'}),
+            dcc.Graph(id='listings-on-map', style={'height': '800px'}),
+            html.Div(id='map-details', style={'padding': '10px'}),
+            dcc.Store(id='map-viewport'),
+            dcc.Graph(id='median-price-by-region', style={'height': '800px'}),
+            dcc.Graph(id='median-price-by-district', style={'height': '800px'}),
+            dcc.Graph(id='median-price-by-suburb', style={'height': '800px'}),
+            dcc.Graph(id='median-price-over-time', style={'height': '800px'}),
+            dcc.Graph(id='listing-count-over-time', style={'height': '800px'}),
+            dcc.Graph(id='listings-by-property-type', style={'height': '800px'}),
+            dcc.Graph(id='price-vs-land-area', style={'height': '800px'}),
+            dcc.Graph(id='price-vs-bedrooms', style={'height': '800'}),
+            dcc.Graph(id='price-vs-bathrooms', style={'height': '800px'}),
+        ], style={'display': 'inline-block', 'width': '75%', 'padding': '20px', 'float': 'right'})
+    ])
+
+
+def loading_layout():
+    message = 'Loading listings...' if load_error is None else f'Loading listings failed: {load_error}'
+    return html.Div([
+        html.H2(message, id='loading-message'),
+        dcc.Interval(id='loading-poll', interval=1000),
+        dcc.Store(id='loading-state'),
+        dcc.Store(id='loading-reload'),
+    ], style={'padding': '20px'})
+
+
+def serve_layout():
+    # Called on every page load.
+    return dashboard_layout if data_ready.is_set() else loading_layout()
+
+
+app.layout = serve_layout
+if deferred_load:
+    threading.Thread(target=load_data_in_background, daemon=True, name='dashboard-data-load').start()
+
+    @app.callback([Output('loading-state', 'data'), Output('loading-message', 'children')],
+                  Input('loading-poll', 'n_intervals'))
+    def poll_data_load(n_intervals):
+        if data_ready.is_set():
+            return 'ready', 'Loaded.'
+        if load_error is not None:
+            return 'failed', f'Loading listings failed: {load_error}'
+        raise PreventUpdate
+
+    # Reload once the data is in, which serves the full layout.
+    app.clientside_callback('function(state) { if (state === "ready") { window.location.reload(); } return state; }',
+                            Output('loading-reload', 'data'), Input('loading-state', 'data'))
+else:
+    load_data()
+
+
+def timed_callback(name):
+    def decorator(function):
+        @functools.wraps(function)
+        def wrapper(*args):
+            wait_for_data()
+            start = time.perf_counter()
+            try:
+                return function(*args)
+            finally:
+                seconds = time.perf_counter() - start
+                metrics.observe('callback_seconds', seconds, callback=name)
+                logger.info('%s updated in %.1f ms', name, seconds * 1000)
+        return wrapper
+    return decorator
 
 
 @app.callback(
@@ -113,51 +301,27 @@ app.layout = html.Div([
      Input('district-dropdown', 'value'),
      Input('suburb-dropdown', 'value')]
 )
+@timed_callback('dropdowns')
 def update_dropdowns(selected_region, selected_district, selected_suburb):
-    filtered_data = data.copy()
-    if selected_region == 'All Regions' or not selected_region or 'All Regions' in selected_region:
-        filtered_data = data.copy()
-    else:
-        filtered_data = data[data['Region'].isin(selected_region)]
+    district_values, suburb_values, property_type_values = engine.dropdown_options(selected_region, selected_district,
+                                                                                   selected_suburb)
     districts = [{'label': 'All Districts', 'value': 'All Districts'}] + \
-        [{'label': district, 'value': district} for district in filtered_data['District'].unique()]
-    if selected_district == 'All Districts' or not selected_district or 'All Districts' in selected_district:
-        filtered_data = filtered_data
-    else:
-        filtered_data = filtered_data[filtered_data['District'].isin(selected_district)]
+        [{'label': district, 'value': district} for district in district_values]
     suburbs = [{'label': 'All Suburbs', 'value': 'All Suburbs'}] + \
-        [{'label': suburb, 'value': suburb} for suburb in filtered_data['Suburb'].unique()]
-    if selected_suburb == 'All Suburbs' or not selected_suburb or 'All Suburbs' in selected_suburb:
-        filtered_data = filtered_data
-    else:
-        filtered_data = filtered_data[filtered_data['Suburb'].isin(selected_suburb)]
+        [{'label': suburb, 'value': suburb} for suburb in suburb_values]
     property_types = [{'label': 'All Property Types', 'value': 'All Property Types'}] + \
-        [{'label': ptype, 'value': ptype} for ptype in filtered_data['PropertyType'].unique()]
+        [{'label': ptype, 'value': ptype} for ptype in property_type_values]
     return districts, suburbs, property_types
 
 
-# Callback to update the graphs based on filters
+# The filter button and the drill-down clicks only record the filter state; every figure then updates from it
+# in its own callback.
 @app.callback(
-    [
-     Output('price-distribution', 'figure'),
-     Output('listings-on-map', 'figure'),
-     Output('median-price-by-region', 'figure'),
-     Output('median-price-by-district', 'figure'),
-     Output('median-price-by-suburb', 'figure'),
-     Output('median-price-over-time', 'figure'),
-     Output('listing-count-over-time', 'figure'),
-     Output('listings-by-property-type', 'figure'),
-     Output('price-vs-land-area', 'figure'),
-     Output('price-vs-bedrooms', 'figure'),
-     Output('price-vs-bathrooms', 'figure'),
-     Output('stats-div', 'children')
-    ],
-    [Input('filter-button', 'n_clicks')],
-    [
-        Input('median-price-by-region', 'clickData'),
-        Input('median-price-by-district', 'clickData'),
-        Input('median-price-by-suburb', 'clickData'),
-    ],
+    Output('filter-state', 'data'),
+    [Input('filter-button', 'n_clicks'),
+     Input('median-price-by-region', 'clickData'),
+     Input('median-price-by-district', 'clickData'),
+     Input('median-price-by-suburb', 'clickData')],
     [State('date-picker-range', 'start_date'),
      State('date-picker-range', 'end_date'),
      State('region-dropdown', 'value'),
@@ -168,205 +332,91 @@ def update_dropdowns(selected_region, selected_district, selected_suburb):
      State('bathrooms-slider', 'value'),
      State('property-type-dropdown', 'value')]
 )
-def update_graphs(n_clicks, region_click, district_click, suburb_click,
-                  start_date, end_date,
-                  region, district, suburb, price_range,
-                  bedroom_range, bathroom_range, property_type):
+@timed_callback('filter-state')
+def update_filter_state(n_clicks, region_click, district_click, suburb_click,
+                        start_date, end_date,
+                        region, district, suburb, price_range,
+                        bedroom_range, bathroom_range, property_type):
     ctx = dash.callback_context
-    if not ctx.triggered or ctx.triggered[0]['prop_id'] == 'filter-button.n_clicks':
-        filtered_data = data[data['EndDate'] >= start_date]   # i.e., remove those that have already ended.
-        filtered_data = data[data['StartDate'] <= end_date]   # i.e., remove those that have not started yet.
-        filtered_data_with_nulls = data
-    else:
+    drill_down = None
+    if ctx.triggered and ctx.triggered[0]['prop_id'] != 'filter-button.n_clicks' and ctx.triggered[0]['value']:
         trigger_id = ctx.triggered[0]['prop_id'].split('.')[0]
         category_value = ctx.triggered[0]['value']['points'][0]['x']
-        if trigger_id in ['median-price-by-region', 'median-price-by-district', 'median-price-by-suburb']:
-            filtered_data = data[data[trigger_id.split('-')[3].title()] == category_value]
-        filtered_data = filtered_data = filtered_data[(filtered_data['EndDate'] >= start_date)]
-        filtered_data = filtered_data[(filtered_data['StartDate'] <= end_date)]
-        filtered_data_with_nulls = filtered_data
-    filtered_data = filtered_data[~((filtered_data['LastUpdatedAt'] < start_date)
-                                  & (filtered_data['ListingStatus'] == 'Delisted'))]
-    filtered_data_with_nulls = filtered_data
-    if region != 'All Regions' and region and 'All Regions' not in region:
-        filtered_data = filtered_data[filtered_data['Region'].isin(region)]
-        filtered_data_with_nulls = filtered_data_with_nulls[(filtered_data_with_nulls['Region'].isin(region)) |
-                                                            (filtered_data_with_nulls['Region'].isnull())]
-    if district != 'All Districts' and district and 'All Districts' not in district:
-        filtered_data = filtered_data[filtered_data['District'].isin(district)]
-        filtered_data_with_nulls = filtered_data_with_nulls[(filtered_data_with_nulls['District'].isin(district)) |
-                                                            (filtered_data_with_nulls['District'].isnull())]
-    if suburb != 'All Suburbs' and suburb and 'All Suburbs' not in suburb:
-        filtered_data = filtered_data[filtered_data['Suburb'].isin(suburb)]
-        filtered_data_with_nulls = filtered_data_with_nulls[(filtered_data_with_nulls['Suburb'].isin(suburb)) |
-                                                            (filtered_data_with_nulls['Suburb'].isnull())]
-    filtered_data = filtered_data[(filtered_data['Price'] >= price_range[0])
-                                  & (filtered_data['Price'] <= price_range[1])]
-    filtered_data_with_nulls = filtered_data_with_nulls[((filtered_data_with_nulls['Price'] >= price_range[0])
-                                                        & (filtered_data_with_nulls['Price'] <= price_range[1])) |
-                                                        (filtered_data_with_nulls['Price'].isnull())]
-    filtered_data = filtered_data[(filtered_data['Bedrooms'] >= bedroom_range[0])
-                                  & (filtered_data['Bedrooms'] <= bedroom_range[1])]
-    filtered_data_with_nulls = filtered_data_with_nulls[((filtered_data_with_nulls['Bedrooms'] >= bedroom_range[0])
-                                                        & (filtered_data_with_nulls['Bedrooms'] <= bedroom_range[1])) |
-                                                        (filtered_data_with_nulls['Bedrooms'].isnull())]
-    filtered_data = filtered_data[(filtered_data['Bathrooms'] >= bathroom_range[0])
-                                  & (filtered_data['Bathrooms'] <= bathroom_range[1])]
-    filtered_data_with_nulls = filtered_data_with_nulls[((filtered_data_with_nulls['Bathrooms'] >= bathroom_range[0])
-                                                        & (filtered_data_with_nulls['Bathrooms'] <= bathroom_range[1]))
-                                                        | (filtered_data_with_nulls['Bathrooms'].isnull())]
-    if property_type != 'All Property Types' and property_type:
-        filtered_data = filtered_data[filtered_data['PropertyType'].isin(property_type)]
-        filtered_data_with_nulls = filtered_data_with_nulls[(filtered_data_with_nulls['PropertyType']
-                                                             .isin(property_type))
-                                                            | (filtered_data_with_nulls['PropertyType'].isnull())]
-
-    # Median Price by Region
-    median_price_region = filtered_data.groupby('Region')['Price'].median().reset_index()
-    median_price_region_sorted = median_price_region.sort_values(by='Price', ascending=False)
-    fig_region = px.bar(
-        median_price_region_sorted,
-        x='Region',
-        y='Price',
-        labels={"Price": "Median Price (millions)"},
-        title='Median Price by Region'
-    )
-
-    # Median Price by District
-    median_price_district = filtered_data.groupby('District')['Price'].median().reset_index()
-    median_price_district_sorted = median_price_district.sort_values(by='Price', ascending=False)
-    fig_district = px.bar(
-        median_price_district_sorted,
-        x='District',
-        y='Price',
-        labels={"Price": "Median Price (millions)"},
-        title='Median Price by District'
-    )
-
-    fig_histogram = px.histogram(filtered_data, x='Price', title='Price Distribution')
-    median_price_suburb = filtered_data.groupby('Suburb')['Price'].median().reset_index()
-    median_price_suburb_sorted = median_price_suburb.sort_values(by='Price', ascending=False)
-    fig_median_price_suburb = px.bar(
-        median_price_suburb_sorted,
-        x='Suburb',
-        y='Price',
-        labels={"Price": "Median Price (millions)"},
-        title='Median Price by Suburb',
-    )
-    fig_median_price_suburb.update_layout(xaxis_tickangle=-90)
-    filtered_data['LastUpdatedAt'] = pd.to_datetime(filtered_data['LastUpdatedAt'])
-    n_days = (filtered_data['LastUpdatedAt'].max() - filtered_data['LastUpdatedAt'].min()).days
-    filtered_data.set_index('LastUpdatedAt', inplace=True)
-    if n_days < 10:
-        # Just show one boxplot for the median price, but make it overall... no x split
-        fig_median_price_time = px.box(
-            filtered_data,
-            y='Price',
-            title='Median Price Overall',
-            labels={"Price": "Price (millions)"}
-        )
-    else:
-        date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-        rolling_median = [calculate_median_price(filtered_data, date) for date in date_range]
-        fig_median_price_time = px.line(
-            rolling_median,
-            x=date_range,
-            y=rolling_median,
-            labels={"y": "Median Price (millions)", "x": "Date"},
-            title='Median Price by Date'
-        )
-    fig_map = px.scatter_mapbox(filtered_data, lat='Latitude', lon='Longitude', size='Price', zoom=4, height=300,
-                                title='Listings on Map',
-                                hover_data={
-                                    'Title': True,
-                                    'Price': ':.2f',
-                                    'Region': True,
-                                    'District': True,
-                                    'Suburb': True,
-                                    'Area': True,
-                                    'LandArea': True,
-                                    'Bedrooms': True,
-                                    'Bathrooms': True,
-                                    'PropertyType': True,
-                                    'StartDate': True,
-
-                                })
-    fig_map.update_layout(mapbox_style='open-street-map', title='Listings on Map', height=800)
-    counts = filtered_data['PropertyType'].value_counts().reset_index()
-    fig_bar = px.bar(counts, x=counts.index, y='PropertyType', title='Number of Listings by Property Type')
-    fig_scatter = px.scatter(filtered_data, x='Area', y='Price', title='Price vs. Floor Area')
-    fig_price_bedrooms = create_price_bedrooms_boxplot(filtered_data)
-    fig_price_bathrooms = create_price_bathrooms_boxplot(filtered_data)
-
-    count = len(filtered_data_with_nulls)
-    median_price = filtered_data['Price'].median() if count > 0 else 0
-    stats_text = [
+        drill_down = [trigger_id.split('-')[3].title(), category_value]
+    return {
+        'filters': [drill_down, start_date, end_date, region, district, suburb, price_range, bedroom_range,
+                    bathroom_range, property_type],
+    }
+
+
+def read_filter_state(state):
+    if state is None:
+        raise PreventUpdate
+    drill_down, *filters = state['filters']
+    return query_engine.normalise_filters(tuple(drill_down) if drill_down else None, *filters)
+
+
+FIGURE_BUILDERS = {
+    'price-distribution': lambda filters, drawn: charts.price_distribution_figure(filters, drawn),
+    'median-price-by-region': lambda filters, drawn: charts.median_price_figure(filters, 'Region', drawn),
+    'median-price-by-district': lambda filters, drawn: charts.median_price_figure(filters, 'District', drawn),
+    'median-price-by-suburb': lambda filters, drawn: charts.median_price_figure(filters, 'Suburb', drawn),
+    'median-price-over-time': lambda filters, drawn: charts.median_price_over_time(filters),
+    'listing-count-over-time': lambda filters, drawn: charts.listing_count_figure(filters, drawn),
+    'listings-by-property-type': lambda filters, drawn: charts.property_type_figure(filters, drawn),
+    'price-vs-land-area': lambda filters, drawn: charts.price_vs_area_figure(filters, drawn),
+    'price-vs-bedrooms': lambda filters, drawn: charts.price_vs_bedrooms(filters),
+    'price-vs-bathrooms': lambda filters, drawn: charts.price_vs_bathrooms(filters),
+}
+
+
+def register_figure_callback(graph_id, build):
+    # The figure the browser holds decides between a Patch and a full figure: a first callback that was skipped
+    # while the data loaded, failed or was cancelled leaves the graph empty, and a Patch can't draw it.
+    @app.callback(Output(graph_id, 'figure'), Input('filter-state', 'data'), State(graph_id, 'figure'))
+    @timed_callback(graph_id)
+    def update_figure(state, figure):
+        return build(read_filter_state(state), figures.has_trace(figure))
+
+
+for graph_id, build in FIGURE_BUILDERS.items():
+    register_figure_callback(graph_id, build)
+
+
+@app.callback(Output('map-viewport', 'data'), Input('listings-on-map', 'relayoutData'))
+def update_map_viewport(relayout_data):
+    wait_for_data()
+    viewport = map_pipeline.viewport_from_relayout(relayout_data)
+    if viewport is None:
+        raise PreventUpdate
+    return [round(value, 4) for value in viewport]
+
+
+@app.callback(Output('listings-on-map', 'figure'), [Input('filter-state', 'data'), Input('map-viewport', 'data')])
+@timed_callback('listings-on-map')
+def update_map(state, viewport):
+    filters = read_filter_state(state)
+    fig_map, mode, markers, payload_bytes = charts.listings_on_map(
+        filters, map_pipeline.Viewport(*viewport) if viewport else None)
+    logger.info('listings-on-map: %d %s, %.0f KiB', markers, mode, payload_bytes / 1024)
+    return fig_map
+
+
+@app.callback(Output('map-details', 'children'), Input('listings-on-map', 'clickData'))
+@timed_callback('map-details')
+def update_map_details(click_data):
+    return [html.Div(line) for line in map_pipeline.listing_details(engine.data, click_data)]
+
+
+@app.callback(Output('stats-div', 'children'), Input('filter-state', 'data'))
+@timed_callback('stats-div')
+def update_stats(state):
+    filters = read_filter_state(state)
+    count, median_price = charts.stats(filters)
+    return [
         html.Div(f"Count: {count}", style={'marginBottom': '10px'}),
         html.Div(f"Median Price: ${median_price:.2f}m")
     ]
-    date_range = pd.date_range(start=start_date, end=end_date, freq='D')
-    listing_count_by_date = [get_listing_count(filtered_data_with_nulls, date) for date in date_range]
-    fig_listing_count_over_time = px.line(
-        x=date_range,
-        y=listing_count_by_date,
-        title='Listing Count Over Time',
-        labels={"y": "Number of Listings", "x": "Date"}
-    )
-    return (fig_histogram, fig_map, fig_region, fig_district, fig_median_price_suburb,
-            fig_median_price_time, fig_listing_count_over_time, fig_bar, fig_scatter, fig_price_bedrooms,
-            fig_price_bathrooms, stats_text)
-
-
-def create_price_bedrooms_boxplot(filtered_data):
-    fig_price_bedrooms = px.box(
-        filtered_data,
-        x='Bedrooms',
-        y='Price',
-        labels={"Price": "Price (millions)", "Bedrooms": "Bedrooms"},
-        title='Price Distribution vs. Bedrooms',
-        notched=True,  # shows the confidence interval around the median
-        points="all",   # show all points
-        height=800
-    )
-    fig_price_bedrooms.update_layout(
-        yaxis_title='Price (millions)',
-        xaxis_title='Bedrooms',
-        xaxis_type='linear'  # Treats the bedroom numbers as categorical
-    )
-    return fig_price_bedrooms
-
-
-def create_price_bathrooms_boxplot(filtered_data):
-    fig_price_bathrooms = px.box(
-        filtered_data,
-        x='Bathrooms',
-        y='Price',
-        labels={"Price": "Price (millions)", "Bathrooms": "Bathrooms"},
-        title='Price Distribution vs. Bathrooms',
-        notched=True,  # shows the confidence interval around the median
-        points="all",   # show all points
-        height=800
-    )
-    fig_price_bathrooms.update_layout(
-        yaxis_title='Price (millions)',
-        xaxis_title='Bathrooms',
-        xaxis_type='linear'  # Treats the bathroom numbers as categorical
-    )
-    return fig_price_bathrooms
-
-
-def calculate_median_price(filtered_data, date):
-    active_listings = filtered_data[(filtered_data['StartDate'] <= date) & (filtered_data['EndDate'] >= date)]
-    return active_listings['Price'].median()
-
-
-def get_listing_count(filtered_data, date):
-    active_listings = filtered_data[(filtered_data['StartDate'] <= date) & (filtered_data['EndDate'] >= date)
-                                    & (filtered_data['ListingStatus'] == 'Listed')]
-    inactive_listings = filtered_data[(filtered_data['StartDate'] <= date) & (filtered_data['EndDate'] >= date)
-                                      & (filtered_data['ListingStatus'] == 'Delisted')]
-    inactive_listings = inactive_listings[inactive_listings['LastUpdatedAt'] >= date]
-    return len(active_listings) + len(inactive_listings)
 
 
 if __name__ == '__main__':
@@ -1,13 +1,25 @@
+import argparse
+import atexit
 import os
 import re
+import sys
 import keyring
 import utils
+import aggregates
+import metrics
+from archive import ListingArchive, get_archive_path
+from checkpoint import IngestCheckpoint, get_work_dir
+from manifest import ListingManifest, get_manifest_path
 from requests_oauthlib import OAuth1Session
 import json
 import pandas as pd
 import numpy as np
 import time
-from datetime import datetime
+import threading
+import requests
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
 from dotenv import load_dotenv
 
 try:
@@ -17,6 +29,55 @@ except FileNotFoundError:
     print('No config file found.')
 
 
+RETRY_STATUS_CODES = {429, 500, 502, 503, 504}
+RETRY_BACKOFF = 1.0
+
+
+class TradeMeFetchError(Exception):
+    pass
+
+
+class TokenBucket:
+    # Shared by all fetch workers. Halves its rate whenever TradeMe pushes back and creeps back up on success.
+    def __init__(self, rate, capacity=None, min_rate=0.1):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.capacity = capacity or max(1.0, rate)
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = threading.Lock()
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def acquire(self):
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self._refill(now)
+                if now >= self.paused_until and self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = max(self.paused_until - now, (1 - self.tokens) / self.rate)
+            time.sleep(wait)
+
+    def back_off(self, retry_after=None):
+        with self.lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate / 2)
+            self.tokens = 0
+            if retry_after:
+                self.paused_until = max(self.paused_until, now + retry_after)
+
+    def recover(self):
+        with self.lock:
+            self.rate = min(self.max_rate, self.rate * 1.1)
+
+
 def get_trademe_credentials():
     TRADEME_API_KEY = os.getenv('TRADEME_API_KEY')
     TRADEME_API_SECRET = os.getenv('TRADEME_API_SECRET')
@@ -33,32 +94,138 @@ def connect_to_trademe():
     return trademe
 
 
-def fetch_trademe_data(trademe, url):
-    # Make initial request to get number of pages
-    print('Fetching page 1 of n')
-    returned_page_all = trademe.get(url)
-    data_raw = returned_page_all.content
-    parsed_data = json.loads(data_raw)
-    listings = parsed_data['List']
+def get_retry_after(response):
+    retry_after = response.headers.get('Retry-After')
+    if retry_after is None:
+        return None
+    try:
+        return max(0.0, float(retry_after))
+    except ValueError:
+        try:
+            return max(0.0, parsedate_to_datetime(retry_after).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+
+def fetch_trademe_page(trademe, url, limiter, max_retries=None):
+    if max_retries is None:
+        max_retries = int(os.getenv('TRADEME_MAX_RETRIES', 5))
+    for attempt in range(max_retries + 1):
+        limiter.acquire()
+        retry_after = None
+        metrics.increment('trademe_requests_total')
+        try:
+            with metrics.timer('trademe_request_seconds'):
+                response = trademe.get(url, timeout=60)
+        except requests.RequestException as e:
+            error = str(e)
+            status = 'error'
+        else:
+            metrics.increment('trademe_bytes_total', len(response.content))
+            if response.status_code == 200:
+                limiter.recover()
+                return json.loads(response.content)
+            error = f'{response.status_code} {response.text}'
+            status = str(response.status_code)
+            if response.status_code not in RETRY_STATUS_CODES:
+                raise TradeMeFetchError(f'Failed to fetch {url}: {error}')
+            retry_after = get_retry_after(response)
+            limiter.back_off(retry_after)
+        if attempt < max_retries:
+            metrics.increment('trademe_retries_total', status=status)
+            delay = retry_after if retry_after is not None else RETRY_BACKOFF * 2 ** attempt
+            print(f'Error fetching {url}: {error}. Retrying in {delay:.1f}s')
+            time.sleep(delay)
+    raise TradeMeFetchError(f'Failed to fetch {url} after {max_retries + 1} attempts: {error}')
+
+
+def iter_trademe_pages(trademe, url, max_workers=None, requests_per_second=None, session_factory=None,
+                       checkpoint=None):
+    if max_workers is None:
+        max_workers = int(os.getenv('TRADEME_MAX_WORKERS', 4))
+    if requests_per_second is None:
+        requests_per_second = float(os.getenv('TRADEME_REQUESTS_PER_SECOND', 2))
+    session_factory = session_factory or connect_to_trademe
+    limiter = TokenBucket(requests_per_second)
+    # Pages saved by an earlier attempt at this run are read back instead of fetched again.
+    saved_pages = set(checkpoint.fetched_pages()) if checkpoint is not None else set()
+    if 1 in saved_pages:
+        parsed_data = checkpoint.load_page(1)
+    else:
+        # Make initial request to get number of pages
+        print('Fetching page 1 of n')
+        parsed_data = fetch_trademe_page(trademe, url, limiter)
+        metrics.increment('trademe_pages_total')
+        if checkpoint is not None:
+            checkpoint.save_page(1, parsed_data)
     total_count = parsed_data['TotalCount']
     total_n_requests = int(total_count/500) + 1
-    data_df = pd.DataFrame.from_dict(listings)
-    for i in range(2, total_n_requests+1):
+    yield 1, parsed_data['List']
+    del parsed_data
+    pages_to_fetch = [i for i in range(2, total_n_requests + 1) if i not in saved_pages]
+    if saved_pages:
+        print(f'Resuming with {total_n_requests - len(pages_to_fetch)} of {total_n_requests} pages already fetched')
+    metrics.increment('trademe_pages_resumed_total', len(saved_pages))
+    for i in sorted(saved_pages):
+        if 1 < i <= total_n_requests:
+            yield i, checkpoint.load_page(i)['List']
+    # OAuth1Session is not safe to share between threads, so each worker signs with its own session.
+    local = threading.local()
+
+    def fetch_page(i):
+        if not hasattr(local, 'session'):
+            local.session = session_factory()
         print(f'Fetching page {i} of {total_n_requests}')
-        name_num = str(i)
-        page_url = f'{url}&page={name_num}&sort_order=Default HTTP/1.1'
-        returned_page_all = trademe.get(page_url)
-        if returned_page_all.status_code != 200:
-            print('Error: ', returned_page_all.status_code)
-            print('Error message: ', returned_page_all.text)
-            # Todo: Implement error handling
-            break
-        data_raw = returned_page_all.content
-        parsed_data = json.loads(data_raw)
-        listings = parsed_data['List']
-        data_df = pd.concat([data_df, pd.DataFrame.from_dict(listings)], ignore_index=True)
-        time.sleep(0.5)     # Sleep for 0.5 seconds to avoid rate limiting
-    return data_df
+        page_url = f'{url}&page={i}&sort_order=Default HTTP/1.1'
+        return i, fetch_trademe_page(local.session, page_url, limiter)
+
+    # Only keep a couple of pages per worker in flight so a slow consumer doesn't buffer the whole result set.
+    executor = ThreadPoolExecutor(max_workers=max_workers)
+    try:
+        next_index = 0
+        pending = set()
+        while next_index < len(pages_to_fetch) or pending:
+            while next_index < len(pages_to_fetch) and len(pending) < 2 * max_workers:
+                pending.add(executor.submit(fetch_page, pages_to_fetch[next_index]))
+                next_index += 1
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            # Pages that made it are saved and passed on before a failed one raises, so a rerun skips them.
+            fetched = [future.result() for future in done if future.exception() is None]
+            for i, parsed_data in fetched:
+                metrics.increment('trademe_pages_total')
+                if checkpoint is not None:
+                    checkpoint.save_page(i, parsed_data)
+                yield i, parsed_data['List']
+            for future in done:
+                future.result()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+def fetch_trademe_data(trademe, url, **kwargs):
+    pages = dict(iter_trademe_pages(trademe, url, **kwargs))
+    listings = [listing for i in sorted(pages) for listing in pages[i]]
+    return pd.DataFrame.from_dict(listings)
+
+
+def iter_listing_batches(pages, checkpoint=None):
+    seen_listing_ids = set()
+    for page, listings in pages:
+        batch = pd.DataFrame.from_dict(listings)
+        if batch.empty:
+            continue
+        # Listings shift between pages while we paginate, so the same ListingId can turn up twice.
+        batch = batch.drop_duplicates(subset=['ListingId'])
+        # Pages upserted by an earlier attempt aren't deduplicated against the others: a listing that attempt kept
+        # on a page that never landed still has to be upserted with that page now.
+        if checkpoint is None or not checkpoint.is_upserted(page):
+            batch = batch[~batch['ListingId'].isin(seen_listing_ids)]
+            seen_listing_ids.update(batch['ListingId'])
+        if not batch.empty:
+            metrics.increment('listings_fetched_total', len(batch))
+            batch = normalise_listings(batch)
+            batch.attrs['page'] = page
+            yield batch
 
 
 def convert_date_string(date_string):
@@ -79,39 +246,280 @@ def extract_price(price_string):
         return None
 
 
-def store_date(data, supabase):
-    data = data.drop_duplicates(subset=['ListingId'])
+def convert_date_strings(date_strings):
+    timestamps = date_strings.str.extract(r'(\d+)', expand=False).astype('int64').to_numpy()
+    # convert_date_string goes through datetime.fromtimestamp, i.e. local time. Apply the same UTC offsets,
+    # looking them up once per quarter hour rather than once per row.
+    if time.daylight:
+        quarter_hours, inverse = np.unique(timestamps // 900000, return_inverse=True)
+        offsets = np.array([datetime.fromtimestamp(q * 900, timezone.utc).astimezone().utcoffset().total_seconds()
+                            for q in quarter_hours], dtype='int64')
+        offsets = offsets[inverse]
+    else:
+        offsets = -time.timezone
+    local_times = (timestamps // 1000 + offsets).astype('datetime64[s]')
+    formatted = np.char.replace(np.datetime_as_string(local_times, unit='s'), 'T', ' ')
+    return pd.Series(formatted, index=date_strings.index, dtype=object)
+
+
+def extract_prices(price_strings):
+    prices = price_strings.str.extract(r'(\$\d{1,3}(?:,\d{3})*(?:\.\d{2})?)', expand=False)
+    return prices.str.replace(r'[$,]', '', regex=True).astype(float)
+
+
+def normalise_listings(data):
+    columns = os.getenv('LISTING_COLUMNS').split(',')
+    # TradeMe leaves out empty fields, so a single page may not have every column.
+    data = data.reindex(columns=data.columns.union(columns, sort=False))
     data['ListingStatus'] = 'Listed'
-    data['StartDate'] = data['StartDate'].apply(convert_date_string)
-    data['EndDate'] = data['EndDate'].apply(convert_date_string)
-    data['Price'] = data['PriceDisplay'].apply(extract_price)
-    data['Price'] = data['Price'].replace('', None).astype(float, errors='ignore').replace({np.nan: None})
+    data['StartDate'] = convert_date_strings(data['StartDate'])
+    data['EndDate'] = convert_date_strings(data['EndDate'])
+    data['Price'] = extract_prices(data['PriceDisplay'])
     data['Parking'] = data['Parking'].replace('', None)
     data['Amenities'] = data['Amenities'].fillna('').replace('', None)
     data = data.replace({np.nan: None})
-    data['Latitude'] = data['GeographicLocation'].apply(lambda x: float(x['Latitude']))
-    data['Longitude'] = data['GeographicLocation'].apply(lambda x: float(x['Longitude']))
-    columns = os.getenv('LISTING_COLUMNS').split(',')
-    data = data[columns]
-    data_to_insert = []
-    for i in range(len(data)):
-        data_to_insert.append(data.iloc[i].to_dict())
-    supabase.table("Listings").upsert(data_to_insert, on_conflict='ListingId').execute()
+    locations = pd.DataFrame.from_records(data['GeographicLocation'].tolist(), columns=['Latitude', 'Longitude'])
+    data['Latitude'] = locations['Latitude'].astype(float).to_numpy()
+    data['Longitude'] = locations['Longitude'].astype(float).to_numpy()
+    return data[columns]
+
+
+def listings_to_records(data):
+    # Same result as data.to_dict('records'), but tolist() boxes each column to native types in one go
+    # instead of checking every cell.
+    columns = list(data.columns)
+    values = [data[column].tolist() for column in columns]
+    return [dict(zip(columns, row)) for row in zip(*values)]
+
+
+def store_date(data, supabase):
+    data = data.drop_duplicates(subset=['ListingId'])
+    return utils.upsert_in_batches(supabase, 'Listings', listings_to_records(normalise_listings(data)),
+                                   on_conflict='ListingId')
+
+
+def mark_upserted_pages(checkpoint, upserter, pending_pages):
+    # Records the pages whose batches have all landed and returns those still in flight.
+    finished = [(page, batch_ids) for page, batch_ids in pending_pages if upserter.finished(batch_ids)]
+    checkpoint.mark_upserted([page for page, batch_ids in finished if upserter.succeeded(batch_ids)])
+    return [item for item in pending_pages if item not in finished]
+
+
+@metrics.timed('stage_seconds', stage='store_batches')
+def store_batches(batches, supabase, manifest=None, checkpoint=None):
+    listing_ids = []
+    # Hashes are only written to the manifest once the batches carrying them have been upserted.
+    pending_hashes = []
+    # Likewise, a page only counts as upserted in the checkpoint once all of its batches have landed.
+    pending_pages = []
+    resumed_listings = 0
+    upserter = utils.BulkUpserter(supabase, 'Listings', on_conflict='ListingId')
+    try:
+        for batch in batches:
+            listing_ids.extend(batch['ListingId'])
+            page = batch.attrs.get('page')
+            if checkpoint is not None and checkpoint.is_upserted(page):
+                resumed_listings += len(batch)
+                metrics.increment('listings_resumed_total', len(batch))
+                continue
+            with metrics.timer('upsert_submit_seconds'):
+                if manifest is not None:
+                    to_upsert, hashes = manifest.classify(batch)
+                    metrics.increment('listings_unchanged_total', int((~to_upsert).sum()))
+                    batch = batch[to_upsert]
+                    hashes = hashes[to_upsert]
+                batch_ids = upserter.submit(listings_to_records(batch))
+            if manifest is not None:
+                pending_hashes.append((batch_ids, batch['ListingId'].to_numpy(), hashes))
+            if checkpoint is not None:
+                pending_pages = mark_upserted_pages(checkpoint, upserter, pending_pages + [(page, batch_ids)])
+    finally:
+        # Let batches already handed to the pool land even if fetching fails part way.
+        report = upserter.close()
+        print(report)
+        if checkpoint is not None:
+            mark_upserted_pages(checkpoint, upserter, pending_pages)
+            if resumed_listings:
+                print(f'Skipped {resumed_listings} listings upserted by an earlier attempt at this run')
+        if manifest is not None:
+            failed_batch_ids = set(report.failed_batch_ids)
+            for batch_ids, batch_listing_ids, hashes in pending_hashes:
+                if not failed_batch_ids.intersection(batch_ids):
+                    manifest.update(batch_listing_ids, hashes)
+            print(f'Incremental ingest: {manifest.summary()}')
+    return listing_ids, report
+
+
+class ReconcileGuardError(Exception):
+    pass
+
+
+class ReconcileReport:
+    def __init__(self, listed_count, fetched_count, delisted_listings, timings, dry_run, guarded=False):
+        self.listed_count = listed_count
+        self.fetched_count = fetched_count
+        self.delisted_listings = delisted_listings
+        self.timings = timings
+        self.dry_run = dry_run
+        # Whether the fetch was too small to act on; only a dry run gets this far with it.
+        self.guarded = guarded
+
+    def __str__(self):
+        action = 'Would delist' if self.dry_run else 'Delisted'
+        timings = ', '.join(f'{phase} {seconds:.2f}s' for phase, seconds in self.timings.items())
+        guard = ' A real run would refuse to reconcile this fetch.' if self.guarded else ''
+        return (f'{action} {len(self.delisted_listings)} of {self.listed_count} listed listings '
+                f'({self.fetched_count} fetched from TradeMe).{guard} {timings}')
+
+
+def fetch_listed_listing_ids(supabase, page_size=None):
+    page_size = page_size or int(os.getenv('SUPABASE_PAGE_SIZE', 1000))
+    listing_ids = []
+    last_listing_id = None
+    # Keyset pagination on the primary key. Stop on an empty page rather than a short one because PostgREST
+    # may cap the page below page_size.
+    while True:
+        query = supabase.table('Listings').select('ListingId').eq('ListingStatus', 'Listed')
+        if last_listing_id is not None:
+            query = query.gt('ListingId', last_listing_id)
+        page = query.order('ListingId').limit(page_size).execute().data
+        if not page:
+            break
+        listing_ids.extend(row['ListingId'] for row in page)
+        last_listing_id = page[-1]['ListingId']
+    return np.array(listing_ids, dtype='int64')
+
+
+@metrics.timed('stage_seconds', stage='reconcile_delisted_listings')
+def reconcile_delisted_listings(listing_ids, supabase, dry_run=False, min_fetched_ratio=None, chunk_size=None):
+    if min_fetched_ratio is None:
+        min_fetched_ratio = float(os.getenv('RECONCILE_MIN_FETCHED_RATIO', 0.8))
+    chunk_size = chunk_size or int(os.getenv('RECONCILE_CHUNK_SIZE', 200))
+    timings = {}
+
+    start = time.perf_counter()
+    db_listings = np.unique(fetch_listed_listing_ids(supabase))
+    timings['read'] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    fetched_listings = np.unique(np.asarray(list(listing_ids), dtype='int64'))
+    delisted_listings = np.setdiff1d(db_listings, fetched_listings, assume_unique=True)
+    timings['diff'] = time.perf_counter() - start
+
+    guarded = len(fetched_listings) < min_fetched_ratio * len(db_listings)
+    report = ReconcileReport(len(db_listings), len(fetched_listings), delisted_listings, timings, dry_run, guarded)
+    # A TradeMe outage or a truncated fetch looks exactly like a mass delisting, so refuse to act on one. A dry run
+    # writes nothing, so it still reports what the fetch would have delisted.
+    if guarded and not dry_run:
+        raise ReconcileGuardError(f'Refusing to reconcile: only {len(fetched_listings)} listings fetched against '
+                                  f'{len(db_listings)} listed in the database (minimum ratio {min_fetched_ratio}). '
+                                  f'{report}')
+
+    start = time.perf_counter()
+    if not dry_run:
+        # Chunked so the in.(...) filter keeps the request URL short.
+        for i in range(0, len(delisted_listings), chunk_size):
+            chunk = delisted_listings[i:i + chunk_size].tolist()
+            supabase.table('Listings').update({'ListingStatus': 'Delisted'}).in_('ListingId', chunk).execute()
+        metrics.increment('listings_delisted_total', len(delisted_listings))
+    timings['update'] = time.perf_counter() - start
+    for phase, seconds in timings.items():
+        metrics.observe('reconcile_phase_seconds', seconds, phase=phase)
+    print(report)
+    return report
+
+
+class IngestReport:
+    def __init__(self, listing_count, upsert_report, reconcile_report, aggregate_reports):
+        self.listing_count = listing_count
+        self.upsert_report = upsert_report
+        self.reconcile_report = reconcile_report
+        self.aggregate_reports = aggregate_reports
+        self.failed_batches = sum(len(report.failed_batch_ids) for report in [upsert_report] + aggregate_reports)
 
 
-def reconcile_delisted_listings(data_df, supabase):
-    db_listings = supabase.table('Listings').select('ListingId').eq('ListingStatus', 'Listed').execute()
-    db_listings = [x['ListingId'] for x in db_listings.data]
-    db_listings_set = set(db_listings)
-    fetched_listings_set = set(data_df['ListingId'])
-    delisted_listings = db_listings_set - fetched_listings_set
-    supabase.table('Listings').update({'ListingStatus': 'Delisted'}).in_('ListingId', delisted_listings).execute()
+def run(trademe, url, supabase, incremental=False, reconcile_dry_run=False, manifest_path=None, archive=False,
+        archive_path=None, work_dir=None, fresh=False, **fetch_kwargs):
+    # The nightly ingest: fetch every page, upsert as pages arrive, reconcile delistings, append to the archive
+    # and rebuild the aggregate tables. fetch_kwargs go to iter_trademe_pages.
+    manifest = ListingManifest(manifest_path or get_manifest_path()) if incremental else None
+    listing_archive = ListingArchive(archive_path) if archive else None
+    work_dir = work_dir or get_work_dir()
+    checkpoint = IngestCheckpoint(work_dir, url, fresh=fresh)
+    # A run that raises, e.g. on a fetch the reconcile guard refuses, skips the archive and the aggregates but
+    # still closes the manifest and keeps its checkpoint for the next attempt.
+    completed = False
+    try:
+        if checkpoint.resumed:
+            print(f'Resuming ingest run from {work_dir}: {checkpoint.summary()}')
+        # Pages are normalised and upserted as they arrive. Delistings are only reconciled once every page is
+        # in. store_batches drives the fetch, so the time spent waiting on TradeMe is recorded as its own stage.
+        pages = metrics.timed_iter(iter_trademe_pages(trademe, url, checkpoint=checkpoint, **fetch_kwargs),
+                                   'stage_seconds', stage='fetch')
+        batches = iter_listing_batches(pages, checkpoint)
+        if listing_archive is not None:
+            batches = listing_archive.collect(batches)
+        listing_ids, report = store_batches(batches, supabase, manifest, checkpoint)
+        checkpoint.finish_stage('fetch')
+        if not report.failed_batch_ids:
+            checkpoint.finish_stage('upsert')
+        dry_run = reconcile_dry_run
+        if not checkpoint.reconcile_is_safe():
+            # Upserts never write ListingStatus, so a listing delisted by mistake would stay delisted. The next
+            # full run reconciles instead.
+            print(f'Reconciling as a dry run: this run resumed pages saved {checkpoint.age_minutes():.0f} minutes '
+                  'ago')
+            dry_run = True
+        reconcile_report = reconcile_delisted_listings(listing_ids, supabase, dry_run=dry_run)
+        checkpoint.finish_stage('reconcile')
+        if manifest is not None and not dry_run:
+            # A delisted listing that comes back has to be upserted again, even if nothing else about it
+            # changed.
+            manifest.forget(reconcile_report.delisted_listings)
+        if listing_archive is not None and not reconcile_dry_run:
+            with metrics.timer('stage_seconds', stage='archive'):
+                listing_archive.append(pd.Timestamp.now(), reconcile_report.delisted_listings, reconciled=not dry_run)
+            checkpoint.finish_stage('archive')
+        aggregate_reports = []
+        if not reconcile_dry_run:
+            with metrics.timer('stage_seconds', stage='aggregates'):
+                aggregate_reports = aggregates.publish_aggregates(supabase)
+        ingest_report = IngestReport(len(set(listing_ids)), report, reconcile_report, aggregate_reports)
+        # Failed batches leave their pages unmarked, so the next run upserts just those again.
+        completed = not ingest_report.failed_batches
+        return ingest_report
+    finally:
+        if manifest is not None:
+            manifest.close()
+        checkpoint.close(completed=completed)
 
 
 if __name__ == '__main__':
-    trademe = connect_to_trademe()
-    url = os.getenv('TRADEME_HOUSES_URL')
-    data = fetch_trademe_data(trademe, url)
-    supabase = utils.connect_to_supabase()
-    reconcile_delisted_listings(data, supabase)
-    store_date(data, supabase)
+    parser = argparse.ArgumentParser(description='Fetch residential listings from TradeMe and store them in Supabase.')
+    parser.add_argument('--incremental', action='store_true',
+                        help='Only upsert listings that are new or have changed since the last run.')
+    parser.add_argument('--reconcile-dry-run', action='store_true',
+                        help='Report how many listings would be delisted without updating them.')
+    parser.add_argument('--manifest', default=get_manifest_path(),
+                        help='SQLite file holding the content hash of every stored listing.')
+    parser.add_argument('--archive', action='store_true',
+                        help="Append the day's listing state to the local Parquet archive.")
+    parser.add_argument('--archive-path', default=get_archive_path(),
+                        help='Directory of the listing archive, partitioned by run date.')
+    parser.add_argument('--work-dir', default=get_work_dir(),
+                        help='Directory for the raw pages and progress of this run, so a failed run can resume.')
+    parser.add_argument('--fresh', action='store_true',
+                        help='Discard the checkpoint of an unfinished run and start over.')
+    parser.add_argument('--metrics', default=metrics.get_metrics_path(),
+                        help="Append timings and counters to this JSON-lines file ('-' for stderr).")
+    args = parser.parse_args()
+    if args.metrics:
+        metrics.configure(args.metrics)
+        # Written however the run ends, so a failed run still reports how far it got.
+        atexit.register(metrics.write_summary, script='fetch_and_store')
+    ingest_report = run(connect_to_trademe(), os.getenv('TRADEME_HOUSES_URL'), utils.connect_to_supabase(),
+                        incremental=args.incremental, reconcile_dry_run=args.reconcile_dry_run,
+                        manifest_path=args.manifest, archive=args.archive, archive_path=args.archive_path,
+                        work_dir=args.work_dir, fresh=args.fresh)
+    if ingest_report.failed_batches:
+        sys.exit(f'{ingest_report.failed_batches} batches failed to upsert')
@@ -0,0 +1,289 @@
+import os
+import threading
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+from dash import Patch
+import aggregates
+import map_pipeline
+import timeseries
+
+plotly_express_lock = threading.Lock()
+plotly_express_module = None
+
+
+def plotly_express():
+    # plotly.express pulls in most of plotly and takes longer to import than the dashboard takes to bind, so it is
+    # imported with the first figure that needs it. It also builds the default template's trace defaults lazily as
+    # figures first read them, which races when threaded workers draw their first figures at the same time, so one
+    # small figure of each kind the dashboard draws is built here first.
+    global plotly_express_module
+    if plotly_express_module is None:
+        with plotly_express_lock:
+            if plotly_express_module is None:
+                import plotly.express as px
+                warm_up = pd.DataFrame({'x': [0, 1], 'y': [0, 1]})
+                for draw in (px.bar, px.line, px.scatter):
+                    draw(warm_up, x='x', y='y')
+                plotly_express_module = px
+    return plotly_express_module
+
+
+def has_trace(figure):
+    # Whether a figure sent back by the browser has a first trace to patch. An undrawn dcc.Graph holds no traces.
+    return bool(figure and figure.get('data'))
+
+
+def patch_trace(**values):
+    # Replace only the first trace's data on a figure the browser already has, keeping its layout.
+    patch = Patch()
+    for key, value in values.items():
+        patch['data'][0][key] = value
+    return patch
+
+
+def create_price_histogram(bin_starts, counts):
+    bin_width = aggregates.get_price_bin_width() / 1000000
+    fig = go.Figure(go.Bar(x=np.asarray(bin_starts) + bin_width / 2, y=counts, width=bin_width,
+                           hovertemplate='$%{x:.2f}m: %{y}<extra></extra>'))
+    fig.update_layout(title='Price Distribution', xaxis_title='Price', yaxis_title='count', bargap=0)
+    return fig
+
+
+def price_histogram(prices):
+    # The same fixed-width bins as the PriceHistogram aggregate, binned in dollars so both agree exactly.
+    bin_width = aggregates.get_price_bin_width()
+    bins = aggregates.price_bins(np.round(np.asarray(prices, dtype=float) * 1000000), bin_width)
+    bin_starts, counts = np.unique(bins, return_counts=True)
+    return bin_starts / 1000000, counts
+
+
+def median_price_by(filtered_data, column):
+    median_price = filtered_data.groupby(column, observed=True)['Price'].median().reset_index()
+    return aggregates.sort_median_prices(median_price, column)
+
+
+def create_median_price_bar(median_price, column):
+    fig = plotly_express().bar(
+        median_price,
+        x=column,
+        y='Price',
+        labels={"Price": "Median Price (millions)"},
+        title=f'Median Price by {column}'
+    )
+    if column == 'Suburb':
+        fig.update_layout(xaxis_tickangle=-90)
+    return fig
+
+
+def get_outlier_limit():
+    return int(os.getenv('DASHBOARD_BOX_OUTLIERS', 50))
+
+
+def box_statistics(groups, prices, max_outliers=None):
+    # Quartiles (linear interpolation, as plotly computes them), whiskers at the furthest prices within 1.5 IQR and
+    # a notch of 1.57 IQR / sqrt(n) per group, from one sort by group and price. Outliers are thinned to an evenly
+    # spaced sample of at most max_outliers per group, always keeping the extremes.
+    max_outliers = max_outliers or get_outlier_limit()
+    groups, prices = np.asarray(groups), np.asarray(prices, dtype=float)
+    keep = pd.notna(groups) & ~np.isnan(prices)
+    groups, prices = groups[keep], prices[keep]
+    order = np.lexsort((prices, groups))
+    groups, prices = groups[order], prices[order]
+    keys, starts, counts = np.unique(groups, return_index=True, return_counts=True)
+    if not len(keys):
+        return pd.DataFrame(columns=['group', 'count', 'q1', 'median', 'q3', 'lowerfence', 'upperfence',
+                                     'notchspan']), pd.DataFrame(columns=['group', 'price'])
+
+    def quantile(q):
+        position = starts + q * (counts - 1)
+        low = np.floor(position).astype(int)
+        high = np.minimum(low + 1, starts + counts - 1)
+        return prices[low] + (prices[high] - prices[low]) * (position - low)
+
+    q1, median, q3 = quantile(0.25), quantile(0.5), quantile(0.75)
+    iqr = q3 - q1
+    group_index = np.repeat(np.arange(len(keys)), counts)
+    inside = (prices >= (q1 - 1.5 * iqr)[group_index]) & (prices <= (q3 + 1.5 * iqr)[group_index])
+    stats = pd.DataFrame({
+        'group': keys,
+        'count': counts,
+        'q1': q1,
+        'median': median,
+        'q3': q3,
+        'lowerfence': np.minimum.reduceat(np.where(inside, prices, np.inf), starts),
+        'upperfence': np.maximum.reduceat(np.where(inside, prices, -np.inf), starts),
+        'notchspan': 1.57 * iqr / np.sqrt(counts),
+    })
+    outliers = np.flatnonzero(~inside)
+    sample = [group_outliers[np.unique(np.linspace(0, len(group_outliers) - 1, max_outliers).round().astype(int))]
+              for group_outliers in np.split(outliers, np.searchsorted(outliers, starts[1:])) if len(group_outliers)]
+    sample = np.concatenate(sample) if sample else np.array([], dtype=int)
+    return stats, pd.DataFrame({'group': groups[sample], 'price': prices[sample]})
+
+
+def create_price_boxplot(stats, outliers, title, x_title=None, notched=True):
+    box = go.Box(x=stats['group'], q1=stats['q1'], median=stats['median'], q3=stats['q3'],
+                 lowerfence=stats['lowerfence'], upperfence=stats['upperfence'], notched=notched,
+                 notchspan=stats['notchspan'] if notched else None, boxpoints=False, name='Price')
+    points = go.Scatter(x=outliers['group'], y=outliers['price'], mode='markers', name='Outliers',
+                        marker={'size': 4, 'opacity': 0.6}, hovertemplate='$%{y:.2f}m<extra></extra>')
+    fig = go.Figure([box, points])
+    fig.update_layout(title=title, yaxis_title='Price (millions)', xaxis_title=x_title, showlegend=False,
+                      height=800)
+    return fig
+
+
+def create_price_bedrooms_boxplot(filtered_data):
+    stats, outliers = box_statistics(filtered_data['Bedrooms'].to_numpy(), filtered_data['Price'].to_numpy())
+    fig_price_bedrooms = create_price_boxplot(stats, outliers, 'Price Distribution vs. Bedrooms', 'Bedrooms')
+    fig_price_bedrooms.update_layout(xaxis_type='linear')  # Treats the bedroom numbers as categorical
+    return fig_price_bedrooms
+
+
+def create_price_bathrooms_boxplot(filtered_data):
+    stats, outliers = box_statistics(filtered_data['Bathrooms'].to_numpy(), filtered_data['Price'].to_numpy())
+    fig_price_bathrooms = create_price_boxplot(stats, outliers, 'Price Distribution vs. Bathrooms', 'Bathrooms')
+    fig_price_bathrooms.update_layout(xaxis_type='linear')  # Treats the bathroom numbers as categorical
+    return fig_price_bathrooms
+
+
+class DashboardFigures:
+    # Builds every dashboard figure from the query engine's filtered frames. Each figure has its own cache keyed
+    # on the normalised filter state; figures whose layout never changes cache only their trace data and, when the
+    # browser already holds a drawn trace, are sent as a Patch of that data. The box plots, the map (per viewport)
+    # and the price-over-time chart are cached whole. When the filters are coarse enough, the listing counts, the
+    # median price bars, the histogram and the property type counts come from the published aggregate tables
+    # instead of raw rows.
+    def __init__(self, engine, aggregate_store=None, cache_size=None):
+        self.engine = engine
+        self.aggregate_store = aggregate_store
+        cache_size = cache_size or int(os.getenv('DASHBOARD_FIGURE_CACHE_SIZE', 8))
+        for name in ['median_prices', 'price_histogram', 'property_type_counts', 'area_and_price', 'listing_counts',
+                     'stats', 'median_price_over_time', 'listings_on_map', 'price_vs_bedrooms', 'price_vs_bathrooms']:
+            setattr(self, name, lru_cache(maxsize=cache_size)(getattr(self, f'_{name}')))
+
+    def strict(self, filters):
+        return self.engine.filter(filters)[0]
+
+    def _median_prices(self, filters, column):
+        if self.answers_whole_groups(filters) and filters.property_type is None:
+            median_price = self.aggregate_store.median_prices(column, filters.end_date)
+            if median_price is not None:
+                return median_price
+        return median_price_by(self.strict(filters), column)
+
+    def aggregate_group(self, filters):
+        # The aggregate (level, names, null tolerant) group answering a time series, or None for raw rows.
+        if (self.aggregate_store is None or filters.property_type is not None
+                or not self.engine.is_full_range(filters)):
+            return None
+        return self.engine.location_group(filters)
+
+    def answers_whole_groups(self, filters):
+        # Whether the filters keep every listing with a price, bedrooms and bathrooms that started by the end date,
+        # bar the property type.
+        return (self.aggregate_store is not None and filters.drill_down is None and filters.region is None
+                and filters.district is None and filters.suburb is None and self.engine.is_full_range(filters)
+                and not self.engine.drops_delisted(filters))
+
+    def answers_from_histogram(self, filters):
+        # The histogram and type counts only come from aggregates when nothing but the property type filters rows.
+        return self.answers_whole_groups(filters) and not self.engine.drops_unstarted(filters)
+
+    def _price_histogram(self, filters):
+        if self.answers_from_histogram(filters):
+            return self.aggregate_store.price_histogram(filters.property_type)
+        return price_histogram(self.strict(filters)['Price'])
+
+    def _property_type_counts(self, filters):
+        if self.answers_from_histogram(filters):
+            return self.aggregate_store.property_type_counts(filters.property_type)
+        counts = self.strict(filters)['PropertyType'].value_counts()
+        return counts[counts > 0].reset_index()
+
+    def _area_and_price(self, filters):
+        return self.strict(filters)[['Area', 'Price']]
+
+    def _listing_counts(self, filters):
+        date_range = pd.date_range(start=filters.start_date, end=filters.end_date, freq='D')
+        group = self.aggregate_group(filters)
+        if group is not None:
+            level, names, null_tolerant = group
+            listing_count_by_date = self.aggregate_store.listing_counts(
+                level, names + ((aggregates.MISSING_NAME,) if null_tolerant else ()), date_range)
+            if listing_count_by_date is not None:
+                return date_range, listing_count_by_date.tolist()
+        filtered_data_with_nulls = self.engine.filter(filters)[1]
+        return date_range, timeseries.daily_listing_counts(filtered_data_with_nulls, date_range).tolist()
+
+    def _stats(self, filters):
+        filtered_data, filtered_data_with_nulls = self.engine.filter(filters)
+        count = len(filtered_data_with_nulls)
+        median_price = filtered_data['Price'].median() if count > 0 else 0
+        return count, median_price
+
+    def _median_price_over_time(self, filters):
+        filtered_data = self.strict(filters)
+        n_days = (filtered_data['LastUpdatedAt'].max() - filtered_data['LastUpdatedAt'].min()).days
+        if n_days < 10:
+            # Just show one boxplot for the median price, but make it overall... no x split
+            stats, outliers = box_statistics(np.full(len(filtered_data), ' '), filtered_data['Price'].to_numpy())
+            return create_price_boxplot(stats, outliers, 'Median Price Overall', notched=False)
+        date_range = pd.date_range(start=filters.start_date, end=filters.end_date, freq='D')
+        rolling_median = timeseries.daily_median_prices(filtered_data, date_range).tolist()
+        return plotly_express().line(
+            rolling_median,
+            x=date_range,
+            y=rolling_median,
+            labels={"y": "Median Price (millions)", "x": "Date"},
+            title='Median Price by Date'
+        )
+
+    def _listings_on_map(self, filters, viewport):
+        fig_map, mode, markers = map_pipeline.create_map_figure(self.strict(filters), viewport)
+        return fig_map, mode, markers, len(fig_map.to_json())
+
+    def _price_vs_bedrooms(self, filters):
+        return create_price_bedrooms_boxplot(self.strict(filters))
+
+    def _price_vs_bathrooms(self, filters):
+        return create_price_bathrooms_boxplot(self.strict(filters))
+
+    def median_price_figure(self, filters, column, drawn):
+        median_price = self.median_prices(filters, column)
+        if drawn:
+            return patch_trace(x=median_price[column].tolist(), y=median_price['Price'].tolist())
+        return create_median_price_bar(median_price, column)
+
+    def price_distribution_figure(self, filters, drawn):
+        bin_starts, counts = self.price_histogram(filters)
+        if drawn:
+            bin_width = aggregates.get_price_bin_width() / 1000000
+            return patch_trace(x=(bin_starts + bin_width / 2).tolist(), y=counts.tolist())
+        return create_price_histogram(bin_starts, counts)
+
+    def property_type_figure(self, filters, drawn):
+        counts = self.property_type_counts(filters)
+        if drawn:
+            return patch_trace(x=counts.index.tolist(), y=counts['PropertyType'].tolist())
+        return plotly_express().bar(counts, x=counts.index, y='PropertyType',
+                                    title='Number of Listings by Property Type')
+
+    def price_vs_area_figure(self, filters, drawn):
+        area_and_price = self.area_and_price(filters)
+        if drawn:
+            return patch_trace(x=area_and_price['Area'].tolist(), y=area_and_price['Price'].tolist())
+        return plotly_express().scatter(area_and_price, x='Area', y='Price', title='Price vs. Floor Area')
+
+    def listing_count_figure(self, filters, drawn):
+        date_range, listing_count_by_date = self.listing_counts(filters)
+        if drawn:
+            return patch_trace(x=date_range.strftime('%Y-%m-%d').tolist(), y=listing_count_by_date)
+        return plotly_express().line(
+            x=date_range,
+            y=listing_count_by_date,
+            title='Listing Count Over Time',
+            labels={"y": "Number of Listings", "x": "Date"}
+        )
@@ -0,0 +1,33 @@
+"""Production serving: gunicorn -c gunicorn.conf.py dashboard:server
+
+Every worker memory-maps the same published dataset from DASHBOARD_SHARED_DIR (see shared_store.py) instead of
+pulling and holding its own copy of dash_view.
+"""
+import os
+
+# An empty DASHBOARD_SHARED_DIR turns the shared store off: each worker then loads its own copy of the snapshot.
+shared_dir = os.environ.setdefault('DASHBOARD_SHARED_DIR', 'dashboard_shared')
+# With DASHBOARD_DEFERRED_LOAD=1 workers attach in a background thread and serve a loading page until they have.
+deferred_load = os.getenv('DASHBOARD_DEFERRED_LOAD') == '1'
+
+bind = f'0.0.0.0:{os.getenv("PORT", 10000)}'
+workers = int(os.getenv('DASHBOARD_WORKERS', 4))
+threads = int(os.getenv('DASHBOARD_THREADS', 2))
+# Workers attach to the store on import, which is quick once a version is published, but the first start may
+# still be waiting on Supabase.
+timeout = int(os.getenv('DASHBOARD_WORKER_TIMEOUT', 120))
+
+
+def on_starting(server):
+    # Publish once in the master, before any worker is forked, so workers never queue on the store lock. A deferred
+    # load binds straight away instead, and the first worker to attach publishes while the others wait on the lock.
+    if not shared_dir or deferred_load:
+        return
+    from dotenv import load_dotenv
+    import shared_store
+    import utils
+
+    load_dotenv()
+    load_dotenv('config.env')
+    name = shared_store.ensure_published(shared_dir, utils.connect_to_supabase)
+    server.log.info('Serving dashboard data version %s', name)
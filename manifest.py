@@ -0,0 +1,69 @@
+import os
+import sqlite3
+import numpy as np
+import pandas as pd
+
+NUMERIC_TYPES = {'integer', 'floating', 'mixed-integer-float', 'decimal'}
+
+
+def get_manifest_path():
+    return os.getenv('LISTING_MANIFEST_PATH', 'listing_manifest.sqlite')
+
+
+def hash_listings(data):
+    # A page with a missing value turns an int column into floats or objects, so hash a canonical text form of
+    # every value. Otherwise the same listing would hash differently depending on which page it arrived on.
+    canonical = {}
+    for column in data.columns:
+        values = data[column]
+        if pd.api.types.infer_dtype(values, skipna=True) in NUMERIC_TYPES:
+            canonical[column] = pd.to_numeric(values).astype(float).astype(str)
+        else:
+            canonical[column] = values.where(values.notna(), 'nan').astype(str)
+    hashes = pd.util.hash_pandas_object(pd.DataFrame(canonical), index=False).to_numpy()
+    # SQLite integers are signed.
+    return hashes.view('int64')
+
+
+class ListingManifest:
+    # Content hash of the last upserted version of every listing, kept in a local SQLite file.
+    def __init__(self, path):
+        self.path = path
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS ListingHashes '
+                                '(ListingId INTEGER PRIMARY KEY, Hash INTEGER NOT NULL) WITHOUT ROWID')
+        stored = pd.read_sql_query('SELECT ListingId, Hash FROM ListingHashes', self.connection)
+        self.listing_ids = pd.Index(stored['ListingId'].to_numpy())
+        self.stored_hashes = stored['Hash'].to_numpy(dtype='int64')
+        self.counts = {'new': 0, 'changed': 0, 'unchanged': 0}
+
+    def __len__(self):
+        return len(self.listing_ids)
+
+    def classify(self, data):
+        hashes = hash_listings(data)
+        positions = self.listing_ids.get_indexer(data['ListingId'].to_numpy())
+        is_new = positions == -1
+        is_changed = np.zeros(len(positions), dtype=bool)
+        if len(self.stored_hashes):
+            is_changed = ~is_new & (self.stored_hashes[positions] != hashes)
+        self.counts['new'] += int(is_new.sum())
+        self.counts['changed'] += int(is_changed.sum())
+        self.counts['unchanged'] += int((~is_new & ~is_changed).sum())
+        return is_new | is_changed, hashes
+
+    def update(self, listing_ids, hashes):
+        rows = zip(np.asarray(listing_ids).tolist(), np.asarray(hashes).tolist())
+        self.connection.executemany('INSERT OR REPLACE INTO ListingHashes (ListingId, Hash) VALUES (?, ?)', rows)
+        self.connection.commit()
+
+    def forget(self, listing_ids):
+        rows = ((listing_id,) for listing_id in np.asarray(list(listing_ids)).tolist())
+        self.connection.executemany('DELETE FROM ListingHashes WHERE ListingId = ?', rows)
+        self.connection.commit()
+
+    def close(self):
+        self.connection.close()
+
+    def summary(self):
+        return ', '.join(f'{count} {kind}' for kind, count in self.counts.items())
@@ -0,0 +1,137 @@
+import math
+import os
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+import plotly.graph_objects as go
+
+DETAIL_COLUMNS = ['Title', 'Price', 'Region', 'District', 'Suburb', 'Area', 'LandArea', 'Bedrooms', 'Bathrooms',
+                  'PropertyType', 'StartDate']
+DEFAULT_ZOOM = 4
+# Grid cells are a sixteenth of a 256px map tile wide, so bins stay about 16px across at every zoom level.
+CELLS_PER_TILE = 16
+MAP_WIDTH_PX = 1200
+MAP_HEIGHT_PX = 800
+
+Viewport = namedtuple('Viewport', ['west', 'south', 'east', 'north', 'zoom'])
+
+
+def get_point_limit():
+    return int(os.getenv('DASHBOARD_MAP_POINT_LIMIT', 2000))
+
+
+def viewport_around(lon, lat, zoom):
+    # Approximates the bounds of a MAP_WIDTH_PX by MAP_HEIGHT_PX map, for when plotly hasn't reported them.
+    lon_span = 360 / 2 ** zoom * MAP_WIDTH_PX / 256
+    lat_span = lon_span * MAP_HEIGHT_PX / MAP_WIDTH_PX * math.cos(math.radians(lat))
+    return Viewport(lon - lon_span / 2, lat - lat_span / 2, lon + lon_span / 2, lat + lat_span / 2, zoom)
+
+
+def viewport_from_relayout(relayout_data):
+    # relayoutData carries the visible corners under mapbox._derived after every pan or zoom. Other relayout
+    # events (autosize, legend clicks) return None.
+    if not relayout_data or 'mapbox.zoom' not in relayout_data:
+        return None
+    zoom = relayout_data['mapbox.zoom']
+    if 'mapbox._derived' in relayout_data:
+        lons, lats = zip(*relayout_data['mapbox._derived']['coordinates'])
+        return Viewport(min(lons), min(lats), max(lons), max(lats), zoom)
+    center = relayout_data['mapbox.center']
+    return viewport_around(center['lon'], center['lat'], zoom)
+
+
+def in_viewport(data, viewport):
+    latitude = data['Latitude'].to_numpy(dtype=float)
+    longitude = data['Longitude'].to_numpy(dtype=float)
+    return ((latitude >= viewport.south) & (latitude <= viewport.north)
+            & (longitude >= viewport.west) & (longitude <= viewport.east))
+
+
+def bin_listings(data, zoom):
+    # Listing counts, median price and mean position per square grid cell, sized for the zoom level.
+    cell_size = 360 / 2 ** math.floor(zoom) / CELLS_PER_TILE
+    latitude = data['Latitude'].to_numpy(dtype=float)
+    longitude = data['Longitude'].to_numpy(dtype=float)
+    prices = data['Price'].to_numpy(dtype=float)
+    # Column and row numbers stay far below 2 ** 31 at any zoom, so one int64 key identifies a cell.
+    columns = np.floor(longitude / cell_size).astype(np.int64)
+    rows = np.floor(latitude / cell_size).astype(np.int64)
+    _, groups = np.unique(columns * 2 ** 32 + rows, return_inverse=True)
+    counts = np.bincount(groups)
+    # Unpriced listings count towards the cell's size and position but not its median. NaN sorts last, so each
+    # cell's priced rows are the first priced_counts of its slice.
+    priced_counts = np.bincount(groups[~np.isnan(prices)], minlength=len(counts))
+    order = np.lexsort((prices, groups))
+    starts = np.cumsum(counts) - counts
+    sorted_prices = prices[order]
+    lower = sorted_prices[starts + np.maximum(priced_counts - 1, 0) // 2]
+    upper = sorted_prices[starts + priced_counts // 2]
+    medians = np.where(priced_counts > 0, (lower + upper) / 2, np.nan)
+    return pd.DataFrame({
+        'Latitude': np.bincount(groups, weights=latitude) / counts,
+        'Longitude': np.bincount(groups, weights=longitude) / counts,
+        'Count': counts,
+        'MedianPrice': medians,
+    })
+
+
+def describe_bin(count, median, separator=', '):
+    # Plotly sends a NaN median back in clickData as None.
+    if median is None or np.isnan(median):
+        return f'{count:.0f} listings here{separator}none with a price'
+    return f'{count:.0f} listings here{separator}median price ${median:.2f}m'
+
+
+def create_map_figure(filtered_data, viewport):
+    located = filtered_data[filtered_data['Latitude'].notna() & filtered_data['Longitude'].notna()]
+    if viewport is None:
+        center = (located['Longitude'].mean(), located['Latitude'].mean()) if len(located) else (174.0, -41.0)
+        viewport = viewport_around(*center, DEFAULT_ZOOM)
+    visible = located[in_viewport(located, viewport)]
+    if len(visible) <= get_point_limit():
+        mode = 'points'
+        prices = visible['Price'].to_numpy(dtype=float)
+        # Plotly rejects NaN sizes; unpriced listings get the smallest marker.
+        trace = go.Scattermapbox(
+            lat=visible['Latitude'], lon=visible['Longitude'], mode='markers',
+            marker={'size': np.nan_to_num(prices), 'sizemode': 'area',
+                    'sizeref': 2 * np.nanmax(prices, initial=1) / 20 ** 2, 'sizemin': 3},
+            customdata=visible['ListingId'], hoverinfo='text',
+            hovertext=[f'${price:.2f}m' if not np.isnan(price) else 'No price' for price in prices],
+        )
+    else:
+        mode = 'bins'
+        bins = bin_listings(visible, viewport.zoom)
+        trace = go.Scattermapbox(
+            lat=bins['Latitude'], lon=bins['Longitude'], mode='markers',
+            marker={'size': bins['Count'], 'sizemode': 'area', 'sizeref': 2 * bins['Count'].max() / 40 ** 2,
+                    'sizemin': 4, 'color': bins['MedianPrice'], 'colorscale': 'Viridis',
+                    'colorbar': {'title': 'Median Price (millions)'}},
+            customdata=np.stack([bins['Count'], bins['MedianPrice']], axis=1),
+            hovertext=[describe_bin(count, median, '<br>')
+                       for count, median in zip(bins['Count'], bins['MedianPrice'])],
+            hoverinfo='text',
+        )
+    fig_map = go.Figure(trace)
+    # A fixed uirevision keeps the user's pan and zoom when the figure is replaced.
+    fig_map.update_layout(mapbox_style='open-street-map', title=f'Listings on Map ({len(visible)} in view)',
+                          height=800, uirevision='listings-on-map',
+                          mapbox={'center': {'lon': (viewport.west + viewport.east) / 2,
+                                             'lat': (viewport.south + viewport.north) / 2},
+                                  'zoom': viewport.zoom})
+    return fig_map, mode, len(trace.lat)
+
+
+def listing_details(data, click_data):
+    # The map only carries each listing's id; its details are looked up when it is clicked.
+    if not click_data:
+        return ['Click a listing on the map for its details.']
+    customdata = click_data['points'][0].get('customdata')
+    if isinstance(customdata, list):
+        return [f'{describe_bin(*customdata)}. Zoom in to see each listing.']
+    listing = data[data['ListingId'] == customdata]
+    if listing.empty:
+        return ['That listing is no longer in the data.']
+    listing = listing.iloc[0]
+    return [f'Price: ${listing[column]:.2f}m' if column == 'Price' and pd.notna(listing[column])
+            else f'{column}: {listing[column]}' for column in DETAIL_COLUMNS]
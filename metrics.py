@@ -0,0 +1,167 @@
+import functools
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import nullcontext
+
+# Counters and timings for the ingest pipeline and the dashboard. Nothing is recorded until configure() is called,
+# so the instrumented code pays one attribute check per call when metrics are off.
+
+
+def get_metrics_path():
+    return os.getenv('METRICS_PATH')
+
+
+# Shared by every timer taken while metrics are off, so those cost no allocation.
+NULL_TIMER = nullcontext()
+
+
+class Timer:
+    def __init__(self, registry, name, labels):
+        self.registry = registry
+        self.name = name
+        self.labels = labels
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.registry.observe(self.name, time.perf_counter() - self.start, **self.labels)
+
+
+class Registry:
+    def __init__(self):
+        self.enabled = False
+        self.sink = None
+        self.lock = threading.Lock()
+        self.counters = {}
+        # (name, labels) -> [count, total seconds, max seconds]
+        self.summaries = {}
+
+    def configure(self, path=None, enabled=True):
+        # With a path, every timing is also written as a JSON line, and write_summary() adds the counters.
+        # '-' writes to stderr.
+        with self.lock:
+            if self.sink not in (None, sys.stderr):
+                self.sink.close()
+            self.sink = None
+            if path == '-':
+                self.sink = sys.stderr
+            elif path:
+                self.sink = open(path, 'a', buffering=1)
+            self.enabled = enabled or self.sink is not None
+
+    def write(self, record):
+        line = json.dumps({'ts': round(time.time(), 3), 'pid': os.getpid(), **record}, default=str)
+        with self.lock:
+            if self.sink is not None:
+                self.sink.write(line + '\n')
+
+    def increment(self, name, value=1, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def observe(self, name, seconds, **labels):
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self.lock:
+            summary = self.summaries.setdefault(key, [0, 0.0, 0.0])
+            summary[0] += 1
+            summary[1] += seconds
+            summary[2] = max(summary[2], seconds)
+        if self.sink is not None:
+            self.write({'type': 'timing', 'name': name, 'seconds': round(seconds, 6), **labels})
+
+    def timer(self, name, **labels):
+        if not self.enabled:
+            return NULL_TIMER
+        return Timer(self, name, labels)
+
+    def timed(self, name, **labels):
+        def decorator(function):
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                if not self.enabled:
+                    return function(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return function(*args, **kwargs)
+                finally:
+                    self.observe(name, time.perf_counter() - start, **labels)
+            return wrapper
+        return decorator
+
+    def timed_iter(self, iterable, name, **labels):
+        # Yields from `iterable` and, once it is used up or closed, records the total time spent waiting on it as one
+        # timing. Time the consumer spends between items isn't counted.
+        if not self.enabled:
+            yield from iterable
+            return
+        iterator = iter(iterable)
+        waited = 0.0
+        try:
+            while True:
+                start = time.perf_counter()
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    break
+                finally:
+                    waited += time.perf_counter() - start
+                yield item
+        finally:
+            self.observe(name, waited, **labels)
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.counters), {key: list(value) for key, value in self.summaries.items()}
+
+    def write_summary(self, **fields):
+        counters, summaries = self.snapshot()
+        self.write({
+            'type': 'summary', **fields,
+            'counters': [{'name': name, **dict(labels), 'value': value} for (name, labels), value in counters.items()],
+            'timings': [{'name': name, **dict(labels), 'count': count, 'seconds': round(total, 6),
+                         'max_seconds': round(longest, 6)} for (name, labels), (count, total, longest)
+                        in summaries.items()],
+        })
+
+    def prometheus_text(self):
+        counters, summaries = self.snapshot()
+        lines = []
+        for name in sorted({name for name, _ in counters}):
+            lines.append(f'# TYPE {name} counter')
+            lines += [f'{name}{format_labels(labels)} {value}' for (other, labels), value in sorted(counters.items())
+                      if other == name]
+        for name in sorted({name for name, _ in summaries}):
+            lines.append(f'# TYPE {name} summary')
+            for (other, labels), (count, total, _) in sorted(summaries.items()):
+                if other == name:
+                    lines.append(f'{name}_count{format_labels(labels)} {count}')
+                    lines.append(f'{name}_sum{format_labels(labels)} {total:.6f}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = (str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, value in labels)
+    return '{' + ','.join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + '}'
+
+
+registry = Registry()
+configure = registry.configure
+increment = registry.increment
+observe = registry.observe
+timer = registry.timer
+timed = registry.timed
+timed_iter = registry.timed_iter
+write_summary = registry.write_summary
+prometheus_text = registry.prometheus_text
@@ -0,0 +1,198 @@
+import os
+import threading
+from collections import namedtuple
+from functools import lru_cache
+import numpy as np
+import pandas as pd
+
+CATEGORY_COLUMNS = ['Region', 'District', 'Suburb', 'PropertyType']
+RANGE_COLUMNS = ['Price', 'Bedrooms', 'Bathrooms', 'StartDate', 'EndDate', 'LastUpdatedAt']
+
+Filters = namedtuple('Filters', ['drill_down', 'start_date', 'end_date', 'region', 'district', 'suburb',
+                                 'price_range', 'bedroom_range', 'bathroom_range', 'property_type'])
+
+
+def normalise_selection(value, all_label, all_in_list_means_all=True):
+    if not value or value == all_label:
+        return None
+    if isinstance(value, str):
+        value = [value]
+    if all_in_list_means_all and all_label in value:
+        return None
+    return tuple(sorted(set(value), key=str))
+
+
+def normalise_filters(drill_down, start_date, end_date, region, district, suburb, price_range, bedroom_range,
+                      bathroom_range, property_type):
+    # A hashable, canonical form of the dashboard's filter state, so equivalent selections share a cache entry.
+    return Filters(
+        drill_down=drill_down,
+        start_date=pd.Timestamp(start_date) if start_date else None,
+        end_date=pd.Timestamp(end_date) if end_date else None,
+        region=normalise_selection(region, 'All Regions'),
+        district=normalise_selection(district, 'All Districts'),
+        suburb=normalise_selection(suburb, 'All Suburbs'),
+        price_range=tuple(float(value) for value in price_range),
+        bedroom_range=tuple(float(value) for value in bedroom_range),
+        bathroom_range=tuple(float(value) for value in bathroom_range),
+        # Unlike the location dropdowns, 'All Property Types' only means everything when it is the whole selection.
+        property_type=normalise_selection(property_type, 'All Property Types', all_in_list_means_all=False),
+    )
+
+
+class CategoryIndex:
+    def __init__(self, values):
+        categorical = pd.Categorical(values)
+        self.codes = categorical.codes
+        self.lookup = {category: code for code, category in enumerate(categorical.categories)}
+        self.is_null = self.codes == -1
+
+    def isin(self, values):
+        # Index a per-category lookup table with the codes; the extra last slot catches code -1 (null).
+        table = np.zeros(len(self.lookup) + 1, dtype=bool)
+        table[[self.lookup[value] for value in values if value in self.lookup]] = True
+        return table[self.codes]
+
+
+def sort_range_column(values):
+    # NaN and NaT sort last, so the valid values are a prefix of the order.
+    values = np.asarray(values)
+    order = np.argsort(values, kind='stable')
+    return order, values[order]
+
+
+class RangeIndex:
+    def __init__(self, values, order=None, sorted_values=None):
+        values = np.asarray(values)
+        self.is_null = pd.isna(values)
+        if order is None:
+            order, sorted_values = sort_range_column(values)
+        n_valid = len(values) - int(self.is_null.sum())
+        self.positions = order[:n_valid]
+        self.sorted_values = sorted_values[:n_valid]
+
+    def _to_key(self, value):
+        if np.issubdtype(self.sorted_values.dtype, np.datetime64):
+            return np.datetime64(pd.Timestamp(value).to_datetime64(), 'ns')
+        return value
+
+    def mask(self, low=None, high=None, include_high=True):
+        start = 0 if low is None else np.searchsorted(self.sorted_values, self._to_key(low), side='left')
+        end = len(self.sorted_values) if high is None else np.searchsorted(
+            self.sorted_values, self._to_key(high), side='right' if include_high else 'left')
+        mask = np.zeros(len(self.is_null), dtype=bool)
+        mask[self.positions[start:end]] = True
+        return mask
+
+
+class LocationHierarchy:
+    # Every distinct Region/District/Suburb/PropertyType combination, in order of first appearance. Filtering this
+    # small table gives the same cascading dropdown options as filtering the full data set.
+    def __init__(self, data):
+        self.combinations = data[CATEGORY_COLUMNS].drop_duplicates().reset_index(drop=True)
+        self.options = lru_cache(maxsize=256)(self._options)
+
+    def _options(self, region, district, suburb):
+        combinations = self.combinations
+        if region is not None:
+            combinations = combinations[combinations['Region'].isin(region)]
+        districts = combinations['District'].unique()
+        if district is not None:
+            combinations = combinations[combinations['District'].isin(district)]
+        suburbs = combinations['Suburb'].unique()
+        if suburb is not None:
+            combinations = combinations[combinations['Suburb'].isin(suburb)]
+        return list(districts), list(suburbs), list(combinations['PropertyType'].unique())
+
+
+class QueryEngine:
+    # Column indexes built once per data set. filter() answers the dashboard's filter state with one pass of
+    # boolean masks and caches the matching row positions. `range_orders` maps range columns to a precomputed
+    # (order, sorted values) pair, e.g. memory-mapped from a shared store, so the columns aren't sorted again.
+    def __init__(self, data, cache_size=None, range_orders=None):
+        self.data = data
+        range_orders = range_orders or {}
+        self.categories = {column: CategoryIndex(data[column]) for column in CATEGORY_COLUMNS}
+        self.ranges = {column: RangeIndex(data[column].to_numpy(), *range_orders.get(column, ()))
+                       for column in RANGE_COLUMNS}
+        self.delisted = (data['ListingStatus'] == 'Delisted').to_numpy(dtype=bool, na_value=False)
+        self.hierarchy = LocationHierarchy(data)
+        self.first_delisted_at = data.loc[self.delisted, 'LastUpdatedAt'].min()
+        self.last_start_date = data['StartDate'].max()
+        cache_size = cache_size or int(os.getenv('DASHBOARD_QUERY_CACHE_SIZE', 16))
+        self.positions = lru_cache(maxsize=cache_size)(self._positions)
+        # Every figure callback asks for the same filter state at once; the first computes it, the rest wait for
+        # the cached result.
+        self.lock = threading.Lock()
+
+    def _positions(self, filters):
+        n = len(self.data)
+        mask = np.ones(n, dtype=bool)
+        if filters.drill_down is not None:
+            column, value = filters.drill_down
+            mask &= self.categories[column].isin([value])
+            if filters.start_date is not None:
+                mask &= self.ranges['EndDate'].mask(low=filters.start_date)
+        # Filtering from the button only bounds StartDate, as update_graphs always has.
+        if filters.end_date is not None:
+            mask &= self.ranges['StartDate'].mask(high=filters.end_date)
+        if filters.start_date is not None:
+            mask &= ~(self.ranges['LastUpdatedAt'].mask(high=filters.start_date, include_high=False) & self.delisted)
+
+        # The strict set drops rows with a null in any filtered column; the tolerant one keeps them.
+        strict = mask
+        tolerant = mask.copy()
+        for column, selection in [('Region', filters.region), ('District', filters.district),
+                                  ('Suburb', filters.suburb), ('PropertyType', filters.property_type)]:
+            if selection is not None:
+                index = self.categories[column]
+                selected = index.isin(selection)
+                strict &= selected
+                tolerant &= selected | index.is_null
+        for column, (low, high) in [('Price', filters.price_range), ('Bedrooms', filters.bedroom_range),
+                                    ('Bathrooms', filters.bathroom_range)]:
+            index = self.ranges[column]
+            selected = index.mask(low, high)
+            strict &= selected
+            tolerant &= selected | index.is_null
+        return np.flatnonzero(strict).astype(np.int32), np.flatnonzero(tolerant).astype(np.int32)
+
+    def is_full_range(self, filters):
+        # Whether the price, bedroom and bathroom ranges take in every listing that has a value.
+        for column, (low, high) in [('Price', filters.price_range), ('Bedrooms', filters.bedroom_range),
+                                    ('Bathrooms', filters.bathroom_range)]:
+            values = self.ranges[column].sorted_values
+            if len(values) and (low > values[0] or high < values[-1]):
+                return False
+        return True
+
+    def drops_delisted(self, filters):
+        return filters.start_date is not None and filters.start_date > self.first_delisted_at
+
+    def drops_unstarted(self, filters):
+        return filters.end_date is not None and filters.end_date < self.last_start_date
+
+    def location_group(self, filters):
+        # The one location level the filters select on, as (level, names, null tolerant), or None when they
+        # combine several.
+        selections = [(column, selection) for column, selection in [('Region', filters.region),
+                                                                     ('District', filters.district),
+                                                                     ('Suburb', filters.suburb)]
+                      if selection is not None]
+        if filters.drill_down is not None:
+            return None if selections else (filters.drill_down[0], (filters.drill_down[1],), False)
+        if not selections:
+            return 'All', ('All',), False
+        if len(selections) > 1:
+            return None
+        return selections[0][0], selections[0][1], True
+
+    def filter(self, filters):
+        with self.lock:
+            strict, tolerant = self.positions(filters)
+        return self.data.take(strict), self.data.take(tolerant)
+
+    def dropdown_options(self, region, district, suburb):
+        return self.hierarchy.options(normalise_selection(region, 'All Regions'),
+                                      normalise_selection(district, 'All Districts'),
+                                      normalise_selection(suburb, 'All Suburbs'))
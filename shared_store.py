@@ -0,0 +1,230 @@
+import fcntl
+import os
+import shutil
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import aggregates
+import query_engine
+import snapshot
+import utils
+
+POINTER = 'CURRENT'
+LOCK = '.lock'
+SNAPSHOT_FILE = 'dash_view.arrow'
+RANGES_FILE = 'ranges.arrow'
+# Versions are named after the newest LastUpdatedAt they hold, so they sort in publication order.
+VERSION_FORMAT = 'v%Y%m%dT%H%M%S%f'
+
+
+def get_shared_dir():
+    return os.getenv('DASHBOARD_SHARED_DIR')
+
+
+def get_version_name(data):
+    return data['LastUpdatedAt'].max().strftime(VERSION_FORMAT)
+
+
+def fetch_dash_view(supabase):
+    return pd.DataFrame(utils.fetch_table(supabase, 'dash_view'))
+
+
+def to_arrow_table(data):
+    # Floats keep NaN rather than becoming nulls, so they convert back to numpy without a copy.
+    return pa.Table.from_arrays([pa.array(data[column], from_pandas=data[column].dtype.kind != 'f')
+                                 for column in data.columns], names=list(data.columns))
+
+
+def write_arrow(table, path):
+    # A single record batch per file: chunked columns would be concatenated, i.e. copied, by every reader.
+    def write(temporary_path):
+        with pa.OSFile(temporary_path, 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table.combine_chunks(), max_chunksize=max(table.num_rows, 1))
+
+    utils.replace_atomically(path, write)
+
+
+def write_pointer(directory, name):
+    def write(temporary_path):
+        with open(temporary_path, 'w') as f:
+            f.write(name)
+
+    utils.replace_atomically(os.path.join(directory, POINTER), write)
+
+
+def map_arrow(path):
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all()
+
+
+def map_snapshot(path):
+    # Numbers, dates and category codes become views of the mapped file, and text stays in Arrow buffers, so every
+    # worker mapping the same file shares its pages.
+    return map_arrow(path).to_pandas(split_blocks=True, types_mapper={pa.string(): pd.StringDtype('pyarrow')}.get)
+
+
+def range_orders_table(data):
+    columns, names = [], []
+    for column in query_engine.RANGE_COLUMNS:
+        order, sorted_values = query_engine.sort_range_column(data[column].to_numpy())
+        # Dates are stored as int64 nanoseconds, NaT included, and viewed back as datetime64 on the way out.
+        columns += [pa.array(order), pa.array(sorted_values.view('int64') if sorted_values.dtype.kind == 'M'
+                                              else sorted_values)]
+        names += [f'{column}.order', f'{column}.sorted']
+    return pa.Table.from_arrays(columns, names=names)
+
+
+def map_range_orders(path, data):
+    table = map_arrow(path)
+    return {column: (table.column(f'{column}.order').chunk(0).to_numpy(),
+                     table.column(f'{column}.sorted').chunk(0).to_numpy().view(data[column].dtype))
+            for column in query_engine.RANGE_COLUMNS}
+
+
+class SharedVersion:
+    def __init__(self, directory, name):
+        self.name = name
+        self.path = os.path.join(directory, name)
+        self.snapshot_path = os.path.join(self.path, SNAPSHOT_FILE)
+        self.data = map_snapshot(self.snapshot_path)
+        self.range_orders = map_range_orders(os.path.join(self.path, RANGES_FILE), self.data)
+
+
+class SharedStoreLock:
+    # An exclusive flock on the store, held by whichever process is publishing a version.
+    def __init__(self, directory, blocking=True):
+        self.path = os.path.join(directory, LOCK)
+        self.blocking = blocking
+        self.file = None
+
+    def __enter__(self):
+        self.file = open(self.path, 'a')
+        try:
+            fcntl.flock(self.file, fcntl.LOCK_EX if self.blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.file.close()
+            return False
+        return True
+
+    def __exit__(self, *exc_info):
+        if not self.file.closed:
+            fcntl.flock(self.file, fcntl.LOCK_UN)
+            self.file.close()
+
+
+def read_current(directory):
+    try:
+        with open(os.path.join(directory, POINTER)) as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+
+def publish(data, directory, connect=None, keep=None):
+    # Writes a prepared dash_view, the sort order of its range columns and its aggregate tables into a new version
+    # directory, then points CURRENT at it. Workers pick the new version up on their next check.
+    keep = keep or int(os.getenv('DASHBOARD_SHARED_VERSIONS', 2))
+    name = get_version_name(data)
+    path = os.path.join(directory, name)
+    os.makedirs(path, exist_ok=True)
+    write_arrow(to_arrow_table(data), os.path.join(path, SNAPSHOT_FILE))
+    write_arrow(range_orders_table(data), os.path.join(path, RANGES_FILE))
+    if connect is not None:
+        aggregates.load_aggregate_store(connect, data, path=os.path.join(path, SNAPSHOT_FILE), refresh=True)
+    write_pointer(directory, name)
+    # Workers still on an older version keep their mappings after the files are removed.
+    versions = sorted(entry for entry in os.listdir(directory) if entry.startswith('v')
+                      and os.path.isdir(os.path.join(directory, entry)))
+    for old in versions[:-keep]:
+        if old != name:
+            shutil.rmtree(os.path.join(directory, old), ignore_errors=True)
+    print(f'Published dashboard data version {name} to {directory}')
+    return name
+
+
+def ensure_published(directory, connect, fetch_data=None):
+    # Only the first process to get here pulls dash_view; the rest find it published.
+    os.makedirs(directory, exist_ok=True)
+    with SharedStoreLock(directory):
+        name = read_current(directory)
+        if name is None or not os.path.exists(os.path.join(directory, name, SNAPSHOT_FILE)):
+            data = snapshot.prepare_dash_view((fetch_data or fetch_dash_view)(connect()))
+            name = publish(data, directory, connect)
+    return name
+
+
+def attach(directory, connect, fetch_data=None):
+    return SharedVersion(directory, ensure_published(directory, connect, fetch_data))
+
+
+def get_aggregates_stamp(version):
+    # When the version's DailyAggregates copy was last written, which is after its PriceHistogram copy.
+    daily_path, _ = aggregates.get_aggregate_paths(version.snapshot_path)
+    try:
+        return os.stat(daily_path).st_mtime_ns
+    except FileNotFoundError:
+        return None
+
+
+class SharedStoreWatcher(threading.Thread):
+    # Runs in every worker. Checks CURRENT every `swap_interval` seconds and hands a newly published version to
+    # on_swap, or the same version again when its aggregate tables have been rewritten. Every `refresh_interval`
+    # seconds, whichever worker gets the store lock first checks dash_view's newest LastUpdatedAt and publishes a
+    # new version when it has moved, or else fetches the aggregate tables again when they have been rebuilt.
+    def __init__(self, directory, connect, on_swap, version, fetch_data=None, swap_interval=None,
+                 refresh_interval=None):
+        super().__init__(daemon=True, name='shared-store-watcher')
+        self.directory = directory
+        self.connect = connect
+        self.on_swap = on_swap
+        self.version = version
+        self.fetch_data = fetch_data or fetch_dash_view
+        self.swap_interval = swap_interval or float(os.getenv('DASHBOARD_SWAP_CHECK_SECONDS', 5))
+        if refresh_interval is None:
+            refresh_interval = float(os.getenv('DASHBOARD_REFRESH_SECONDS', 600))
+        self.refresh_interval = refresh_interval
+        self.refreshed_at = time.monotonic()
+        self.aggregates_stamp = get_aggregates_stamp(version)
+
+    def check(self):
+        name = read_current(self.directory)
+        if name is not None and name != self.version.name:
+            self.version = SharedVersion(self.directory, name)
+        elif get_aggregates_stamp(self.version) == self.aggregates_stamp:
+            return False
+        self.aggregates_stamp = get_aggregates_stamp(self.version)
+        self.on_swap(self.version)
+        print(f'Swapped to dashboard data version {self.version.name}')
+        return True
+
+    def refresh(self):
+        with SharedStoreLock(self.directory, blocking=False) as locked:
+            if not locked:
+                return False
+            supabase = self.connect()
+            last_updated_at = snapshot.fetch_max_last_updated_at(supabase)
+            current = read_current(self.directory)
+            if last_updated_at is None or last_updated_at.strftime(VERSION_FORMAT) == current:
+                if current is not None and aggregates.aggregates_changed(supabase, self.snapshot_path(current)):
+                    version = SharedVersion(self.directory, current)
+                    aggregates.load_aggregate_store(self.connect, version.data, path=version.snapshot_path,
+                                                    refresh=True)
+                return False
+            publish(snapshot.prepare_dash_view(self.fetch_data(supabase)), self.directory, self.connect)
+            return True
+
+    def snapshot_path(self, name):
+        return os.path.join(self.directory, name, SNAPSHOT_FILE)
+
+    def run(self):
+        while True:
+            time.sleep(self.swap_interval)
+            try:
+                if self.refresh_interval and time.monotonic() - self.refreshed_at >= self.refresh_interval:
+                    self.refreshed_at = time.monotonic()
+                    self.refresh()
+                self.check()
+            except Exception as e:
+                print(f'Shared data check failed: {e}')
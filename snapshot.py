@@ -0,0 +1,91 @@
+import os
+import threading
+import time
+import pandas as pd
+import pyarrow as pa
+import pyarrow.feather as feather
+import utils
+
+CATEGORY_COLUMNS = ['Region', 'District', 'Suburb', 'PropertyType']
+DATE_COLUMNS = ['StartDate', 'EndDate', 'LastUpdatedAt']
+
+
+def get_snapshot_path():
+    return os.getenv('DASHBOARD_SNAPSHOT_PATH', 'dash_view.arrow')
+
+
+def fetch_latest(supabase, table, column):
+    latest = supabase.table(table).select(column).order(column, desc=True).limit(1).execute().data
+    return pd.to_datetime(latest[0][column]) if latest else None
+
+
+def fetch_max_last_updated_at(supabase):
+    return fetch_latest(supabase, 'dash_view', 'LastUpdatedAt')
+
+
+def prepare_dash_view(data):
+    data['Price'] = data['Price'] / 1000000
+    for column in DATE_COLUMNS:
+        data[column] = pd.to_datetime(data[column])
+    for column in CATEGORY_COLUMNS:
+        data[column] = data[column].astype('category')
+    return data
+
+
+def write_snapshot(data, path):
+    utils.replace_atomically(path, lambda temporary_path: feather.write_feather(data, temporary_path,
+                                                                               compression='uncompressed'))
+
+
+def read_snapshot(path):
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).read_all().to_pandas()
+
+
+def load_dash_view(connect, fetch_data, path=None):
+    path = path or get_snapshot_path()
+    if os.path.exists(path):
+        print(f'Loading dashboard data from snapshot {path}')
+        return read_snapshot(path)
+    data = prepare_dash_view(fetch_data(connect()))
+    write_snapshot(data, path)
+    return data
+
+
+class SnapshotRefresher(threading.Thread):
+    # Polls the newest LastUpdatedAt in dash_view and, when it moves, pulls the view again, rewrites the
+    # snapshot and hands the new frame to on_refresh. On every poll that doesn't, refresh_aggregates (if given) is
+    # called with the client to check for aggregate tables published since.
+    def __init__(self, connect, fetch_data, on_refresh, last_updated_at, path=None, interval=None,
+                 refresh_aggregates=None):
+        super().__init__(daemon=True, name='snapshot-refresher')
+        self.connect = connect
+        self.fetch_data = fetch_data
+        self.on_refresh = on_refresh
+        self.refresh_aggregates = refresh_aggregates
+        self.last_updated_at = last_updated_at
+        self.path = path or get_snapshot_path()
+        self.interval = interval or float(os.getenv('DASHBOARD_REFRESH_SECONDS', 600))
+
+    def refresh(self, supabase):
+        last_updated_at = fetch_max_last_updated_at(supabase)
+        if last_updated_at is None or last_updated_at == self.last_updated_at:
+            if self.refresh_aggregates is not None:
+                self.refresh_aggregates(supabase)
+            return False
+        data = prepare_dash_view(self.fetch_data(supabase))
+        write_snapshot(data, self.path)
+        self.last_updated_at = last_updated_at
+        self.on_refresh(data)
+        print(f'Refreshed dashboard snapshot to {last_updated_at}')
+        return True
+
+    def run(self):
+        supabase = None
+        while True:
+            try:
+                supabase = supabase or self.connect()
+                self.refresh(supabase)
+            except Exception as e:
+                print(f'Snapshot refresh failed: {e}')
+            time.sleep(self.interval)
@@ -0,0 +1,82 @@
+import numpy as np
+
+BLOCK_SIZE = 512
+
+
+def active_day_spans(start_dates, end_dates, dates):
+    # For each listing, the half-open range [first, last) of positions in dates with start <= date <= end.
+    dates = np.asarray(dates, dtype='datetime64[ns]')
+    start_dates = np.asarray(start_dates, dtype='datetime64[ns]')
+    end_dates = np.asarray(end_dates, dtype='datetime64[ns]')
+    first = np.searchsorted(dates, start_dates, side='left')
+    last = np.searchsorted(dates, end_dates, side='right')
+    # NaT sorts after every date, but never compares as active.
+    last[np.isnat(start_dates) | np.isnat(end_dates)] = 0
+    return first, last
+
+
+def count_active(first, last, n_dates):
+    events = np.bincount(first[first < last], minlength=n_dates + 1)
+    events -= np.bincount(last[first < last], minlength=n_dates + 1)
+    return np.cumsum(events)[:n_dates]
+
+
+def daily_listing_counts(data, dates):
+    # Same as counting, for every date, listings that are Listed and running on that date, plus Delisted ones that
+    # were running and hadn't been delisted yet. A delisted listing is therefore active until min(EndDate,
+    # LastUpdatedAt).
+    end_dates = data['EndDate'].to_numpy(dtype='datetime64[ns]')
+    last_updated_at = data['LastUpdatedAt'].to_numpy(dtype='datetime64[ns]')
+    # na_value: ListingStatus may be a nullable string column when mapped from the shared store.
+    delisted = (data['ListingStatus'] == 'Delisted').to_numpy(dtype=bool, na_value=False)
+    listed = (data['ListingStatus'] == 'Listed').to_numpy(dtype=bool, na_value=False)
+    end_dates = np.where(delisted & ~(last_updated_at >= end_dates), last_updated_at, end_dates)
+    end_dates[~listed & ~delisted] = np.datetime64('NaT')
+    first, last = active_day_spans(data['StartDate'], end_dates, dates)
+    return count_active(first, last, len(dates))
+
+
+def daily_median_prices(data, dates):
+    # Median price of the listings running on each date. Listings are ranked by price once; a sweep over the dates
+    # adds and removes them from per-rank counts, and each median is found through per-block totals, so a date
+    # costs O(sqrt(n)) instead of a scan of every listing.
+    prices = data['Price'].to_numpy(dtype=float)
+    has_price = ~np.isnan(prices)
+    first, last = active_day_spans(data['StartDate'].to_numpy()[has_price], data['EndDate'].to_numpy()[has_price],
+                                   dates)
+    order = np.argsort(prices[has_price], kind='stable')
+    sorted_prices = prices[has_price][order]
+    first, last = first[order], last[order]
+    ranks = np.flatnonzero(first < last)
+    n_dates = len(dates)
+    # One group per date position, plus a final one for listings still running after the last date.
+    added_by_date = np.split(ranks[np.argsort(first[ranks], kind='stable')],
+                             np.searchsorted(np.sort(first[ranks]), np.arange(1, n_dates + 1)))
+    removed_by_date = np.split(ranks[np.argsort(last[ranks], kind='stable')],
+                               np.searchsorted(np.sort(last[ranks]), np.arange(1, n_dates + 1)))
+
+    active = np.zeros(len(sorted_prices), dtype=np.int32)
+    n_blocks = len(sorted_prices) // BLOCK_SIZE + 1
+    block_counts = np.zeros(n_blocks, dtype=np.int64)
+    n_active = 0
+
+    def kth_smallest(k, block_totals):
+        block = np.searchsorted(block_totals, k, side='right')
+        offset = k - (block_totals[block - 1] if block else 0)
+        within = np.cumsum(active[block * BLOCK_SIZE:(block + 1) * BLOCK_SIZE])
+        return sorted_prices[block * BLOCK_SIZE + np.searchsorted(within, offset, side='right')]
+
+    medians = np.full(n_dates, np.nan)
+    for i in range(n_dates):
+        added, removed = added_by_date[i], removed_by_date[i]
+        active[added] += 1
+        active[removed] -= 1
+        block_counts += np.bincount(added // BLOCK_SIZE, minlength=n_blocks)
+        block_counts -= np.bincount(removed // BLOCK_SIZE, minlength=n_blocks)
+        n_active += len(added) - len(removed)
+        if n_active == 0:
+            continue
+        block_totals = np.cumsum(block_counts)
+        upper = kth_smallest(n_active // 2, block_totals)
+        medians[i] = upper if n_active % 2 else (kth_smallest(n_active // 2 - 1, block_totals) + upper) / 2
+    return medians
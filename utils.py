@@ -1,7 +1,13 @@
 from supabase import create_client
 import os
+import time
+import threading
+import httpx
 import keyring
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
+from postgrest.exceptions import APIError
+import metrics
 
 try:
     # load_dotenv('config.env')
@@ -26,3 +32,126 @@ def connect_to_supabase():
     SUPABASE_API_KEY, SUPABASE_API_URL = get_supabase_credentials()
     supabase = create_client(SUPABASE_API_URL, SUPABASE_API_KEY)
     return supabase
+
+
+class BulkUpsertReport:
+    def __init__(self, table, rows_written, rows_failed, failed_batch_ids, elapsed):
+        self.table = table
+        self.rows_written = rows_written
+        self.rows_failed = rows_failed
+        self.failed_batch_ids = failed_batch_ids
+        self.elapsed = elapsed
+
+    @property
+    def rows_per_second(self):
+        return self.rows_written / self.elapsed if self.elapsed else 0.0
+
+    def __str__(self):
+        summary = (f'Upserted {self.rows_written} rows into {self.table} in {self.elapsed:.1f}s '
+                   f'({self.rows_per_second:.0f} rows/s)')
+        if self.failed_batch_ids:
+            summary += f'. {self.rows_failed} rows in failed batches {self.failed_batch_ids}'
+        return summary
+
+
+class BulkUpserter:
+    # Splits rows into batches and upserts them from a small thread pool, retrying each batch with backoff.
+    # Rows can be submitted in several goes, e.g. one TradeMe page at a time; close() waits and reports.
+    def __init__(self, supabase, table, on_conflict='', batch_size=None, max_workers=None, max_retries=None,
+                 backoff=1.0):
+        self.supabase = supabase
+        self.table = table
+        self.on_conflict = on_conflict
+        self.batch_size = batch_size or int(os.getenv('SUPABASE_BATCH_SIZE', 500))
+        max_workers = max_workers or int(os.getenv('SUPABASE_MAX_WORKERS', 4))
+        self.max_retries = max_retries if max_retries is not None else int(os.getenv('SUPABASE_MAX_RETRIES', 3))
+        self.backoff = backoff
+        self.executor = ThreadPoolExecutor(max_workers=max_workers)
+        # Bound the queue so a fast producer can't pile the whole data set up in memory.
+        self.slots = threading.BoundedSemaphore(2 * max_workers)
+        self.lock = threading.Lock()
+        self.futures = {}
+        self.rows_written = 0
+        self.started_at = time.perf_counter()
+
+    def submit(self, rows):
+        batch_ids = []
+        for start in range(0, len(rows), self.batch_size):
+            self.slots.acquire()
+            batch_id = len(self.futures)
+            batch = rows[start:start + self.batch_size]
+            future = self.executor.submit(self._upsert_batch, batch_id, batch)
+            future.add_done_callback(lambda _: self.slots.release())
+            self.futures[batch_id] = (future, len(batch))
+            batch_ids.append(batch_id)
+        return batch_ids
+
+    def _upsert_batch(self, batch_id, batch):
+        for attempt in range(self.max_retries + 1):
+            try:
+                with metrics.timer('supabase_upsert_seconds', table=self.table):
+                    self.supabase.table(self.table).upsert(batch, on_conflict=self.on_conflict).execute()
+                break
+            except (APIError, httpx.HTTPError) as e:
+                if attempt == self.max_retries:
+                    print(f'Batch {batch_id} of {self.table} failed after {attempt + 1} attempts: {e}')
+                    metrics.increment('supabase_rows_failed_total', len(batch), table=self.table)
+                    raise
+                metrics.increment('supabase_retries_total', table=self.table)
+                delay = self.backoff * 2 ** attempt
+                print(f'Batch {batch_id} of {self.table} failed: {e}. Retrying in {delay:.1f}s')
+                time.sleep(delay)
+        with self.lock:
+            self.rows_written += len(batch)
+        metrics.increment('supabase_rows_upserted_total', len(batch), table=self.table)
+
+    def finished(self, batch_ids):
+        return all(self.futures[batch_id][0].done() for batch_id in batch_ids)
+
+    def succeeded(self, batch_ids):
+        # Only meaningful once the batches have finished.
+        return all(self.futures[batch_id][0].exception() is None for batch_id in batch_ids)
+
+    def close(self):
+        self.executor.shutdown(wait=True)
+        failed = [(batch_id, size) for batch_id, (future, size) in self.futures.items() if future.exception()]
+        return BulkUpsertReport(self.table, self.rows_written, sum(size for _, size in failed),
+                                [batch_id for batch_id, _ in failed], time.perf_counter() - self.started_at)
+
+
+def upsert_in_batches(supabase, table, rows, on_conflict='', **kwargs):
+    upserter = BulkUpserter(supabase, table, on_conflict, **kwargs)
+    upserter.submit(rows)
+    report = upserter.close()
+    print(report)
+    return report
+
+
+def fetch_table(supabase, table, columns='*', order=('ListingId',), page_size=None):
+    page_size = page_size or int(os.getenv('SUPABASE_PAGE_SIZE', 1000))
+    rows = []
+    # PostgREST caps a select at 1000 rows, so page through the table, ordered by a unique key so pages don't
+    # overlap.
+    while True:
+        query = supabase.table(table).select(columns)
+        for column in order:
+            query = query.order(column)
+        page = query.range(len(rows), len(rows) + page_size - 1).execute().data
+        if not page:
+            break
+        rows.extend(page)
+        metrics.increment('supabase_rows_read_total', len(page), table=table)
+    return rows
+
+
+def replace_atomically(path, write):
+    # Calls write() with a temporary path next to `path` and renames the result over it, so readers only ever see
+    # a complete file. The leading dot keeps dataset readers from picking the temporary file up.
+    directory, name = os.path.split(path)
+    temporary_path = os.path.join(directory, f'.{name}.{os.getpid()}.{threading.get_ident()}.tmp')
+    try:
+        write(temporary_path)
+        os.replace(temporary_path, path)
+    finally:
+        if os.path.exists(temporary_path):
+            os.remove(temporary_path)